@@ -0,0 +1,120 @@
+"""
+Throughput and event loop lag of Google Fit step fetches, the old way versus
+through services.google_fit.
+
+Both paths are served the recorded responses in data/google_fit_recordings.json
+with the same simulated network latency per request. The old path builds a
+googleapiclient service per request (fetching the discovery document, or with
+--static-discovery reading the copy bundled with the library) and runs the
+blocking execute() on the event loop; the new path awaits the cached client
+over the shared connection pool. A ticker coroutine measures how long the
+event loop is kept from running other work.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_google_fit --requests 200 --concurrency 20 --latency 0.05
+"""
+import json
+import time
+import asyncio
+import argparse
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from services.google_fit import GoogleFitAPI, RecordedFitnessTransport, DiscoveryDocument, DISCOVERY_URL
+
+BODY = {
+    "aggregateBy": [{"dataTypeName": "com.google.step_count.delta"}],
+    "bucketByTime": {"durationMillis": 86400000},
+    "startTimeMillis": 1760745600000,
+    "endTimeMillis": 1761350400000
+}
+
+
+class RecordedHttp:
+    """httplib2.Http stand-in for googleapiclient, replaying the recordings with blocking latency."""
+
+    def __init__(self, transport, latency):
+        self.transport = transport
+        self.latency = latency
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        time.sleep(self.latency)
+        if uri.startswith(DISCOVERY_URL.split("/rest")[0]):
+            return httplib2.Response({"status": "200"}), json.dumps(self.transport.recordings["discovery"]).encode()
+        return httplib2.Response({"status": "200"}), json.dumps(self.transport._aggregate(json.loads(body))).encode()
+
+
+async def ticker(lags, stop):
+    """Record how late each 5 ms sleep wakes up."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - started - 0.005)
+
+
+async def run(label, fetch, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        async with semaphore:
+            response = await fetch(index)
+            assert len(response["bucket"]) == 7
+
+    await fetch(-1)  # Warm up
+    lags, stop = [], asyncio.Event()
+    ticking = asyncio.create_task(ticker(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticking
+    lags.sort()
+    print(f"{label:<34}{requests / elapsed:>10.1f}{elapsed * 1000 / requests:>14.2f}"
+          f"{lags[len(lags) // 2] * 1000:>14.1f}{lags[-1] * 1000:>12.1f}")
+
+
+async def main_async(args):
+    transport = RecordedFitnessTransport(latency=args.latency)
+    http = RecordedHttp(transport, args.latency)
+
+    def old_fetch(static_discovery):
+        async def fetch(index):
+            Credentials(token=f"token-{index}", refresh_token=f"refresh-{index % args.users}",
+                        token_uri="https://oauth2.googleapis.com/token", client_id="id", client_secret="secret")
+            service = build("fitness", "v1", http=http, static_discovery=static_discovery, cache_discovery=False)
+            return service.users().dataset().aggregate(userId="me", body=BODY).execute()
+        return fetch
+
+    api = GoogleFitAPI(transport=transport, discovery=DiscoveryDocument(path=None))
+
+    async def new_fetch(index):
+        return await api.aggregate({"access_token": f"token-{index}",
+                                    "refresh_token": f"refresh-{index % args.users}"}, BODY)
+
+    print(f"{'path':<34}{'req/s':>10}{'ms per req':>14}{'lag p50 ms':>14}{'lag max':>12}")
+    if not args.static_discovery:
+        await run("build + execute (fetch discovery)", old_fetch(False), args.requests, args.concurrency)
+    await run("build + execute (static doc)", old_fetch(True), args.requests, args.concurrency)
+    await run("cached client, async", new_fetch, args.requests, args.concurrency)
+    metrics = api.get_metrics()
+    print(f"new path: {metrics['clients']['hits']} client cache hits, "
+          f"{metrics['discovery_fetches']} discovery fetch, {metrics['avg_latency_ms']} ms avg per call")
+    await api.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Google Fit step fetches")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20, help="Distinct credentials among the requests")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated network latency in seconds")
+    parser.add_argument("--static-discovery", action="store_true",
+                        help="Only run the old path with the discovery document bundled with googleapiclient")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
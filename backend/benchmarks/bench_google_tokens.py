@@ -0,0 +1,103 @@
+"""
+Token endpoint calls, wall time and event loop lag when many users' Google
+access tokens expire together, the old way versus through TokenManager.
+
+Every user sends --requests-per-user concurrent step requests with an access
+token about to expire. The old path rebuilds a google-auth Credentials object
+per request and refreshes it with a blocking HTTP call on the event loop; the
+new path asks the token manager, which refreshes each user once over the
+pooled async client. Both token endpoints answer after the same simulated
+latency.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_google_tokens --users 50 --requests-per-user 10 --latency 0.05
+"""
+import json
+import time
+import asyncio
+import argparse
+
+from google.oauth2.credentials import Credentials
+
+from services.google_fit import GoogleFitAPI, RecordedFitnessTransport, DiscoveryDocument, TOKEN_URI
+
+
+class BlockingTokenEndpoint:
+    """google.auth.transport.Request stand-in answering refreshes after a blocking sleep."""
+
+    class Response:
+        status = 200
+        headers = {"content-type": "application/json"}
+
+        def __init__(self):
+            self.data = json.dumps({"access_token": "fresh", "expires_in": 3599, "token_type": "Bearer"}).encode()
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self.Response()
+
+
+async def ticker(lags, stop):
+    """Record how late each 5 ms sleep wakes up."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        lags.append(time.perf_counter() - started - 0.005)
+
+
+async def run(label, get_token, calls, args):
+    lags, stop = [], asyncio.Event()
+    ticking = asyncio.create_task(ticker(lags, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        get_token(user) for user in range(args.users) for _ in range(args.requests_per_user)
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticking
+    print(f"{label:<30}{calls():>14}{elapsed * 1000:>12.0f}{max(lags) * 1000:>14.1f}")
+
+
+async def main_async(args):
+    expires_at = int(time.time()) + 10
+
+    endpoint = BlockingTokenEndpoint(args.latency)
+
+    async def old_get_token(user):
+        credentials = Credentials(token="stale", refresh_token=f"refresh-{user}", token_uri=TOKEN_URI,
+                                  client_id="id", client_secret="secret")
+        credentials.refresh(endpoint)
+        return credentials.token
+
+    api = GoogleFitAPI(transport=RecordedFitnessTransport(latency=args.latency),
+                       discovery=DiscoveryDocument(path=None))
+
+    async def new_get_token(user):
+        token = await api.tokens.get_token(
+            {"access_token": "stale", "refresh_token": f"refresh-{user}", "expires_at": expires_at}
+        )
+        return token["access_token"]
+
+    print(f"{args.users} users x {args.requests_per_user} concurrent requests, tokens expiring in 10 s")
+    print(f"{'path':<30}{'token calls':>14}{'wall ms':>12}{'max lag ms':>14}")
+    await run("google-auth refresh, blocking", old_get_token, lambda: endpoint.calls, args)
+    await run("TokenManager, single-flight", new_get_token, lambda: api.tokens.refreshes, args)
+    await api.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Google token refresh storms")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests-per-user", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated token endpoint latency in seconds")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
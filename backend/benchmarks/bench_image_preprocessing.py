@@ -0,0 +1,125 @@
+"""
+Payload size and end-to-end latency of /api/compounder/analyze-report uploads,
+sent as they are versus pre-processed.
+
+A synthetic 12-megapixel phone photo of a printed page (or the given image) is
+analyzed through analyze_medical_report() with a stub model whose response time
+is a fixed inference time plus the upload time of the request body at the given
+bandwidth. Also reports the vision tokens the image costs at detail "high".
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_image_preprocessing --runs 5 --bandwidth-mbps 20
+"""
+import io
+import json
+import math
+import time
+import asyncio
+import argparse
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import services.ai_compounder as ai_compounder
+from services.image_preprocessing import ImagePreprocessor, sniff_mime_type
+from services.report_dedup import ReportAnalysisCache
+from services.llm_gateway import set_llm_backend, close_llm_gateway
+
+EXIF_ORIENTATION = 0x0112
+
+
+def synthetic_report(width=4032, height=3024):
+    """JPEG of a camera shot of a text page: sensor noise, uneven light, rotated by EXIF like a phone photo."""
+    rng = np.random.default_rng(0)
+    shading = np.linspace(170, 235, width, dtype=np.float32)[None, :, None]
+    pixels = shading + rng.normal(0, 8, size=(height, width, 3)).astype(np.float32)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for row in range(120, height - 120, 60):
+        for column in range(150, width - 300, 260):
+            draw.rectangle([column, row, column + int(rng.integers(80, 240)), row + 24], fill=(40, 40, 50))
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=92, exif=exif)
+    return buffer.getvalue()
+
+
+def vision_tokens(width, height):
+    """OpenAI's published cost of an image at detail "high"."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+class UploadTimedBackend:
+    """Stub model that takes `inference` seconds plus the time to upload the request body."""
+
+    def __init__(self, inference, bandwidth_mbps):
+        self.inference = inference
+        self.bytes_per_second = bandwidth_mbps * 1e6 / 8
+
+    async def complete(self, model, messages, response_format=None, timeout=None):
+        body = json.dumps({"model": model, "messages": messages})
+        await asyncio.sleep(self.inference + len(body) / self.bytes_per_second)
+        return json.dumps({"summary": "ok", "medications": [], "recommendations": "", "concerns": ""})
+
+    async def aclose(self):
+        pass
+
+
+class Passthrough:
+    """The old path: send the upload as it is."""
+
+    async def process(self, data):
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+        return {"data": data, "mime_type": sniff_mime_type(data), "width": width, "height": height}
+
+
+async def run(label, preprocessor, data, runs):
+    # Analyze every run; repeat uploads would otherwise be answered from the report cache
+    ai_compounder.report_analysis_cache = ReportAnalysisCache(enabled=False, preprocessor=preprocessor)
+    await ai_compounder.analyze_medical_report(data)  # Warm up the worker pool
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = await ai_compounder.analyze_medical_report(data)
+        latencies.append(time.perf_counter() - started)
+    image = response["image"]
+    payload = math.ceil(image["sent_size"] / 3) * 4
+    tokens = vision_tokens(image["width"], image["height"])
+    dimensions = f"{image['width']}x{image['height']}"
+    print(f"{label:<26}{dimensions:>11}{payload / 1024:>13.0f}{tokens:>8}"
+          f"{image.get('preprocess_ms') or 0:>15.1f}{sorted(latencies)[len(latencies) // 2] * 1000:>12.0f}")
+
+
+async def main_async(args):
+    data = open(args.image, "rb").read() if args.image else synthetic_report()
+    set_llm_backend(UploadTimedBackend(args.inference, args.bandwidth_mbps))
+
+    print(f"{'mode':<26}{'size':>11}{'payload KiB':>13}{'tokens':>8}{'preprocess ms':>15}{'median ms':>12}")
+    await run("raw upload", Passthrough(), data, args.runs)
+    await run("jpeg q85", ImagePreprocessor(output_format="jpeg", quality=85), data, args.runs)
+    await run("webp q80", ImagePreprocessor(output_format="webp", quality=80), data, args.runs)
+    await run("document (gray+contrast)", ImagePreprocessor(output_format="jpeg", quality=80, grayscale=True,
+                                                          enhance_contrast=True), data, args.runs)
+    await run("document, max 1536", ImagePreprocessor(max_dimension=1536, output_format="jpeg", quality=80,
+                                                    grayscale=True, enhance_contrast=True), data, args.runs)
+    await close_llm_gateway()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark report image pre-processing")
+    parser.add_argument("--image", help="Image to upload (defaults to a synthetic 12 MP report photo)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--inference", type=float, default=0.0, help="Simulated model time in seconds")
+    parser.add_argument("--bandwidth-mbps", type=float, default=20.0, help="Simulated upload bandwidth")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
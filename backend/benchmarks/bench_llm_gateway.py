@@ -0,0 +1,75 @@
+"""
+Offline throughput benchmark for the shared LLM gateway.
+
+Runs a burst of chat completions against the stub backend and reports calls per
+second and event loop lag for several concurrency limits. No network access or
+OpenAI key is needed.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_llm_gateway --calls 200 --latency 0.2
+"""
+import time
+import asyncio
+import argparse
+
+from services.llm_gateway import LLMGateway, StubBackend
+
+
+async def measure_loop_lag(stop, samples, interval=0.01):
+    """Record how late the event loop wakes up a periodic timer."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+async def run(calls, latency, concurrency):
+    gateway = LLMGateway(StubBackend(latency=latency), max_concurrency=concurrency)
+    messages = [{"role": "user", "content": "benchmark"}]
+
+    stop = asyncio.Event()
+    lag_samples = []
+    lag_task = asyncio.create_task(measure_loop_lag(stop, lag_samples))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(gateway.chat_completion_json(messages) for _ in range(calls)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    await gateway.aclose()
+
+    max_lag = max(lag_samples) * 1000 if lag_samples else 0.0
+    return elapsed, calls / elapsed, max_lag
+
+
+def blocking_baseline(calls, latency):
+    """The pre-gateway behaviour: each call blocks the thread for the full round trip."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        time.sleep(latency)
+    elapsed = time.perf_counter() - started
+    return elapsed, calls / elapsed, latency * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the async LLM gateway with a stub backend")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated model latency in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--baseline-calls", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'mode':<22}{'calls':>8}{'seconds':>10}{'calls/s':>10}{'max loop lag ms':>18}")
+
+    elapsed, rate, lag = blocking_baseline(args.baseline_calls, args.latency)
+    print(f"{'blocking client':<22}{args.baseline_calls:>8}{elapsed:>10.2f}{rate:>10.1f}{lag:>18.1f}")
+
+    for concurrency in args.concurrency:
+        elapsed, rate, lag = asyncio.run(run(args.calls, args.latency, concurrency))
+        label = f"gateway (limit {concurrency})"
+        print(f"{label:<22}{args.calls:>8}{elapsed:>10.2f}{rate:>10.1f}{lag:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
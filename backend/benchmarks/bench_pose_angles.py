@@ -0,0 +1,90 @@
+"""
+Microbenchmark of joint angle computation.
+
+Compares the previous per-point path (three Python lists per angle converted to
+NumPy arrays by calc_angle, landmarks looked up through PoseLandmark.X.value)
+against one landmark-to-array conversion plus the vectorized kernel, for a
+single frame and for an N-frame batch. Also checks both paths agree.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_pose_angles --frames 2000
+"""
+import time
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+import mediapipe as mp
+
+from services.pose_angles import JOINT_ANGLES, landmarks_to_array, compute_angles
+
+PoseLandmark = mp.solutions.pose.PoseLandmark
+
+
+def calc_angle(x, y, z):
+    """The previous per-call implementation."""
+    x = np.array(x)
+    y = np.array(y)
+    z = np.array(z)
+    radians = np.arctan2(z[1] - y[1], z[0] - y[0]) - np.arctan2(x[1] - y[1], x[0] - y[0])
+    angle = np.abs(radians * 180.0 / np.pi)
+    if angle > 180.0:
+        angle = 360 - angle
+    return angle
+
+
+def legacy_angles(landmarks):
+    """Every joint angle the way the recognise_* methods used to build them."""
+    angles = []
+    for _, (first, vertex, last) in JOINT_ANGLES:
+        points = []
+        for index in (first, vertex, last):
+            landmark = PoseLandmark(index)
+            points.append([landmarks[landmark.value].x, landmarks[landmark.value].y])
+        angles.append(calc_angle(*points))
+    return angles
+
+
+def make_frames(frames):
+    rng = np.random.default_rng(0)
+    batch = rng.random((frames, 33, 3), dtype=np.float32)
+    pose_landmarks = [
+        SimpleNamespace(landmark=[SimpleNamespace(x=float(x), y=float(y), z=float(z)) for x, y, z in frame])
+        for frame in batch
+    ]
+    return batch, pose_landmarks
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-point calc_angle against the vectorized kernel")
+    parser.add_argument("--frames", type=int, default=2000)
+    args = parser.parse_args()
+
+    batch, pose_landmarks = make_frames(args.frames)
+
+    legacy_time, legacy = timed(lambda: [legacy_angles(p.landmark) for p in pose_landmarks])
+    frame_time, per_frame = timed(lambda: [compute_angles(landmarks_to_array(p)) for p in pose_landmarks])
+    batch_time, batched = timed(lambda: compute_angles(batch))
+
+    max_error = max(
+        float(np.max(np.abs(np.array(legacy) - np.array(per_frame)))),
+        float(np.max(np.abs(np.array(legacy) - batched)))
+    )
+
+    joints = len(JOINT_ANGLES)
+    print(f"{args.frames} frames x {joints} joints, max difference from legacy path: {max_error:.4f} degrees")
+    print(f"{'path':<34}{'us/frame':>12}{'speedup':>10}")
+    for label, elapsed in (("per-point calc_angle", legacy_time),
+                           ("array + kernel, per frame", frame_time),
+                           ("kernel over batch", batch_time)):
+        print(f"{label:<34}{elapsed / args.frames * 1e6:>12.2f}{legacy_time / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
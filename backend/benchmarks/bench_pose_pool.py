@@ -0,0 +1,79 @@
+"""
+Frames-per-second benchmark for pose estimation on /api/gymtrainer/process-frame.
+
+Compares the old behaviour (a new mp_pose.Pose context per frame) against the
+persistent PosePool, reporting frames per second and frames per second per core.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_pose_pool --frames 100 --image squat.jpg
+"""
+import os
+import time
+import asyncio
+import argparse
+
+import cv2
+import numpy as np
+
+from services.pose_pool import PosePool, decode_frame, mp_pose
+
+
+def load_frame_bytes(path, width=640, height=480):
+    """Return JPEG bytes of the given image, or of a synthetic frame if no image is given."""
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    ok, encoded = cv2.imencode(".jpg", frame)
+    return encoded.tobytes()
+
+
+def bench_per_frame_context(frame_bytes, frames):
+    """Old path: open a fresh Pose graph for every frame."""
+    started = time.perf_counter()
+    for _ in range(frames):
+        with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
+            pose.process(decode_frame(frame_bytes))
+    return frames / (time.perf_counter() - started)
+
+
+async def bench_pool(frame_bytes, frames, workers):
+    """New path: one session per worker, all sending frames concurrently."""
+    pool = PosePool(size=workers, max_estimators=workers)
+    pool.start()
+    keys = [f"session-{i}" for i in range(workers)]
+    # Warm up every session's estimator so graph start-up is not counted
+    await asyncio.gather(*(pool.process(key, frame_bytes) for key in keys))
+
+    async def session(key, count):
+        for _ in range(count):
+            await pool.process(key, frame_bytes)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(key, frames) for key in keys))
+    elapsed = time.perf_counter() - started
+    pool.close()
+    return frames * workers / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-frame Pose contexts against the pose pool")
+    parser.add_argument("--frames", type=int, default=50, help="Frames per session")
+    parser.add_argument("--image", help="Image to use as the frame (defaults to a synthetic frame)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    frame_bytes = load_frame_bytes(args.image)
+
+    print(f"{'mode':<28}{'cores':>6}{'fps':>10}{'fps/core':>10}")
+    fps = bench_per_frame_context(frame_bytes, args.frames)
+    print(f"{'Pose context per frame':<28}{1:>6}{fps:>10.1f}{fps:>10.1f}")
+
+    for workers in sorted(set(args.workers)):
+        fps = asyncio.run(bench_pool(frame_bytes, args.frames, workers))
+        print(f"{'pose pool':<28}{workers:>6}{fps:>10.1f}{fps / workers:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
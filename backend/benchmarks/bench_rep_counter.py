@@ -0,0 +1,65 @@
+"""
+Throughput benchmark of the table-driven rep counter across many sessions.
+
+Steps N concurrent sessions of one exercise frame by frame, either one session
+at a time (scalar path) or all sessions in a single step_many() call, and
+reports session-frames per second.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_rep_counter --sessions 500 --frames 200
+"""
+import time
+import argparse
+
+import numpy as np
+
+from services.gym_sessions import SessionState
+from services.pose_angles import compute_features
+from services.rep_counter import exercise_registry
+
+
+def make_trajectories(sessions, frames):
+    """Random-walk landmark tracks, one per session."""
+    rng = np.random.default_rng(0)
+    start = rng.random((sessions, 1, 33, 3))
+    walk = np.cumsum(rng.normal(0, 0.05, (sessions, frames, 33, 3)), axis=1)
+    return (start + walk).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scalar and batched rep counter steps")
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--exercise", type=int, default=1)
+    args = parser.parse_args()
+
+    exercise = exercise_registry.get(args.exercise)
+    tracks = make_trajectories(args.sessions, args.frames)
+    features = compute_features(tracks)  # (sessions, frames, F)
+    total = args.sessions * args.frames
+
+    scalar_sessions = [SessionState(f"user-{i}") for i in range(args.sessions)]
+    started = time.perf_counter()
+    for frame in range(args.frames):
+        for session, row in zip(scalar_sessions, features[:, frame]):
+            exercise.step(session, row)
+    scalar_time = time.perf_counter() - started
+
+    batched_sessions = [SessionState(f"user-{i}") for i in range(args.sessions)]
+    started = time.perf_counter()
+    for frame in range(args.frames):
+        exercise.step_many(batched_sessions, features[:, frame])
+    batched_time = time.perf_counter() - started
+
+    agree = all(
+        a.exercise_counters == b.exercise_counters and a.state == b.state
+        for a, b in zip(scalar_sessions, batched_sessions)
+    )
+    print(f"{exercise.name}: {args.sessions} sessions x {args.frames} frames, results agree: {agree}")
+    print(f"{'path':<26}{'session-frames/s':>18}{'us/session-frame':>18}")
+    for label, elapsed in (("scalar step per session", scalar_time), ("batched step_many", batched_time)):
+        print(f"{label:<26}{total / elapsed:>18.0f}{elapsed / total * 1e6:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
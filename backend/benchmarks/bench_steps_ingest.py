@@ -0,0 +1,133 @@
+"""
+Rows per second of backfilling daily steps: one /save-steps request per day
+versus /ingest with NDJSON, columnar JSON lists or columnar base64 int32.
+
+Requests go through the steps router in-process. By default the database
+only counts the writes, so the numbers are the HTTP, parsing, validation and
+batching cost of each path; pass --mongodb-uri to write to a real server.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_steps_ingest --users 100 --days 365
+"""
+import json
+import time
+import base64
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import steps
+from database.mongodb import get_db
+
+
+class CountingCollection:
+    """Accepts writes without storing them; reads find nothing."""
+
+    def __init__(self):
+        self.documents = 0
+
+    def find(self, *args, **kwargs):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+    async def insert_one(self, document):
+        self.documents += 1
+        return SimpleNamespace(inserted_id=None)
+
+    async def bulk_write(self, requests, ordered=True):
+        self.documents += len(requests)
+        return SimpleNamespace(upserted_count=len(requests), modified_count=0)
+
+
+class CountingDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        return self.collections.setdefault(name, CountingCollection())
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def history(users, days):
+    rng = np.random.default_rng(0)
+    start = np.datetime64("2025-01-01")
+    dates = (start + np.arange(days)).astype(str).tolist()
+    return dates, rng.integers(0, 25000, size=(users, days), dtype=np.int32)
+
+
+def run(label, client, requests, rows):
+    started = time.perf_counter()
+    for body, headers, path in requests:
+        response = client.post(path, content=body, headers=headers)
+        assert response.status_code == 200, response.text
+    elapsed = time.perf_counter() - started
+    size = sum(len(body) for body, _, _ in requests)
+    print(f"{label:<28}{len(requests):>10}{size / 1024:>12.0f}{elapsed:>10.2f}{rows / elapsed:>14,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk steps ingestion")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--single-row-users", type=int, default=5,
+                        help="Users sent one request per day (the old path is slow)")
+    parser.add_argument("--mongodb-uri", help="Write to this MongoDB instead of counting writes")
+    args = parser.parse_args()
+
+    if args.mongodb_uri:
+        import motor.motor_asyncio
+        db = motor.motor_asyncio.AsyncIOMotorClient(args.mongodb_uri)["steps_ingest_benchmark"]
+    else:
+        db = CountingDatabase()
+    app = FastAPI()
+    app.include_router(steps.router, prefix="/api/steps")
+    app.dependency_overrides[get_db] = lambda: db
+    client = TestClient(app)
+
+    dates, counts = history(args.users, args.days)
+    rows = args.users * args.days
+    json_headers = {"content-type": "application/json"}
+    ndjson_headers = {"content-type": "application/x-ndjson"}
+
+    print(f"{args.users} users x {args.days} days = {rows:,} rows")
+    print(f"{'path':<28}{'requests':>10}{'body KiB':>12}{'seconds':>10}{'rows/s':>14}")
+
+    single = [
+        (json.dumps({"user_id": f"user-{user}", "steps_data": {"date": date, "steps": int(counts[user, day])}}),
+         json_headers, "/api/steps/save-steps")
+        for user in range(args.single_row_users) for day, date in enumerate(dates)
+    ]
+    run("save-steps, one per day", client, single, len(single))
+
+    ndjson = "\n".join(
+        json.dumps({"user_id": f"user-{user}", "date": date, "steps": int(counts[user, day])})
+        for user in range(args.users) for day, date in enumerate(dates)
+    )
+    run("ingest, NDJSON", client, [(ndjson, ndjson_headers, "/api/steps/ingest")], rows)
+
+    columnar = json.dumps({"series": [
+        {"user_id": f"user-{user}", "start_date": dates[0], "steps": counts[user].tolist()}
+        for user in range(args.users)
+    ]})
+    run("ingest, columnar list", client, [(columnar, json_headers, "/api/steps/ingest")], rows)
+
+    packed = json.dumps({"series": [
+        {"user_id": f"user-{user}", "start_date": dates[0],
+         "steps_int32": base64.b64encode(counts[user].astype("<i4").tobytes()).decode()}
+        for user in range(args.users)
+    ]})
+    run("ingest, columnar int32", client, [(packed, json_headers, "/api/steps/ingest")], rows)
+
+
+if __name__ == "__main__":
+    main()
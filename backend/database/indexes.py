@@ -0,0 +1,304 @@
+import os
+import asyncio
+import argparse
+import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from dotenv import load_dotenv
+
+from database.pagination import HISTORY_SORT
+
+# Load environment variables
+load_dotenv()
+
+# Retention configuration (0 keeps documents forever)
+CONVERSATION_RETENTION_DAYS = int(os.getenv("CONVERSATION_RETENTION_DAYS", "0"))
+
+# Shared tier of the health prediction cache (see services.health_prediction_cache)
+HEALTH_PREDICTION_CACHE_COLLECTION = "health_prediction_cache"
+HEALTH_PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("HEALTH_PREDICTION_CACHE_TTL_SECONDS", "86400"))
+# Also keep predictions in MongoDB so every worker (and restarts) can reuse them
+HEALTH_PREDICTION_CACHE_SHARED = os.getenv("HEALTH_PREDICTION_CACHE_SHARED", "false").lower() == "true"
+
+# Every history read filters on user_id and pages newest first by (timestamp, _id)
+USER_HISTORY_INDEX = {
+    "name": "user_id_timestamp",
+    "keys": [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+}
+
+
+def ttl_index(days):
+    """TTL index removing documents `days` after their timestamp (None when retention is off)."""
+    if days <= 0:
+        return None
+    return {
+        "name": "timestamp_ttl",
+        "keys": [("timestamp", ASCENDING)],
+        "expireAfterSeconds": int(days * 86400),
+    }
+
+
+# Indexes each collection should have, by collection name.
+# TTL only applies to BSON dates; exercise_records stores ISO strings and is kept forever.
+INDEX_MANIFEST = {
+    "medical_conversations": [USER_HISTORY_INDEX, ttl_index(CONVERSATION_RETENTION_DAYS)],
+    "diet_conversations": [USER_HISTORY_INDEX, ttl_index(CONVERSATION_RETENTION_DAYS)],
+    "compounder_conversations": [USER_HISTORY_INDEX, ttl_index(CONVERSATION_RETENTION_DAYS)],
+    "steps_conversations": [USER_HISTORY_INDEX, ttl_index(CONVERSATION_RETENTION_DAYS)],
+    "exercise_records": [USER_HISTORY_INDEX],
+    "steps_data": [USER_HISTORY_INDEX],
+    # One bucket per user and UTC day; range reads and totals scan the user's days in order
+    "steps_daily": [{
+        "name": "user_id_date",
+        "keys": [("user_id", ASCENDING), ("date", ASCENDING)],
+        "unique": True,
+    }],
+    "medical_reports": [
+        USER_HISTORY_INDEX,
+        # One report per user and image; also serves the exact-duplicate lookup
+        {
+            "name": "content_sha256_user_id",
+            "keys": [("content_sha256", ASCENDING), ("user_id", ASCENDING)],
+            "unique": True,
+            "partialFilterExpression": {"content_sha256": {"$exists": True}},
+        },
+        # Candidates for near-duplicate re-photos: any matching perceptual hash band
+        {
+            "name": "user_id_phash_bands",
+            "keys": [("user_id", ASCENDING), ("phash_bands", ASCENDING)],
+            "partialFilterExpression": {"phash_bands": {"$exists": True}},
+        },
+    ],
+    "diet_plans": [USER_HISTORY_INDEX],
+    # Latest token of each set of Google credentials, by a hash of the refresh token
+    "google_tokens": [{"name": "credential", "keys": [("credential", ASCENDING)], "unique": True}],
+    "steps_rollups": [
+        # One total per user and period; the target of every $inc
+        {
+            "name": "user_id_period_key",
+            "keys": [("user_id", ASCENDING), ("period", ASCENDING), ("key", ASCENDING)],
+            "unique": True,
+        },
+        # Leaderboards and goal queries walk one period from the most steps down
+        {
+            "name": "period_key_steps",
+            "keys": [("period", ASCENDING), ("key", ASCENDING), ("steps", DESCENDING)],
+        },
+    ],
+}
+
+# Shared tier of the health prediction cache, when enabled
+if HEALTH_PREDICTION_CACHE_SHARED:
+    INDEX_MANIFEST[HEALTH_PREDICTION_CACHE_COLLECTION] = [{
+        "name": "created_at_ttl",
+        "keys": [("created_at", ASCENDING)],
+        "expireAfterSeconds": int(HEALTH_PREDICTION_CACHE_TTL_SECONDS),
+    }]
+
+# Names of the optional indexes this module manages; they are dropped when switched off
+MANAGED_OPTIONAL_INDEXES = {"timestamp_ttl"}
+
+# Query shapes the application runs, checked with explain() by check_indexes()
+QUERY_SHAPES = [
+    {"collection": collection, "filter": {"user_id": "index-check"}, "sort": HISTORY_SORT}
+    for collection in (
+        "medical_conversations", "diet_conversations", "compounder_conversations",
+        "steps_conversations", "exercise_records", "medical_reports", "diet_plans"
+    )
+] + [
+    {
+        "collection": "steps_data",
+        "filter": {"user_id": "index-check", "timestamp": {"$gte": datetime.datetime(1970, 1, 1)}},
+        "sort": HISTORY_SORT
+    },
+    {
+        "collection": "steps_daily",
+        "filter": {"user_id": "index-check", "date": {"$gte": datetime.datetime(1970, 1, 1)}},
+        "sort": [("date", ASCENDING)]
+    },
+    {"collection": "google_tokens", "filter": {"credential": "index-check"}},
+    {"collection": "steps_rollups", "filter": {"period": "week", "key": "index-check"}, "sort": [("steps", DESCENDING)]},
+    {
+        "collection": "steps_rollups",
+        "filter": {"period": "day", "key": "index-check", "steps": {"$gte": 10000}, "rewarded_at": None},
+        "sort": [("steps", DESCENDING)]
+    },
+    {"collection": "medical_reports", "filter": {"content_sha256": "index-check", "user_id": "index-check"}},
+    {"collection": "medical_reports", "filter": {"user_id": "index-check", "phash_bands": {"$in": ["0:0000"]}}},
+]
+
+
+def _index_options(spec):
+    return {key: value for key, value in spec.items() if key not in ("name", "keys")}
+
+
+def _matches(existing, spec):
+    """Whether an entry of index_information() already has the keys and options of a spec."""
+    if [tuple(key) for key in existing["key"]] != [tuple(key) for key in spec["keys"]]:
+        return False
+    return all(existing.get(option) == value for option, value in _index_options(spec).items())
+
+
+async def ensure_indexes(db, manifest=None):
+    """
+    Bring the indexes of every collection in line with the manifest.
+
+    Safe to run on every startup: indexes that already match are left alone,
+    a TTL whose retention changed is updated in place with collMod, any other
+    index whose definition changed is rebuilt, and optional managed indexes
+    that are switched off are dropped.
+
+    Args:
+        db: Motor database
+        manifest: Collection name -> list of index specs (defaults to INDEX_MANIFEST)
+
+    Returns:
+        dict: Collection name -> list of "created:<name>", "updated:<name>" or "dropped:<name>" actions
+    """
+    manifest = INDEX_MANIFEST if manifest is None else manifest
+    changes = {}
+
+    for collection_name, specs in manifest.items():
+        collection = db[collection_name]
+        specs = [spec for spec in specs if spec]
+        existing = await collection.index_information()
+        actions = []
+
+        to_create = []
+        for spec in specs:
+            current = existing.get(spec["name"])
+            if current is None:
+                to_create.append(spec)
+            elif _matches(current, spec):
+                continue
+            elif "expireAfterSeconds" in spec and "expireAfterSeconds" in current and \
+                    [tuple(key) for key in current["key"]] == [tuple(key) for key in spec["keys"]]:
+                await db.command("collMod", collection_name, index={
+                    "name": spec["name"], "expireAfterSeconds": spec["expireAfterSeconds"]
+                })
+                actions.append(f"updated:{spec['name']}")
+            else:
+                await collection.drop_index(spec["name"])
+                to_create.append(spec)
+
+        if to_create:
+            await collection.create_indexes([
+                IndexModel(spec["keys"], name=spec["name"], **_index_options(spec)) for spec in to_create
+            ])
+            actions.extend(f"created:{spec['name']}" for spec in to_create)
+
+        wanted = {spec["name"] for spec in specs}
+        for name in MANAGED_OPTIONAL_INDEXES & (set(existing) - wanted):
+            await collection.drop_index(name)
+            actions.append(f"dropped:{name}")
+
+        if actions:
+            changes[collection_name] = actions
+
+    return changes
+
+
+def _plan_stages(plan):
+    """Yield (stage name, index name) for every stage of an explain() plan tree."""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"], plan.get("indexName")
+    for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+        yield from _plan_stages(plan.get(key))
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def analyze_plan(explain):
+    """
+    Summarize the winning plan of an explain() result.
+
+    Returns:
+        dict: Indexes used, whether the query scans the whole collection and
+              whether results are sorted in memory
+    """
+    stages = list(_plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})))
+    return {
+        "indexes": sorted({index for _, index in stages if index}),
+        "collection_scan": any(stage == "COLLSCAN" for stage, _ in stages),
+        "in_memory_sort": any(stage in ("SORT", "SORT_KEY_GENERATOR") for stage, _ in stages),
+    }
+
+
+async def check_indexes(db, manifest=None, query_shapes=None):
+    """
+    Report missing and unused indexes.
+
+    Each known query shape is explained; a winning plan with a collection scan
+    or an in-memory sort means the index it needs is missing. $indexStats gives
+    the access count of every index since the server started, so indexes with
+    no accesses are reported as unused.
+
+    Args:
+        db: Motor database
+        manifest: Collection name -> list of index specs (defaults to INDEX_MANIFEST)
+        query_shapes: Queries to explain (defaults to QUERY_SHAPES)
+
+    Returns:
+        dict: "missing" manifest indexes, "slow_queries" with their plans,
+              and "unused" indexes with their access counts
+    """
+    manifest = INDEX_MANIFEST if manifest is None else manifest
+    query_shapes = QUERY_SHAPES if query_shapes is None else query_shapes
+    report = {"missing": [], "slow_queries": [], "unused": []}
+
+    existing_collections = set(await db.list_collection_names())
+    for collection_name, specs in manifest.items():
+        existing = await db[collection_name].index_information() if collection_name in existing_collections else {}
+        for spec in filter(None, specs):
+            if spec["name"] not in existing or not _matches(existing[spec["name"]], spec):
+                report["missing"].append({"collection": collection_name, "index": spec["name"]})
+
+    for shape in query_shapes:
+        cursor = db[shape["collection"]].find(shape["filter"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        plan = analyze_plan(await cursor.explain())
+        if plan["collection_scan"] or plan["in_memory_sort"]:
+            report["slow_queries"].append(dict(shape, filter=str(shape["filter"]), sort=shape.get("sort"), plan=plan))
+
+    for collection_name in sorted(existing_collections & set(manifest)):
+        async for stats in db[collection_name].aggregate([{"$indexStats": {}}]):
+            if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                report["unused"].append({
+                    "collection": collection_name,
+                    "index": stats["name"],
+                    "since": stats["accesses"]["since"].isoformat()
+                })
+
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Apply the index manifest and report missing or unused indexes")
+    parser.add_argument("--check-only", action="store_true", help="Only report, do not create or drop indexes")
+    args = parser.parse_args()
+
+    import motor.motor_asyncio
+    from database.mongodb import MONGODB_URI, MONGODB_DB_NAME
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URI)
+    try:
+        db = client[MONGODB_DB_NAME]
+        if not args.check_only:
+            print(f"Index changes: {await ensure_indexes(db) or 'none'}")
+        report = await check_indexes(db)
+        for item in report["missing"]:
+            print(f"MISSING  {item['collection']}.{item['index']}")
+        for item in report["slow_queries"]:
+            print(f"SLOW     {item['collection']} {item['filter']} sort={item['sort']} plan={item['plan']}")
+        for item in report["unused"]:
+            print(f"UNUSED   {item['collection']}.{item['index']} (no accesses since {item['since']})")
+        if not any(report.values()):
+            print("All query shapes are served by indexes")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
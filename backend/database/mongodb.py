@@ -1,8 +1,13 @@
 import os
+import threading
 import motor.motor_asyncio
-from pymongo import MongoClient
+from pymongo import monitoring
+from fastapi import HTTPException
 from dotenv import load_dotenv
 
+from database.indexes import ensure_indexes
+from database.write_behind import insert_document
+
 # Load environment variables
 load_dotenv()
 
@@ -10,41 +15,190 @@ load_dotenv()
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "ai_healthcare_platform")
 
-# Global variables for database connections
-client = None
-db = None
+# Connection pool configuration
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "5"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+# Collections the application writes to
+COLLECTIONS = [
+    "patient_records",
+    "exercise_records",
+    "medical_queries",
+    "diet_plans",
+    "medical_reports",
+    "steps_data",
+    "medical_conversations",
+    "diet_conversations",
+    "compounder_conversations",
+    "steps_conversations",
+]
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool counters fed by pymongo's CMAP events.
+
+    Events arrive on the driver's worker threads, so updates take a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pool_clears=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checked_out=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "max_pool_size": MONGODB_MAX_POOL_SIZE,
+                "min_pool_size": MONGODB_MIN_POOL_SIZE,
+                "open_connections": self.open,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "waiting": self.waiting,
+                "utilization": round(self.checked_out / MONGODB_MAX_POOL_SIZE, 3) if MONGODB_MAX_POOL_SIZE else 0.0,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "pool_clears": self.pool_clears
+            }
+
+
+# Connection state, set by connect_to_mongo() for the lifetime of the app
+_client = None
+_db = None
+pool_metrics = PoolMetrics()
 
 
 async def connect_to_mongo():
-    """Connect to MongoDB and initialize global db variable."""
-    global client, db
+    """
+    Open the pooled MongoDB client, create missing collections and indexes.
+
+    Returns:
+        The Motor database
+    """
+    global _client, _db
     try:
-        client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URI)
-        db = client[MONGODB_DB_NAME]
+        _client = motor.motor_asyncio.AsyncIOMotorClient(
+            MONGODB_URI,
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            event_listeners=[pool_metrics]
+        )
+        db = _client[MONGODB_DB_NAME]
 
         # Verify connection
         await db.command("ping")
         print(f"Connected to MongoDB: {MONGODB_DB_NAME}")
 
-        # Create collections if they don't exist
-        if "patient_records" not in await db.list_collection_names():
-            await db.create_collection("patient_records")
-        if "exercise_records" not in await db.list_collection_names():
-            await db.create_collection("exercise_records")
-        if "medical_queries" not in await db.list_collection_names():
-            await db.create_collection("medical_queries")
-        if "diet_plans" not in await db.list_collection_names():
-            await db.create_collection("diet_plans")
+        # Create collections if they don't exist, with a single discovery round trip
+        existing_collections = set(await db.list_collection_names())
+        for collection in COLLECTIONS:
+            if collection not in existing_collections:
+                await db.create_collection(collection)
+                print(f"Created collection: {collection}")
 
-        # Create conversation collections
-        await create_conversation_collections()
+        # Create the indexes the history queries need; existing ones are left untouched
+        try:
+            changes = await ensure_indexes(db)
+            if changes:
+                print(f"Updated MongoDB indexes: {changes}")
+        except Exception as e:
+            print(f"Error creating MongoDB indexes: {e}")
+
+        _db = db
+        return db
 
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
         raise
 
 
-async def save_conversation(collection_name, user_id, conversation_data):
+async def close_mongo_connection():
+    """Close MongoDB connection."""
+    global _client, _db
+    if _client:
+        _client.close()
+        _client = None
+        _db = None
+        print("MongoDB connection closed")
+
+
+def get_database():
+    """Return the connected database, or None if the app is running without one."""
+    return _db
+
+
+def get_db():
+    """
+    FastAPI dependency for endpoints that cannot work without the database.
+
+    Raises:
+        HTTPException: 503 if MongoDB is not connected
+    """
+    if _db is None:
+        raise HTTPException(status_code=503, detail="Database is not available")
+    return _db
+
+
+def get_optional_db():
+    """FastAPI dependency for endpoints where persistence is best effort; None without a database."""
+    return _db
+
+
+def get_pool_metrics():
+    return pool_metrics.snapshot()
+
+
+async def save_conversation(db, collection_name, user_id, conversation_data):
     """Save a conversation entry to the specified collection."""
     try:
         conversation_record = {
@@ -54,14 +208,15 @@ async def save_conversation(collection_name, user_id, conversation_data):
             "response": conversation_data.get("response"),
             "metadata": conversation_data.get("metadata", {})
         }
-        result = await db[collection_name].insert_one(conversation_record)
-        return str(result.inserted_id)
+        if conversation_data.get("context_summary") is not None:
+            conversation_record["context_summary"] = conversation_data["context_summary"]
+        return str(await insert_document(db, collection_name, conversation_record))
     except Exception as e:
         print(f"Error saving conversation to {collection_name}: {e}")
         raise
 
 
-async def get_user_conversations(collection_name, user_id, limit=10):
+async def get_user_conversations(db, collection_name, user_id, limit=10):
     """Retrieve conversation history for a specific user from the specified collection."""
     try:
         cursor = db[collection_name].find({"user_id": user_id}).sort("timestamp", -1).limit(limit)
@@ -72,31 +227,8 @@ async def get_user_conversations(collection_name, user_id, limit=10):
         raise
 
 
-# Create collections for conversations if they don't exist
-async def create_conversation_collections():
-    collections_to_create = [
-        "medical_conversations",
-        "diet_conversations",
-        "compounder_conversations"
-    ]
-    existing_collections = await db.list_collection_names()
-
-    for collection in collections_to_create:
-        if collection not in existing_collections:
-            await db.create_collection(collection)
-            print(f"Created collection: {collection}")
-
-
-async def close_mongo_connection():
-    """Close MongoDB connection."""
-    global client
-    if client:
-        client.close()
-        print("MongoDB connection closed")
-
-
 # Database operations for exercise tracking
-async def save_exercise_data(user_id, exercise_data):
+async def save_exercise_data(db, user_id, exercise_data):
     """Save exercise tracking data to MongoDB."""
     exercise_record = {
         "user_id": user_id,
@@ -106,14 +238,7 @@ async def save_exercise_data(user_id, exercise_data):
         "accuracy": exercise_data.get("accuracy"),
         "feedback": exercise_data.get("feedback")
     }
-    result = await db.exercise_records.insert_one(exercise_record)
-    return result.inserted_id
-
+    return await insert_document(db, "exercise_records", exercise_record)
 
-async def get_user_exercise_history(user_id):
-    """Retrieve exercise history for a specific user."""
-    cursor = db.exercise_records.find({"user_id": user_id}).sort("timestamp", -1)
-    exercise_history = await cursor.to_list(length=100)
-    return exercise_history
 
-# Add similar functions for other collections as needed
\ No newline at end of file
+# Add similar functions for other collections as needed
@@ -0,0 +1,215 @@
+import os
+import json
+import base64
+import datetime
+from bson import ObjectId
+from pymongo import DESCENDING
+from fastapi.responses import Response, StreamingResponse
+from dotenv import load_dotenv
+
+from database.cache import TTLCache
+from database.write_behind import write_behind
+
+# Load environment variables
+load_dotenv()
+
+# Pagination configuration
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "500"))
+
+# Per-user page cache for polled history endpoints (a TTL of 0 disables it)
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "30"))
+HISTORY_CACHE_MAX_USERS = int(os.getenv("HISTORY_CACHE_MAX_USERS", "2048"))
+HISTORY_CACHE_PAGES_PER_USER = 16
+
+# Newest first; _id breaks ties between documents with the same timestamp
+HISTORY_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+
+
+def encode_cursor(document):
+    """Opaque token pointing just after `document` in HISTORY_SORT order."""
+    timestamp = document.get("timestamp")
+    if isinstance(timestamp, datetime.datetime):
+        position = {"d": timestamp.isoformat()}
+    else:
+        position = {"v": timestamp}
+    position["id"] = str(document["_id"])
+    token = base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode("utf-8"))
+    return token.decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Decode a token made by encode_cursor().
+
+    Raises:
+        ValueError: If the token is malformed
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        timestamp = datetime.datetime.fromisoformat(position["d"]) if "d" in position else position["v"]
+        return timestamp, ObjectId(position["id"])
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_filter(query, cursor=None):
+    """Restrict `query` to the documents after `cursor` in HISTORY_SORT order."""
+    if not cursor:
+        return query
+    timestamp, last_id = decode_cursor(cursor)
+    return {"$and": [query, {"$or": [
+        {"timestamp": {"$lt": timestamp}},
+        {"timestamp": timestamp, "_id": {"$lt": last_id}}
+    ]}]}
+
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value):
+    return json.dumps(value, default=json_default, separators=(",", ":"))
+
+
+async def _next_document(documents):
+    try:
+        return await documents.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _page_chunks(documents, limit, format_item, items_key, fields, wrap_data):
+    # Fetch the first document before emitting anything, so query errors surface as HTTP errors
+    document = await _next_document(documents)
+
+    opening = _dumps(fields)[:-1] + ("," if fields else "") + _dumps(items_key) + ":["
+    if wrap_data:
+        opening = '{"status":"success","data":' + opening
+    yield opening
+
+    count = 0
+    last = None
+    while document is not None and count < limit:
+        yield ("," if count else "") + _dumps(format_item(document))
+        last = document
+        count += 1
+        document = await _next_document(documents)
+
+    # A document beyond the limit means there is another page
+    next_cursor = encode_cursor(last) if document is not None else None
+    yield '],"next_cursor":' + _dumps(next_cursor) + ("}}" if wrap_data else "}")
+
+
+def _history_chunks(collection, query, projection, format_item, items_key, fields, limit, cursor, wrap_data):
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    documents = collection.find(keyset_filter(query, cursor), projection) \
+        .sort(HISTORY_SORT).limit(limit + 1).batch_size(min(limit + 1, 101))
+    return _page_chunks(documents.__aiter__(), limit, format_item, items_key, fields or {}, wrap_data)
+
+
+async def stream_history_page(collection, query, projection, format_item, items_key, fields=None,
+                              limit=HISTORY_PAGE_SIZE, cursor=None, wrap_data=True):
+    """
+    Stream one page of a user's history as JSON, newest first.
+
+    Pages are addressed by keyset on (timestamp, _id), so every page is an
+    index range scan no matter how deep it is, and documents are serialized
+    one by one as the driver returns them instead of being collected first.
+
+    Args:
+        collection: Motor collection
+        query: Filter selecting the history, e.g. {"user_id": ...}
+        projection: Fields to fetch; must include timestamp
+        format_item: Turns a projected document into the JSON-ready item
+        items_key: Name of the item list in the response
+        fields: Other response fields placed before the items
+        limit: Page size
+        cursor: next_cursor of the previous page, or None for the first page
+        wrap_data: Wrap the fields in {"status": "success", "data": {...}}
+
+    Returns:
+        StreamingResponse: The page, with "next_cursor" set to the token of
+                           the next page or null on the last one
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    chunks = _history_chunks(collection, query, projection, format_item, items_key, fields, limit, cursor, wrap_data)
+    first = await chunks.__anext__()
+
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type="application/json")
+
+
+class HistoryPageCache:
+    """
+    Rendered history pages of each (collection, user), dropped as a whole when
+    that user's history in the collection changes.
+    """
+
+    def __init__(self, ttl=HISTORY_CACHE_TTL_SECONDS, max_users=HISTORY_CACHE_MAX_USERS):
+        self.enabled = ttl > 0
+        self._users = TTLCache(max_entries=max_users, ttl=ttl)  # (collection, user_id) -> {page key: body}
+
+    def get(self, collection_name, user_id, page_key):
+        pages = self._users.get((collection_name, user_id))
+        return pages.get(page_key) if pages else None
+
+    def put(self, collection_name, user_id, page_key, body):
+        pages = self._users.get((collection_name, user_id))
+        if pages is None:
+            pages = {}
+            self._users.set((collection_name, user_id), pages)
+        elif len(pages) >= HISTORY_CACHE_PAGES_PER_USER:
+            pages.pop(next(iter(pages)))
+        pages[page_key] = body
+
+    def invalidate(self, collection_name, user_id):
+        self._users.pop((collection_name, user_id))
+
+    def invalidate_documents(self, collection_name, documents):
+        for user_id in {document.get("user_id") for document in documents}:
+            self.invalidate(collection_name, user_id)
+
+    def get_metrics(self):
+        return dict(self._users.get_metrics(), enabled=self.enabled)
+
+
+async def cached_history_page(collection, user_id, query, projection, format_item, items_key, fields=None,
+                              limit=HISTORY_PAGE_SIZE, cursor=None, wrap_data=True):
+    """
+    Like stream_history_page(), but serves repeated reads of the same page
+    from the per-user cache until the user's history changes or the TTL passes.
+
+    Returns:
+        Response: The page, with an X-Cache header of HIT or MISS
+    """
+    if not history_cache.enabled:
+        return await stream_history_page(collection, query, projection, format_item, items_key, fields,
+                                         limit, cursor, wrap_data)
+
+    page_key = (limit, cursor)
+    body = history_cache.get(collection.name, user_id, page_key)
+    if body is not None:
+        return Response(body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+    chunks = _history_chunks(collection, query, projection, format_item, items_key, fields, limit, cursor, wrap_data)
+    body = "".join([chunk async for chunk in chunks]).encode("utf-8")
+    history_cache.put(collection.name, user_id, page_key, body)
+    return Response(body, media_type="application/json", headers={"X-Cache": "MISS"})
+
+
+# Create a singleton instance
+history_cache = HistoryPageCache()
+
+# Queued records only become visible once written, so drop cached pages again at that point
+write_behind.listeners.append(history_cache.invalidate_documents)
@@ -0,0 +1,214 @@
+import os
+import time
+import asyncio
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Write-behind configuration
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "250"))
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class WriteBehindQueue:
+    """
+    Buffers inserts and writes them in per-collection insert_many batches.
+
+    A request only pays for appending its document to a buffer. Documents get
+    their ObjectId on the client, so the id can be returned right away and a
+    batch retried after a connection failure cannot insert anything twice: the
+    copies already written are rejected as duplicate _ids and counted as
+    written. Any other duplicate key is a failed write. A collection is
+    flushed as soon as it holds max_batch documents, and everything is flushed
+    at least every flush_interval seconds and on close().
+    """
+
+    def __init__(self, max_batch=WRITE_BEHIND_MAX_BATCH, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000,
+                 max_queue=WRITE_BEHIND_MAX_QUEUE):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.db = None
+        self._buffers = {}  # collection name -> documents waiting to be written
+        self._depth = 0
+        self._wake = None
+        self._flush_lock = None
+        self._task = None
+        self._stopping = False
+        self._retried_ids = set()  # _ids of documents requeued after a connection failure
+        self.listeners = []  # called with (collection name, documents) after each successful write
+
+        # Counters exposed through get_metrics()
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self, db):
+        """Start writing queued documents to `db` in the background."""
+        if self._task is None:
+            self.db = db
+            self._wake = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, collection_name, document):
+        """
+        Queue a document for insertion.
+
+        Args:
+            collection_name: Target collection
+            document: The document; an _id is assigned if it has none
+
+        Returns:
+            ObjectId: The _id the document will be stored under
+        """
+        if self._depth >= self.max_queue:
+            # Apply backpressure rather than growing without bound while the database is slow
+            await self.flush()
+
+        document.setdefault("_id", ObjectId())
+        buffer = self._buffers.setdefault(collection_name, [])
+        buffer.append(document)
+        self._depth += 1
+        self.enqueued += 1
+        if len(buffer) >= self.max_batch:
+            self._wake.set()
+        return document["_id"]
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing write-behind queue: {e}")
+
+    async def flush(self):
+        """Write every buffered document, one insert_many per collection."""
+        async with self._flush_lock:
+            buffers, self._buffers = self._buffers, {}
+            for collection_name, documents in buffers.items():
+                self._depth -= len(documents)
+                for start in range(0, len(documents), self.max_batch):
+                    await self._write(collection_name, documents[start:start + self.max_batch])
+
+    def _already_written(self, documents, error):
+        """Whether a write error is a retried document colliding with its own earlier insert."""
+        if error.get("code") != DUPLICATE_KEY_ERROR:
+            return False
+        if error.get("keyPattern", {"_id": 1}) != {"_id": 1}:
+            return False
+        return documents[error["index"]]["_id"] in self._retried_ids
+
+    async def _write(self, collection_name, documents):
+        started = time.perf_counter()
+        requeued = False
+        try:
+            await self.db[collection_name].insert_many(documents, ordered=False)
+            self.written += len(documents)
+            self._notify(collection_name, documents)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            rejected = {error["index"] for error in errors if not self._already_written(documents, error)}
+            self.written += len(documents) - len(rejected)
+            self.failed += len(rejected)
+            for error in errors:
+                if error["index"] in rejected:
+                    print(f"Error writing document {documents[error['index']]['_id']} to {collection_name}: "
+                          f"{error.get('errmsg', error)}")
+            written = [document for index, document in enumerate(documents) if index not in rejected]
+            if written:
+                self._notify(collection_name, written)
+        except ConnectionFailure as e:
+            if self._depth + len(documents) <= self.max_queue:
+                # Keep the batch for the next flush; client-side ids make the retry idempotent
+                self._buffers.setdefault(collection_name, [])[:0] = documents
+                self._depth += len(documents)
+                self._retried_ids.update(document["_id"] for document in documents)
+                self.retried += len(documents)
+                requeued = True
+            else:
+                self.failed += len(documents)
+            print(f"Error writing to {collection_name}, {len(documents)} documents affected: {e}")
+        except Exception as e:
+            self.failed += len(documents)
+            print(f"Error writing {len(documents)} documents to {collection_name}: {e}")
+        finally:
+            if not requeued and self._retried_ids:
+                self._retried_ids.difference_update(document["_id"] for document in documents)
+            latency = time.perf_counter() - started
+            self.batches += 1
+            self.total_flush_latency += latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+
+    def _notify(self, collection_name, documents):
+        for listener in self.listeners:
+            try:
+                listener(collection_name, documents)
+            except Exception as e:
+                print(f"Error in write-behind listener: {e}")
+
+    async def close(self):
+        """Stop the background task and write everything still queued."""
+        if self._task:
+            # Let a flush in progress finish rather than cancelling it with its documents taken off the buffers
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+            await self.flush()
+            if self._depth:
+                print(f"Write-behind queue closed with {self._depth} documents not written")
+
+    def get_metrics(self):
+        return {
+            "running": self.running,
+            "depth": self._depth,
+            "depth_by_collection": {name: len(documents) for name, documents in self._buffers.items() if documents},
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "retried": self.retried,
+            "batches": self.batches,
+            "avg_flush_ms": round(self.total_flush_latency / self.batches * 1000, 2) if self.batches else 0.0,
+            "max_flush_ms": round(self.max_flush_latency * 1000, 2)
+        }
+
+
+async def insert_document(db, collection_name, document):
+    """
+    Insert a document through the write-behind queue when it is running for
+    this database, or directly otherwise (e.g. in scripts).
+
+    Returns:
+        ObjectId: The _id of the document
+    """
+    if write_behind.running and write_behind.db is db:
+        return await write_behind.put(collection_name, document)
+    result = await db[collection_name].insert_one(document)
+    return result.inserted_id
+
+
+# Create a singleton instance
+write_behind = WriteBehindQueue()
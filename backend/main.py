@@ -1,4 +1,5 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -7,11 +8,61 @@ from fastapi import Request
 # Load environment variables
 load_dotenv()
 
+# Import routers
+from routers import compounder, doctor, dietician, gymtrainer, steps
+from database.mongodb import connect_to_mongo, close_mongo_connection, get_pool_metrics
+from database.write_behind import write_behind
+from database.pagination import history_cache
+from services.llm_gateway import close_llm_gateway, get_llm_gateway
+from services.doctor_directory import doctor_repository
+from services.health_prediction_cache import health_prediction_cache
+from services.streaming import stream_metrics
+from services.pose_pool import pose_pool
+from services.image_preprocessing import image_preprocessor
+from services.report_dedup import report_analysis_cache
+from services.gym_sessions import session_manager
+from services.google_fit import google_fit
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start the shared resources before serving requests and release them on shutdown."""
+    # Load the doctor directory once at startup; later changes to the CSV are picked up by mtime
+    doctor_repository.load()
+
+    # Create the long-lived pose estimators before the first frame arrives
+    pose_pool.start()
+
+    # Open the pooled MongoDB client; without it the AI endpoints still work but nothing is persisted
+    try:
+        db = await connect_to_mongo()
+        # Persist records in batches in the background instead of inside each request
+        write_behind.start(db)
+    except Exception as e:
+        print(f"Starting without MongoDB: {e}")
+
+    # Evict idle exercise sessions in the background
+    session_manager.start_eviction()
+
+    try:
+        yield
+    finally:
+        await session_manager.stop_eviction()
+        pose_pool.close()
+        image_preprocessor.close()
+        await close_llm_gateway()
+        await google_fit.aclose()
+        # Write out queued records before the client goes away
+        await write_behind.close()
+        await close_mongo_connection()
+
+
 # Create a single FastAPI app
 app = FastAPI(
     title="Health_sync",
     description="A comprehensive healthcare platform with multiple AI services",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 @app.get("/auth/callback")
 async def root_auth_callback(request: Request, code: str = None, error: str = None):
@@ -52,10 +103,6 @@ async def root_auth_callback(request: Request, code: str = None, error: str = No
     </body>
     </html>
     """)
-# Import routers
-from routers import compounder, doctor, dietician, gymtrainer, steps
-from database.mongodb import connect_to_mongo, close_mongo_connection
-
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -73,6 +120,24 @@ app.include_router(dietician.router, prefix="/api/dietician", tags=["dietician"]
 app.include_router(steps.router, prefix="/api/steps", tags=["steps"])
 
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics of the shared connection pools."""
+    return {
+        "status": "success",
+        "data": {
+            "mongo_pool": get_pool_metrics(),
+            "write_behind": write_behind.get_metrics(),
+            "history_cache": history_cache.get_metrics(),
+            "health_prediction_cache": health_prediction_cache.get_metrics(),
+            "llm_gateway": get_llm_gateway().get_metrics(),
+            "streaming": stream_metrics.get_metrics(),
+            "image_preprocessing": image_preprocessor.get_metrics(),
+            "report_analysis_cache": report_analysis_cache.get_metrics(),
+            "google_fit": google_fit.get_metrics()
+        }
+    }
+
 
 @app.get("/")
 async def root():
@@ -1,4 +1,5 @@
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -9,12 +10,26 @@ load_dotenv()
 # Import routers
 from routers import compounder, doctor, dietician, gymtrainer
 from database.mongodb import connect_to_mongo, close_mongo_connection
+from services.llm_gateway import close_llm_gateway
+
+
+# Database connection lifecycle
+@asynccontextmanager
+async def lifespan(app):
+    await connect_to_mongo()
+    try:
+        yield
+    finally:
+        await close_mongo_connection()
+        await close_llm_gateway()
+
 
 # Create FastAPI app
 app = FastAPI(
     title="Health_sync",
     description="A comprehensive healthcare platform with multiple AI services",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -32,15 +47,6 @@ app.include_router(gymtrainer.router, prefix="/api/gymtrainer", tags=["gymtraine
 app.include_router(doctor.router, prefix="/api/doctor", tags=["doctor"])
 app.include_router(dietician.router, prefix="/api/dietician", tags=["dietician"])
 
-# Database connection events
-@app.on_event("startup")
-async def startup_db_client():
-    await connect_to_mongo()
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    await close_mongo_connection()
-
 @app.get("/")
 async def root():
     return {
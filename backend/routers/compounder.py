@@ -1,12 +1,16 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query, status
 from pydantic import BaseModel
 from typing import Optional, List
 import json
 
 # Import services
 from services.ai_compounder import analyze_medical_report, save_analysis_to_db
+from services.uploads import LimitedBodyRoute, max_body_size, read_upload, MAX_REPORT_UPLOAD_BYTES, MULTIPART_OVERHEAD_BYTES
+from database.mongodb import get_db, get_optional_db
+from database.pagination import cached_history_page, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 
-router = APIRouter()
+# Upload endpoints reject oversized bodies before they are parsed
+router = APIRouter(route_class=LimitedBodyRoute)
 
 
 class AnalysisResponse(BaseModel):
@@ -17,31 +21,40 @@ class AnalysisResponse(BaseModel):
 
 
 @router.post("/analyze-report", response_model=dict)
+@max_body_size(MAX_REPORT_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES)
 async def analyze_report(
         file: UploadFile = File(...),
         user_id: str = Form(...),
+        db=Depends(get_optional_db)
 ):
     """
     Endpoint to analyze medical reports and prescriptions.
 
     - Accepts an uploaded image of a medical report or prescription
     - Returns structured analysis of the report
+    - Rejects images larger than MAX_REPORT_UPLOAD_BYTES with 413
     """
-    try:
-        # Read file contents
-        contents = await file.read()
+    # Read the file in chunks, hashing it on the way; 413 as soon as it passes the limit
+    contents, content_sha256 = await read_upload(file, MAX_REPORT_UPLOAD_BYTES)
 
-        # Process the image with AI service
-        analysis_result = await analyze_medical_report(contents)
+    try:
+        # Process the image with AI service; a repeat upload reuses the earlier analysis
+        analysis_result = await analyze_medical_report(contents, user_id=user_id, db=db, content_sha256=content_sha256)
 
-        # Save to database if analysis was successful
-        if analysis_result["status"] == "success":
+        # Save to database if analysis was successful, unless the user already has this report
+        fingerprint = analysis_result.pop("fingerprint", None)
+        duplicate = analysis_result.get("duplicate")
+        if analysis_result["status"] == "success" and db is not None and not (duplicate and duplicate["report_id"]):
             report_data = {
                 "filename": file.filename,
                 "content_type": file.content_type,
                 "size": len(contents)
             }
-            await save_analysis_to_db(user_id, report_data, analysis_result["data"])
+            analysis_result["report_id"] = await save_analysis_to_db(
+                db, user_id, report_data, analysis_result["data"], fingerprint
+            )
+        elif duplicate:
+            analysis_result["report_id"] = duplicate["report_id"]
 
         return analysis_result
     except Exception as e:
@@ -51,22 +64,50 @@ async def analyze_report(
         )
 
 
+# Listing fields of a stored analysis; the summary is cut down on the server
+USER_REPORT_PROJECTION = {
+    "timestamp": 1,
+    "filename": "$report_data.filename",
+    "summary": {"$substrCP": [{"$ifNull": ["$analysis_result.summary", ""]}, 0, 200]}
+}
+
+
+def format_user_report(report):
+    return {
+        "id": str(report["_id"]),
+        "date": report.get("timestamp"),
+        "filename": report.get("filename"),
+        "summary": report.get("summary", "")
+    }
+
+
 @router.get("/user-reports/{user_id}", response_model=dict)
-async def get_user_reports(user_id: str):
+async def get_user_reports(
+        user_id: str,
+        limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        db=Depends(get_db)
+):
     """
-    Endpoint to retrieve a user's previous medical report analyses.
+    Endpoint to retrieve a user's previous medical report analyses, newest first.
+
+    - Pass the returned next_cursor as cursor to get the next page
     """
-    # This would normally fetch from MongoDB
-    # For now, return placeholder data
-    return {
-        "status": "success",
-        "data": {
-            "reports": [
-                {
-                    "id": "sample_report_id_1",
-                    "date": "2025-03-01T10:30:00",
-                    "summary": "Sample medical report analysis"
-                }
-            ]
-        }
-    }
\ No newline at end of file
+    try:
+        return await cached_history_page(
+            db.medical_reports,
+            user_id,
+            {"user_id": user_id},
+            USER_REPORT_PROJECTION,
+            format_user_report,
+            items_key="reports",
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error retrieving user reports: {str(e)}"
+        )
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 
 # Import services
-from services.ai_dietician import generate_diet_plan, predict_health_metrics, save_diet_plan
+from services.ai_dietician import generate_diet_plan, stream_diet_plan, predict_health_metrics, save_diet_plan
+from services.streaming import sse_response
+from database.mongodb import get_db, get_optional_db
+from database.pagination import cached_history_page, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 
 router = APIRouter()
 
@@ -34,7 +37,7 @@ class DietPlan(BaseModel):
 
 
 @router.post("/diet-plan", response_model=dict)
-async def create_diet_plan(user_data: UserHealthData):
+async def create_diet_plan(user_data: UserHealthData, db=Depends(get_optional_db)):
     """
     Endpoint to generate a personalized diet plan based on user health data.
 
@@ -43,11 +46,11 @@ async def create_diet_plan(user_data: UserHealthData):
     """
     try:
         # Generate diet plan with AI service
-        response = await generate_diet_plan(user_data.dict())
+        response = await generate_diet_plan(user_data.dict(), db=db)
 
         # Save to database if diet plan generation was successful
-        if response["status"] == "success":
-            await save_diet_plan(user_data.user_id, response["data"])
+        if response["status"] == "success" and db is not None:
+            await save_diet_plan(db, user_data.user_id, response["data"])
 
         return response
     except Exception as e:
@@ -57,8 +60,27 @@ async def create_diet_plan(user_data: UserHealthData):
         )
 
 
+@router.post("/diet-plan/stream")
+async def create_diet_plan_stream(user_data: UserHealthData, db=Depends(get_optional_db)):
+    """
+    Server-sent event variant of /diet-plan.
+
+    - Sends a "field" event for each part of the plan as soon as it is generated
+    - Ends with a "done" event carrying the same response as /diet-plan plus timing,
+      or an "error" event
+    """
+    async def events():
+        async for event, data in stream_diet_plan(user_data.dict(), db=db):
+            # Save the finished plan before telling the client it is done
+            if event == "done" and db is not None:
+                await save_diet_plan(db, user_data.user_id, data["data"])
+            yield event, data
+
+    return sse_response(events(), endpoint="dietician_diet_plan")
+
+
 @router.post("/health-predictions", response_model=dict)
-async def health_predictions(user_data: UserHealthData):
+async def health_predictions(user_data: UserHealthData, db=Depends(get_optional_db)):
     """
     Endpoint to predict health metrics like average lifespan and disease risks.
 
@@ -67,7 +89,7 @@ async def health_predictions(user_data: UserHealthData):
     """
     try:
         # Generate health predictions with AI service
-        response = await predict_health_metrics(user_data.dict())
+        response = await predict_health_metrics(user_data.dict(), db=db)
         return response
     except Exception as e:
         raise HTTPException(
@@ -76,22 +98,52 @@ async def health_predictions(user_data: UserHealthData):
         )
 
 
+# Listing fields of a stored diet plan; the meal plan itself is not fetched
+USER_DIET_PLAN_PROJECTION = {
+    "timestamp": 1,
+    "daily_calories": "$diet_plan.daily_calories",
+    "macronutrient_ratio": "$diet_plan.macronutrient_ratio"
+}
+
+
+def format_user_diet_plan(plan):
+    calories = plan.get("daily_calories")
+    return {
+        "id": str(plan["_id"]),
+        "created_at": plan.get("timestamp"),
+        "title": f"{calories} kcal/day diet plan" if calories else "Diet plan",
+        "daily_calories": calories,
+        "macronutrient_ratio": plan.get("macronutrient_ratio")
+    }
+
+
 @router.get("/user-diet-plans/{user_id}", response_model=dict)
-async def get_user_diet_plans(user_id: str):
+async def get_user_diet_plans(
+        user_id: str,
+        limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        db=Depends(get_db)
+):
     """
-    Endpoint to retrieve a user's previous diet plans.
+    Endpoint to retrieve a user's previous diet plans, newest first.
+
+    - Pass the returned next_cursor as cursor to get the next page
     """
-    # This would normally fetch from MongoDB
-    # For now, return placeholder data
-    return {
-        "status": "success",
-        "data": {
-            "diet_plans": [
-                {
-                    "id": "sample_diet_plan_id_1",
-                    "created_at": "2025-03-02T09:15:00",
-                    "title": "Low-carb diet plan for weight management"
-                }
-            ]
-        }
-    }
\ No newline at end of file
+    try:
+        return await cached_history_page(
+            db.diet_plans,
+            user_id,
+            {"user_id": user_id},
+            USER_DIET_PLAN_PROJECTION,
+            format_user_diet_plan,
+            items_key="diet_plans",
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error retrieving diet plans: {str(e)}"
+        )
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 
 # Import services
-from services.ai_doctor import process_medical_query, get_doctor_list
-from database.mongodb import get_user_conversations
+from services.ai_doctor import process_medical_query, stream_medical_query, get_doctor_list
+from services.streaming import sse_response
+from database.mongodb import get_db, get_optional_db
+from database.pagination import stream_history_page, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 
 router = APIRouter()
 
@@ -23,7 +25,7 @@ class DoctorReferral(BaseModel):
 
 
 @router.post("/query", response_model=dict)
-async def medical_query(query_data: MedicalQuery):
+async def medical_query(query_data: MedicalQuery, db=Depends(get_optional_db)):
     """
     Endpoint to process medical queries and provide personalized responses.
 
@@ -36,7 +38,8 @@ async def medical_query(query_data: MedicalQuery):
         response = await process_medical_query(
             query_data.user_id,
             query_data.query,
-            query_data.conversation_history
+            query_data.conversation_history,
+            db=db
         )
 
         return response
@@ -47,6 +50,26 @@ async def medical_query(query_data: MedicalQuery):
         )
 
 
+@router.post("/query/stream")
+async def medical_query_stream(query_data: MedicalQuery, db=Depends(get_optional_db)):
+    """
+    Server-sent event variant of /query.
+
+    - Sends a "field" event for each part of the answer as soon as it is generated
+    - Ends with a "done" event carrying the same response as /query plus timing,
+      or an "error" event
+    """
+    return sse_response(
+        stream_medical_query(
+            query_data.user_id,
+            query_data.query,
+            query_data.conversation_history,
+            db=db
+        ),
+        endpoint="doctor_query"
+    )
+
+
 @router.get("/doctors", response_model=Dict[str, List[Dict[str, Any]]])
 async def list_doctors():
     """
@@ -63,35 +86,51 @@ async def list_doctors():
         )
 
 
+# Summary fields of a stored conversation, cut down on the server so the full LLM response is never sent
+USER_QUERY_PROJECTION = {
+    "timestamp": 1,
+    "query": 1,
+    "answer_preview": {"$substrCP": [{"$ifNull": ["$response.answer", ""]}, 0, 100]},
+    "has_response": {"$ne": [{"$ifNull": ["$response", None]}, None]}
+}
+
+
+def format_user_query(conv):
+    return {
+        "id": str(conv.get("_id")),
+        "timestamp": conv.get("timestamp"),
+        "query": conv.get("query"),
+        "response_summary": conv.get("answer_preview", "") + "..." if conv.get("has_response") else "No response"
+    }
+
+
 @router.get("/user-queries/{user_id}", response_model=dict)
-async def get_user_queries(user_id: str):
+async def get_user_queries(
+        user_id: str,
+        limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        db=Depends(get_db)
+):
     """
-    Endpoint to retrieve a user's previous medical queries and responses.
+    Endpoint to retrieve a user's previous medical queries and responses, newest first.
+
+    - Pass the returned next_cursor as cursor to get the next page
     """
     try:
-        # Get conversation history from MongoDB
-        conversations = await get_user_conversations("medical_conversations", user_id)
-
-        # Format the conversations for the response
-        formatted_queries = []
-        for conv in conversations:
-            query_summary = {
-                "id": str(conv.get("_id")),
-                "timestamp": conv.get("timestamp").isoformat() if "timestamp" in conv else None,
-                "query": conv.get("query"),
-                "response_summary": conv.get("response", {}).get("answer", "")[:100] + "..." if conv.get(
-                    "response") else "No response"
-            }
-            formatted_queries.append(query_summary)
-
-        return {
-            "status": "success",
-            "data": {
-                "queries": formatted_queries
-            }
-        }
+        # Stream the page of conversation summaries from MongoDB
+        return await stream_history_page(
+            db.medical_conversations,
+            {"user_id": user_id},
+            USER_QUERY_PROJECTION,
+            format_user_query,
+            items_key="queries",
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error retrieving user queries: {str(e)}"
-        )
\ No newline at end of file
+        )
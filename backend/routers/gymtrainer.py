@@ -1,24 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Body, Form
-from fastapi.responses import JSONResponse
-from typing import Optional, Dict, Any, List
-import cv2
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Body, Form, Query, WebSocket, WebSocketDisconnect, Request
+from typing import Optional
 import numpy as np
 import asyncio
-import base64
 from datetime import datetime
 import os
+import json
+import time
 
 from services.ai_gymtrainer import gym_trainer_service
-from database.mongodb import get_user_exercise_history
+from services.frame_stream import LatestFrameBuffer
+from services.gym_sessions import session_manager, DEFAULT_SESSION_ID, HISTORY_EXPORT_MODES
+from services.pose_angles import NUM_LANDMARKS
+from services.rep_counter import exercise_registry
+from services.uploads import LimitedBodyRoute, max_body_size, read_upload, MAX_FRAME_UPLOAD_BYTES, MULTIPART_OVERHEAD_BYTES
+from database.mongodb import get_db, get_optional_db
+from database.pagination import stream_history_page, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 
-router = APIRouter()
+# Upload endpoints reject oversized bodies before they are parsed
+router = APIRouter(route_class=LimitedBodyRoute)
+
+# Largest landmark batch accepted by /process-landmarks (4 minutes at 30 FPS)
+MAX_LANDMARK_BATCH_FRAMES = int(os.getenv("MAX_LANDMARK_BATCH_FRAMES", "7200"))
+LANDMARK_FRAME_BYTES = NUM_LANDMARKS * 3 * 4
 
 
 @router.post("/process-frame")
+@max_body_size(MAX_FRAME_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES)
 async def process_exercise_frame(
         file: UploadFile = File(...),
         user_id: str = Form(...),
-        exercise_choice: int = Form(...)
+        exercise_choice: int = Form(...),
+        session_id: str = Form(DEFAULT_SESSION_ID)
 ):
     """
     Process a single video frame for exercise recognition.
@@ -26,40 +38,161 @@ async def process_exercise_frame(
     - **file**: The video frame as an image file
     - **user_id**: Unique identifier for the user
     - **exercise_choice**: 1=Squat, 2=Curl, 3=Sit-up, 4=Lunge, 5=Pushup
+    - **session_id**: Session started with /start-session (default: "default")
     """
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="Invalid file type. Only images are accepted.")
+    if exercise_choice not in exercise_registry:
+        raise HTTPException(status_code=400, detail="Invalid exercise_choice. See /exercises.")
 
-    # Read file content
-    contents = await file.read()
+    # Read file content in chunks; 413 as soon as it passes the limit
+    contents, _ = await read_upload(file, MAX_FRAME_UPLOAD_BYTES, hash_content=False)
 
     try:
         # Process the frame using our gym trainer service
-        response = await gym_trainer_service.process_frame(contents, user_id, exercise_choice)
+        response = await gym_trainer_service.process_frame(contents, user_id, exercise_choice, session_id)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing frame: {str(e)}")
 
 
+@router.post("/process-landmarks")
+@max_body_size(MAX_LANDMARK_BATCH_FRAMES * LANDMARK_FRAME_BYTES)
+async def process_landmark_batch(
+        request: Request,
+        user_id: str,
+        exercise_choice: int,
+        session_id: str = DEFAULT_SESSION_ID
+):
+    """
+    Process a batch of pose landmarks computed on the client, skipping image decoding.
+
+    - **body**: Packed little-endian float32 array of shape frames x 33 x 3
+      (MediaPipe landmark order, x/y/z per landmark), sent as application/octet-stream
+    - **user_id**: Unique identifier for the user
+    - **exercise_choice**: 1=Squat, 2=Curl, 3=Sit-up, 4=Lunge, 5=Pushup
+    - **session_id**: Session started with /start-session (default: "default")
+    """
+    if exercise_choice not in exercise_registry:
+        raise HTTPException(status_code=400, detail="Invalid exercise_choice. See /exercises.")
+
+    frame_size = LANDMARK_FRAME_BYTES
+    body = await request.body()
+    if not body or len(body) % frame_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Body must be a non-empty multiple of {frame_size} bytes (33x3 float32 per frame)."
+        )
+    if len(body) // frame_size > MAX_LANDMARK_BATCH_FRAMES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_LANDMARK_BATCH_FRAMES} frames per batch.")
+
+    try:
+        batch = np.frombuffer(body, dtype="<f4")
+        return await gym_trainer_service.process_landmark_batch(batch, user_id, exercise_choice, session_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing landmarks: {str(e)}")
+
+
+@router.websocket("/stream")
+async def stream_exercise_frames(
+        websocket: WebSocket,
+        user_id: str,
+        exercise_choice: int = 1,
+        session_id: str = DEFAULT_SESSION_ID,
+        mode: str = "jpeg"
+):
+    """
+    Stream video frames of one session over a WebSocket.
+
+    - **user_id**: Unique identifier for the user
+    - **exercise_choice**: 1=Squat, 2=Curl, 3=Sit-up, 4=Lunge, 5=Pushup (default: 1)
+    - **session_id**: Session started with /start-session (default: "default")
+    - **mode**: "jpeg" for binary JPEG frames, "landmarks" for binary 33x3 little-endian
+      float32 landmark arrays (or text messages of the form {"landmarks": [[x, y, z], ...]})
+
+    Each processed frame is answered with a JSON message holding reps, state and
+    feedback. When inference falls behind, only the newest frame is kept and
+    stale frames are dropped, so latency stays bounded.
+    """
+    if mode not in ("jpeg", "landmarks") or exercise_choice not in exercise_registry:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    buffer = LatestFrameBuffer()
+
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    buffer.put(message["bytes"])
+                elif message.get("text") is not None and mode == "landmarks":
+                    try:
+                        buffer.put(np.asarray(json.loads(message["text"])["landmarks"], dtype=np.float32))
+                    except (ValueError, KeyError, TypeError) as e:
+                        print(f"Ignoring malformed landmark message: {e}")
+        finally:
+            buffer.close()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            frame, received_at = await buffer.get()
+            if frame is None:
+                break
+
+            try:
+                if mode == "landmarks":
+                    if isinstance(frame, bytes):
+                        frame = np.frombuffer(frame, dtype="<f4")
+                    response = await gym_trainer_service.process_landmarks(
+                        frame, user_id, exercise_choice, session_id
+                    )
+                else:
+                    response = await gym_trainer_service.process_frame(frame, user_id, exercise_choice, session_id)
+            except Exception as e:
+                response = {"error": f"Error processing frame: {str(e)}"}
+
+            response["frames_received"] = buffer.received
+            response["frames_dropped"] = buffer.dropped
+            response["latency_ms"] = round((time.perf_counter() - received_at) * 1000, 1)
+            await websocket.send_json(response)
+    except (WebSocketDisconnect, RuntimeError):
+        # Client went away while a response was being sent
+        pass
+    finally:
+        receiver.cancel()
+
+
 @router.post("/start-session")
 async def start_exercise_session(
         user_id: str = Body(...),
-        exercise_choice: Optional[int] = Body(1)
+        exercise_choice: Optional[int] = Body(1),
+        session_id: Optional[str] = Body(DEFAULT_SESSION_ID)
 ):
     """
     Start a new exercise tracking session.
 
     - **user_id**: Unique identifier for the user
     - **exercise_choice**: 1=Squat, 2=Curl, 3=Sit-up, 4=Lunge, 5=Pushup (default: 1)
+    - **session_id**: Identifier of the session, unique per user (default: "default")
     """
+    exercise = exercise_registry.get(exercise_choice)
+    if exercise is None:
+        raise HTTPException(status_code=400, detail="Invalid exercise_choice. See /exercises.")
+
     try:
-        # Reset the exercise tracking state
-        gym_trainer_service.reset_variables()
+        # Start fresh tracking state for this user's session only
+        await session_manager.start(user_id, session_id, exercise_choice)
 
         return {
             "message": "Exercise session started",
-            "exercise": ['', 'Squat', 'Curl', 'Sit-up', 'Lunge', 'Pushup'][exercise_choice],
+            "exercise": exercise.name,
             "user_id": user_id,
+            "session_id": session_id,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -68,43 +201,86 @@ async def start_exercise_session(
 
 @router.post("/end-session")
 async def end_exercise_session(
-        user_id: str = Body(...)
+        user_id: str = Body(...),
+        session_id: Optional[str] = Body(DEFAULT_SESSION_ID),
+        include_history: bool = Body(False),
+        history_points: Optional[int] = Body(None, ge=2),
+        history_mode: str = Body("downsample"),
+        db=Depends(get_optional_db)
 ):
     """
     End the current exercise session and save the data.
 
     - **user_id**: Unique identifier for the user
+    - **session_id**: Identifier of the session (default: "default")
+    - **include_history**: Add the angle history of the session's exercise to the summary
+    - **history_points**: Decimate the history to at most this many points per series
+    - **history_mode**: "downsample" (evenly spaced samples) or "minmax" (per-bucket extremes)
     """
+    if history_mode not in HISTORY_EXPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"history_mode must be one of {', '.join(HISTORY_EXPORT_MODES)}")
+
+    session = await session_manager.end(user_id, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Exercise session not found or expired")
+
     try:
         # Save the exercise data to the database
-        summary = await gym_trainer_service.save_exercise_data(user_id, None)
-
-        # Reset the state for the next session
-        gym_trainer_service.reset_variables()
+        summary = await gym_trainer_service.save_exercise_data(
+            session,
+            db=db,
+            exercise_choice=session.exercise_choice if include_history else None,
+            history_points=history_points,
+            history_mode=history_mode
+        )
 
         return {
             "message": "Exercise session completed",
             "summary": summary,
             "user_id": user_id,
+            "session_id": session_id,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error ending session: {str(e)}")
 
 
+# Fields of an exercise record returned by /history
+EXERCISE_HISTORY_PROJECTION = {"timestamp": 1, "exercise_type": 1, "reps": 1, "accuracy": 1, "feedback": 1}
+
+
+def format_exercise_record(record):
+    return dict(record, _id=str(record["_id"]))
+
+
 @router.get("/history/{user_id}")
-async def get_exercise_history(user_id: str):
+async def get_exercise_history(
+        user_id: str,
+        limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        db=Depends(get_db)
+):
     """
-    Get the exercise history for a specific user.
+    Get the exercise history for a specific user, newest first.
 
     - **user_id**: Unique identifier for the user
+    - **limit**: Records per page
+    - **cursor**: next_cursor of the previous page
     """
     try:
-        exercise_history = await get_user_exercise_history(user_id)
-        return {
-            "user_id": user_id,
-            "history": exercise_history
-        }
+        return await stream_history_page(
+            db.exercise_records,
+            {"user_id": user_id},
+            EXERCISE_HISTORY_PROJECTION,
+            format_exercise_record,
+            items_key="history",
+            fields={"user_id": user_id},
+            limit=limit,
+            cursor=cursor,
+            wrap_data=False
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving exercise history: {str(e)}")
 
@@ -113,10 +289,7 @@ async def get_exercise_history(user_id: str):
 async def get_available_exercises():
     """Get a list of available exercises."""
     exercises = [
-        {"id": 1, "name": "Squat", "target_muscles": ["Quadriceps", "Glutes", "Hamstrings"]},
-        {"id": 2, "name": "Arm Curl", "target_muscles": ["Biceps", "Forearms"]},
-        {"id": 3, "name": "Sit-up", "target_muscles": ["Core", "Abdominal Muscles"]},
-        {"id": 4, "name": "Lunge", "target_muscles": ["Quadriceps", "Glutes", "Calves"]},
-        {"id": 5, "name": "Push-up", "target_muscles": ["Chest", "Triceps", "Core"]}
+        {"id": exercise.id, "name": exercise.display_name, "target_muscles": exercise.target_muscles}
+        for exercise in exercise_registry
     ]
     return {"exercises": exercises}
\ No newline at end of file
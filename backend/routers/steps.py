@@ -1,16 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Request
+import json
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
 from typing import Dict, Any, Optional, List
-from datetime import datetime
-import os
-import requests
-import time
+from datetime import datetime, timedelta, date
 
 # Import steps service
 from services.ai_steps import get_steps_count, save_steps_data
+from services.steps_store import steps_totals, PERIOD_FORMATS
+from services.google_fit import google_fit
+from services.steps_ingest import (
+    ingest_steps, parse_ndjson, parse_columnar, NDJSON_CONTENT_TYPES, STEPS_INGEST_MAX_BYTES
+)
+from services.steps_rollups import (
+    leaderboard, goal_reached, mark_rewarded, current_key, STEP_GOALS, LEADERBOARD_MAX_SIZE, GOAL_QUERY_MAX_SIZE
+)
+from services.uploads import LimitedBodyRoute, max_body_size
+from database.mongodb import get_db, get_optional_db
+from database.pagination import stream_history_page, HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE
 
-router = APIRouter()
+router = APIRouter(route_class=LimitedBodyRoute)
 
 
 class TokenInfo(BaseModel):
@@ -25,29 +34,37 @@ class StepsRequest(BaseModel):
     time_range: Optional[str] = "today"  # today, week, month
 
 
+class MarkRewardedRequest(BaseModel):
+    period: str  # day, week, month
+    key: str
+    user_ids: List[str]
+
+
 class SaveStepsRequest(BaseModel):
     user_id: str
     steps_data: Dict[str, Any]
 
 
 @router.post("/get-steps")
-async def fetch_steps_count(request: StepsRequest):
+async def fetch_steps_count(request: StepsRequest, db=Depends(get_optional_db)):
     """
     Fetch steps count from Google Fit API
     """
     return await get_steps_count(
         user_id=request.user_id,
         token_info=request.token_info.dict(),
-        time_range=request.time_range
+        time_range=request.time_range,
+        db=db
     )
 
 
 @router.post("/save-steps")
-async def save_steps(request: SaveStepsRequest):
+async def save_steps(request: SaveStepsRequest, db=Depends(get_db)):
     """
     Save steps data to database
     """
     result_id = await save_steps_data(
+        db,
         user_id=request.user_id,
         steps_data=request.steps_data
     )
@@ -60,43 +77,179 @@ async def save_steps(request: SaveStepsRequest):
     }
 
 
-@router.get("/summary/{user_id}")
-async def get_steps_summary(user_id: str, days: int = 7):
+@router.post("/ingest")
+@max_body_size(STEPS_INGEST_MAX_BYTES)
+async def ingest_steps_bulk(request: Request, db=Depends(get_db)):
     """
-    Get a summary of steps data for a user over a specified number of days
+    Bulk upsert daily step counts for many users, e.g. to backfill wearable history.
+
+    Send NDJSON (Content-Type application/x-ndjson), one {"user_id", "date", "steps"} per line,
+    or JSON series of consecutive days or dates with steps as a list or base64 little-endian int32
+    (see parse_columnar()). Invalid rows are skipped and reported; the rest are written.
     """
-    from database.mongodb import db
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    body = await request.body()
+
+    try:
+        if content_type in NDJSON_CONTENT_TYPES:
+            columns = parse_ndjson(body)
+        elif content_type == "application/json":
+            columns = parse_columnar(json.loads(body))
+        else:
+            raise HTTPException(
+                status_code=415,
+                detail=f"Content-Type must be application/json or one of {', '.join(NDJSON_CONTENT_TYPES)}"
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        result = await ingest_steps(db, columns)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to ingest steps: {str(e)}")
+
+    return {
+        "status": "success",
+        "data": result
+    }
+
+
+def format_steps_record(doc):
+    return {
+        "date": doc["timestamp"].strftime("%Y-%m-%d"),
+        "steps_data": doc["steps_data"]
+    }
 
+
+@router.get("/summary/{user_id}")
+async def get_steps_summary(
+        user_id: str,
+        days: int = 7,
+        limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        db=Depends(get_db)
+):
+    """
+    Get a summary of steps data for a user over a specified number of days, newest first.
+    Pass the returned next_cursor as cursor to get the next page.
+    """
     # Calculate date range
     end_date = datetime.utcnow()
-    start_date = datetime(end_date.year, end_date.month, end_date.day) - datetime.timedelta(days=days)
+    start_date = datetime(end_date.year, end_date.month, end_date.day) - timedelta(days=days)
 
     try:
-        # Query the database for steps data within the date range
-        cursor = db.steps_data.find({
-            "user_id": user_id,
-            "timestamp": {"$gte": start_date, "$lte": end_date}
-        }).sort("timestamp", -1)
-
-        steps_history = []
-        async for doc in cursor:
-            steps_history.append({
-                "date": doc["timestamp"].strftime("%Y-%m-%d"),
-                "steps_data": doc["steps_data"]
-            })
-
-        return {
-            "status": "success",
-            "data": {
-                "user_id": user_id,
-                "days": days,
-                "steps_history": steps_history
-            }
-        }
+        # Stream the page of steps data within the date range
+        return await stream_history_page(
+            db.steps_data,
+            {"user_id": user_id, "timestamp": {"$gte": start_date, "$lte": end_date}},
+            {"timestamp": 1, "steps_data": 1},
+            format_steps_record,
+            items_key="steps_history",
+            fields={"user_id": user_id, "days": days},
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch steps summary: {str(e)}")
 
 
+@router.get("/totals/{user_id}")
+async def get_steps_totals(
+        user_id: str,
+        start: date,
+        end: Optional[date] = None,
+        group_by: str = "day",
+        db=Depends(get_db)
+):
+    """
+    Get step totals for a user over a date range (inclusive, UTC days) from the synced daily buckets,
+    grouped by day, week or month.
+    """
+    end = end or datetime.utcnow().date()
+    if group_by not in PERIOD_FORMATS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(PERIOD_FORMATS)}")
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    try:
+        totals = await steps_totals(db, user_id, start, end, group_by=group_by)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch steps totals: {str(e)}")
+
+    return {
+        "status": "success",
+        "data": dict(totals, user_id=user_id, start=start.isoformat(), end=end.isoformat(), group_by=group_by)
+    }
+
+
+def _check_period(period):
+    if period not in STEP_GOALS:
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(STEP_GOALS)}")
+
+
+@router.get("/leaderboard")
+async def get_leaderboard(
+        period: str = "week",
+        key: Optional[str] = None,
+        limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_SIZE),
+        db=Depends(get_db)
+):
+    """
+    Get the users with the most steps in a day, ISO week or month (key such as 2026-10-18, 2026-W42
+    or 2026-10; defaults to the current one), from the materialized rollups.
+    """
+    _check_period(period)
+    key = key or current_key(period)
+    try:
+        entries = await leaderboard(db, period, key, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch leaderboard: {str(e)}")
+
+    return {
+        "status": "success",
+        "data": {"period": period, "key": key, "leaderboard": entries}
+    }
+
+
+@router.get("/goal-reached")
+async def get_goal_reached(
+        period: str = "day",
+        key: Optional[str] = None,
+        goal: Optional[int] = Query(None, ge=1),
+        unrewarded_only: bool = True,
+        limit: int = Query(1000, ge=1, le=GOAL_QUERY_MAX_SIZE),
+        db=Depends(get_db)
+):
+    """
+    Get the users who reached the step goal of a period, by default only those not marked as rewarded yet.
+    """
+    _check_period(period)
+    key = key or current_key(period)
+    try:
+        users = await goal_reached(db, period, key, goal, unrewarded_only, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch goal progress: {str(e)}")
+
+    return {
+        "status": "success",
+        "data": {"period": period, "key": key, "goal": goal or STEP_GOALS[period], "users": users}
+    }
+
+
+@router.post("/goal-reached/mark-rewarded")
+async def post_mark_rewarded(request: MarkRewardedRequest, db=Depends(get_db)):
+    """
+    Mark users as rewarded for a period so they no longer show up in goal-reached.
+    """
+    _check_period(request.period)
+    marked = await mark_rewarded(db, request.period, request.key, request.user_ids)
+
+    return {
+        "status": "success",
+        "data": {"marked": marked}
+    }
 
 
 @router.get("/auth/callback")
@@ -141,34 +294,18 @@ async def auth_callback(request: Request, code: str = None, error: str = None):
 
 
 @router.post("/exchange-token")
-async def exchange_token(code: str = Body(...)):
+async def exchange_token(code: str = Body(...), db=Depends(get_optional_db)):
     """
     Exchange authorization code for access and refresh tokens
     """
-    token_url = "https://oauth2.googleapis.com/token"
-    client_id = os.getenv("GOOGLE_CLIENT_ID")
-    client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
     redirect_uri = "http://localhost:8000/auth/callback"
 
-    payload = {
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "code": code,
-        "redirect_uri": redirect_uri,
-        "grant_type": "authorization_code"
-    }
-
     try:
-        response = requests.post(token_url, data=payload)
-        token_data = response.json()
+        token_data = await google_fit.tokens.exchange_code(code, redirect_uri, db=db)
 
         if "error" in token_data:
             return {"status": "error", "message": token_data.get("error_description", token_data["error"])}
 
-        # Calculate expiration time
-        if "expires_in" in token_data:
-            token_data["expires_at"] = int(time.time()) + token_data["expires_in"]
-
         return {"status": "success", "data": token_data}
     except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
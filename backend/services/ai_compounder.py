@@ -1,33 +1,32 @@
-import os
 import base64
-import json
 import datetime
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
-from openai import OpenAI
+from services.llm_gateway import chat_completion_json
+from services.report_dedup import report_analysis_cache, report_fingerprint
 from database.mongodb import save_conversation
+from database.write_behind import insert_document
+from database.pagination import history_cache
 
 # Load environment variables
 load_dotenv()
 
-# OpenAI API configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
 
-
-async def analyze_medical_report(image_data, user_id=None):
+async def analyze_medical_report(image_data, user_id=None, db=None, content_sha256=None):
     """
     Analyze medical reports and prescriptions using OpenAI's GPT-4o.
 
     Args:
         image_data: The medical report or prescription image data
         user_id: The ID of the user (optional)
+        db: Database to keep the conversation history in (optional)
+        content_sha256: SHA-256 of image_data if already computed while reading it
 
     Returns:
         dict: Analysis results including summary, medications, and recommendations
     """
-    try:
-        # Convert image data to base64 for OpenAI API
-        base64_image = base64.b64encode(image_data).decode('utf-8')
+    async def analyze(image):
+        base64_image = base64.b64encode(image["data"]).decode('utf-8')
 
         # Construct the prompt for GPT-4o
         prompt = """
@@ -44,25 +43,42 @@ async def analyze_medical_report(image_data, user_id=None):
         - concerns: Any warnings or potential issues to be aware of
         """
 
-        # Call the OpenAI API with the image and prompt
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        # Call the OpenAI API through the shared gateway with the image and prompt
+        return await chat_completion_json(
             messages=[
                 {"role": "system",
                  "content": "You are a medical assistant that analyzes medical reports and prescriptions."},
                 {"role": "user", "content": [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    {"type": "image_url", "image_url": {"url": f"data:{image['mime_type']};base64,{base64_image}"}}
                 ]}
-            ],
-            response_format={"type": "json_object"}
+            ]
         )
 
-        # Extract and parse the JSON response
-        analysis_result = json.loads(response.choices[0].message.content)
+    try:
+        # Reuse the analysis of an earlier upload of the same report; otherwise orient, downscale and
+        # re-encode the upload in the worker pool and send it to the model
+        analysis_result, details = await report_analysis_cache.get_or_analyze(
+            image_data, analyze, user_id=user_id, db=db, sha256=content_sha256
+        )
+        image = details.get("image")
+        fingerprint = report_fingerprint(details["content_sha256"], details["dhash"])
+
+        if details.get("match"):
+            # Nothing new was said to the user, so there is no conversation to save
+            return {
+                "status": "success",
+                "data": analysis_result,
+                "duplicate": {
+                    "match": details["match"],
+                    "distance": details["distance"],
+                    "report_id": details["report_id"]
+                },
+                "fingerprint": fingerprint
+            }
 
         # Save the analysis to conversation history if user_id is provided
-        if user_id:
+        if user_id and db is not None:
             try:
                 # We can't save the actual image in the conversation history,
                 # so we'll save the analysis results
@@ -72,16 +88,28 @@ async def analyze_medical_report(image_data, user_id=None):
                     "response": analysis_result,
                     "metadata": {
                         "image_analyzed": True,
-                        "image_size": len(image_data)
+                        "image_size": len(image_data),
+                        "sent_image_size": len(image["data"]),
+                        "content_sha256": details["content_sha256"]
                     }
                 }
-                await save_conversation("compounder_conversations", user_id, conversation_data)
+                await save_conversation(db, "compounder_conversations", user_id, conversation_data)
             except Exception as e:
                 print(f"Error saving medical report analysis conversation: {e}")
 
         return {
             "status": "success",
-            "data": analysis_result
+            "data": analysis_result,
+            "duplicate": None,
+            "fingerprint": fingerprint,
+            "image": {
+                "original_size": len(image_data),
+                "sent_size": len(image["data"]),
+                "mime_type": image["mime_type"],
+                "width": image.get("width"),
+                "height": image.get("height"),
+                "preprocess_ms": image.get("preprocess_ms")
+            }
         }
     except Exception as e:
         return {
@@ -90,28 +118,51 @@ async def analyze_medical_report(image_data, user_id=None):
         }
 
 
-async def save_analysis_to_db(user_id, report_data, analysis_result):
+async def _upsert_report(db, record):
+    """Insert a fingerprinted report unless the user already has one for the image; returns its _id."""
+    query = {"content_sha256": record["content_sha256"], "user_id": record["user_id"]}
+    try:
+        result = await db.medical_reports.update_one(query, {"$setOnInsert": record}, upsert=True)
+        if result.upserted_id is not None:
+            return result.upserted_id
+    except DuplicateKeyError:
+        # Another worker inserted it between the match and the insert
+        pass
+    existing = await db.medical_reports.find_one(query, {"_id": 1})
+    return existing["_id"]
+
+
+async def save_analysis_to_db(db, user_id, report_data, analysis_result, fingerprint=None):
     """
     Save the medical report analysis to the database.
 
     Args:
+        db: The database
         user_id: The ID of the user
         report_data: Original report data
         analysis_result: The results of the analysis
+        fingerprint: Content and perceptual hashes of the image (see report_fingerprint())
 
     Returns:
         str: The ID of the saved record
     """
-    # Updated to actually save to MongoDB
-    from database.mongodb import db
+    record = dict(fingerprint or {}, **{
+        "user_id": user_id,
+        "timestamp": datetime.datetime.utcnow(),
+        "report_data": report_data,
+        "analysis_result": analysis_result
+    })
     try:
-        result = await db.medical_reports.insert_one({
-            "user_id": user_id,
-            "timestamp": datetime.datetime.utcnow(),
-            "report_data": report_data,
-            "analysis_result": analysis_result
-        })
-        return str(result.inserted_id)
+        if fingerprint:
+            # Written right away rather than through the write-behind queue, so a concurrent
+            # upload of the same image by this user gets the same report instead of a lost insert
+            record_id = await _upsert_report(db, record)
+        else:
+            record_id = await insert_document(db, "medical_reports", record)
+        history_cache.invalidate("medical_reports", user_id)
+        if fingerprint:
+            report_analysis_cache.remember_report(fingerprint["content_sha256"], user_id, str(record_id))
+        return str(record_id)
     except Exception as e:
         print(f"Error saving analysis to db: {e}")
         return "report_analysis_id_error"
\ No newline at end of file
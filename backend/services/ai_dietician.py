@@ -1,107 +1,115 @@
-import os
 import json
 import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
-from database.mongodb import save_conversation, get_user_conversations
+from services.llm_gateway import chat_completion_json, chat_completion_stream, DEFAULT_MODEL
+from services.streaming import JSONFieldParser
+from services.health_prediction_cache import health_prediction_cache, normalize_profile, profile_key
+from services.context_builder import build_context, summarize_turn
+from database.mongodb import save_conversation
+from database.write_behind import insert_document
+from database.pagination import history_cache
 
 # Load environment variables
 load_dotenv()
 
-# OpenAI API configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
+DIETICIAN_SYSTEM_PROMPT = "You are a nutritionist and dietitian assistant."
 
 
-async def generate_diet_plan(user_data):
+async def _build_diet_prompt(user_data, db=None):
+    """Prompt for a diet plan, with summaries of the user's recent plans for context."""
+    # Summaries of the user's recent diet plans keep the context within the token budget
+    user_id = user_data.get("user_id")
+    past_context = ""
+
+    if user_id and db is not None:
+        try:
+            turns = await build_context(
+                db, "diet_conversations", user_id,
+                query={"response.daily_calories": {"$exists": True}}, max_turns=3, full_turns=0
+            )
+            if turns:
+                past_context = "\nPrevious diet plans for this user (oldest first):\n" + "\n".join(
+                    f"- {turn['content']}" for turn in turns
+                )
+        except Exception as e:
+            print(f"Error retrieving diet conversation history: {e}")
+
+    # Construct the prompt for GPT-4o
+    prompt = f"""
+    Generate a personalized diet plan for a {user_data.get('age')}-year-old {user_data.get('sex')} 
+    with the following characteristics:
+    - Weight: {user_data.get('weight')} kg
+    - Height: {user_data.get('height')} cm
+    - Health issues: {', '.join(user_data.get('health_issues', ['None reported']))}
+    - Sleep patterns: {user_data.get('sleep_hours', 'Not specified')} hours per night
+    - Activity level: {user_data.get('activity_level', 'Not specified')}
+    - Dietary preferences: {', '.join(user_data.get('dietary_preferences', ['None specified']))}
+    - Allergies: {', '.join(user_data.get('allergies', ['None reported']))}{past_context}
+
+    Please include:
+    1. Daily calorie recommendation
+    2. Macronutrient ratio (protein, carbs, fats)
+    3. Meal plan with specific food suggestions
+    4. Hydration recommendations
+    5. Supplement suggestions if appropriate
+    6. Lifestyle recommendations
+
+    Format your response as a structured JSON with these fields:
+    - daily_calories: recommended daily calorie intake
+    - macronutrient_ratio: object with protein, carbohydrates, and fats percentages
+    - meal_plan: object with arrays for breakfast, lunch, dinner, and snacks
+    - hydration: water intake recommendation
+    - supplements: any recommended supplements
+    - lifestyle_recommendations: array of lifestyle suggestions
+    """
+    return prompt
+
+
+async def _save_diet_conversation(user_data, diet_plan, db=None):
+    user_id = user_data.get("user_id")
+    # Save the diet plan to conversation history
+    if user_id and db is not None:
+        try:
+            conversation_data = {
+                "timestamp": datetime.datetime.utcnow(),
+                "query": f"Diet plan request for {user_data.get('age')}-year-old {user_data.get('sex')}",
+                "response": diet_plan,
+                "context_summary": summarize_turn("diet_conversations", diet_plan),
+                "metadata": {
+                    "health_issues": user_data.get('health_issues', []),
+                    "dietary_preferences": user_data.get('dietary_preferences', []),
+                    "allergies": user_data.get('allergies', [])
+                }
+            }
+            await save_conversation(db, "diet_conversations", user_id, conversation_data)
+        except Exception as e:
+            print(f"Error saving diet conversation: {e}")
+
+
+async def generate_diet_plan(user_data, db=None):
     """
     Generate a personalized diet plan based on user data using OpenAI's GPT-4o.
 
     Args:
         user_data: User health information including weight, age, sex,
                   health issues, sleep patterns, and lifestyle
+        db: Database holding the conversation history (optional)
 
     Returns:
         dict: Personalized diet plan and lifestyle recommendations
     """
     try:
-        # Check for past conversations to maintain context
-        user_id = user_data.get("user_id")
-        past_conversations = []
-
-        if user_id:
-            try:
-                stored_conversations = await get_user_conversations("diet_conversations", user_id, limit=3)
-                for conv in stored_conversations:
-                    # Only include relevant past diet plans in the context
-                    if "response" in conv and "daily_calories" in conv["response"]:
-                        past_conversations.append(conv["response"])
-            except Exception as e:
-                print(f"Error retrieving diet conversation history: {e}")
-
-        # Include past conversation context in the prompt if available
-        past_context = ""
-        if past_conversations:
-            past_context = "\nPrevious diet plans for this user: " + json.dumps(past_conversations)
-
-        # Construct the prompt for GPT-4o
-        prompt = f"""
-        Generate a personalized diet plan for a {user_data.get('age')}-year-old {user_data.get('sex')} 
-        with the following characteristics:
-        - Weight: {user_data.get('weight')} kg
-        - Height: {user_data.get('height')} cm
-        - Health issues: {', '.join(user_data.get('health_issues', ['None reported']))}
-        - Sleep patterns: {user_data.get('sleep_hours', 'Not specified')} hours per night
-        - Activity level: {user_data.get('activity_level', 'Not specified')}
-        - Dietary preferences: {', '.join(user_data.get('dietary_preferences', ['None specified']))}
-        - Allergies: {', '.join(user_data.get('allergies', ['None reported']))}{past_context}
+        prompt = await _build_diet_prompt(user_data, db)
 
-        Please include:
-        1. Daily calorie recommendation
-        2. Macronutrient ratio (protein, carbs, fats)
-        3. Meal plan with specific food suggestions
-        4. Hydration recommendations
-        5. Supplement suggestions if appropriate
-        6. Lifestyle recommendations
-
-        Format your response as a structured JSON with these fields:
-        - daily_calories: recommended daily calorie intake
-        - macronutrient_ratio: object with protein, carbohydrates, and fats percentages
-        - meal_plan: object with arrays for breakfast, lunch, dinner, and snacks
-        - hydration: water intake recommendation
-        - supplements: any recommended supplements
-        - lifestyle_recommendations: array of lifestyle suggestions
-        """
-
-        # Call the OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        # Call the OpenAI API through the shared gateway
+        diet_plan = await chat_completion_json(
             messages=[
-                {"role": "system", "content": "You are a nutritionist and dietitian assistant."},
+                {"role": "system", "content": DIETICIAN_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
+            ]
         )
 
-        # Extract and parse the JSON response
-        diet_plan = json.loads(response.choices[0].message.content)
-
-        # Save the diet plan to conversation history
-        if user_id:
-            try:
-                conversation_data = {
-                    "timestamp": datetime.datetime.utcnow(),
-                    "query": f"Diet plan request for {user_data.get('age')}-year-old {user_data.get('sex')}",
-                    "response": diet_plan,
-                    "metadata": {
-                        "health_issues": user_data.get('health_issues', []),
-                        "dietary_preferences": user_data.get('dietary_preferences', []),
-                        "allergies": user_data.get('allergies', [])
-                    }
-                }
-                await save_conversation("diet_conversations", user_id, conversation_data)
-            except Exception as e:
-                print(f"Error saving diet conversation: {e}")
+        await _save_diet_conversation(user_data, diet_plan, db)
 
         return {
             "status": "success",
@@ -114,33 +122,70 @@ async def generate_diet_plan(user_data):
         }
 
 
-async def predict_health_metrics(user_data):
+async def stream_diet_plan(user_data, db=None):
+    """
+    Streaming variant of generate_diet_plan().
+
+    Yields a ("field", {"name", "value"}) event for each field of the plan as
+    soon as the model has written it, then ("done", response) with the same
+    response generate_diet_plan() returns. The plan is saved to the
+    conversation history once it is complete.
+
+    Args:
+        user_data: User health information including weight, age, sex,
+                  health issues, sleep patterns, and lifestyle
+        db: Database holding the conversation history (optional)
+    """
+    prompt = await _build_diet_prompt(user_data, db)
+
+    parser = JSONFieldParser()
+    messages = [
+        {"role": "system", "content": DIETICIAN_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    async for delta in chat_completion_stream(messages, response_format={"type": "json_object"}):
+        for name, value in parser.feed(delta):
+            yield "field", {"name": name, "value": value}
+
+    diet_plan = parser.result()
+    await _save_diet_conversation(user_data, diet_plan, db)
+    yield "done", {
+        "status": "success",
+        "data": diet_plan
+    }
+
+
+async def predict_health_metrics(user_data, db=None):
     """
     Predict health metrics like average lifespan and disease risks using OpenAI's GPT-4o.
 
     Args:
         user_data: User health information and lifestyle data
+        db: Database holding the conversation history and shared prediction cache (optional)
 
     Returns:
-        dict: Predicted health metrics and risk assessments
+        dict: Predicted health metrics and risk assessments, and whether they came from the cache
     """
     try:
         # Get user ID for saving conversation
         user_id = user_data.get("user_id")
 
+        # The prediction only depends on the normalized profile, so identical profiles share one answer
+        profile = normalize_profile(user_data)
+
         # Construct the prompt for GPT-4o
         prompt = f"""
         Based on the following health information, provide predictions about potential health metrics 
-        and disease risks for a {user_data.get('age')}-year-old {user_data.get('sex')}:
+        and disease risks for a {profile['age']}-year-old {profile['sex']}:
 
-        - Weight: {user_data.get('weight')} kg
-        - Height: {user_data.get('height')} cm
-        - Health issues: {', '.join(user_data.get('health_issues', ['None reported']))}
-        - Sleep patterns: {user_data.get('sleep_hours', 'Not specified')} hours per night
-        - Activity level: {user_data.get('activity_level', 'Not specified')}
-        - Family history: {json.dumps(user_data.get('family_history', {}))}
-        - Current medications: {', '.join(user_data.get('current_medications', ['None']))}
-        - Daily routine: {user_data.get('daily_routine', 'Not specified')}
+        - Weight: {profile['weight']} kg
+        - Height: {profile['height']} cm
+        - Health issues: {', '.join(profile['health_issues'] or ['None reported'])}
+        - Sleep patterns: {profile['sleep_hours'] or 'Not specified'} hours per night
+        - Activity level: {profile['activity_level'] or 'Not specified'}
+        - Family history: {json.dumps(profile['family_history'])}
+        - Current medications: {', '.join(profile['current_medications'] or ['None'])}
+        - Daily routine: {profile['daily_routine'] or 'Not specified'}
 
         Please include:
         1. Estimated lifespan based on statistical averages
@@ -155,22 +200,24 @@ async def predict_health_metrics(user_data):
         - disclaimer: clear statement about limitations of these predictions
         """
 
-        # Call the OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system",
-                 "content": "You are a health analytics assistant. Provide health predictions based on statistical averages while clearly stating limitations."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
+        # Call the OpenAI API through the shared gateway, unless this profile was answered recently
+        async def predict():
+            return await chat_completion_json(
+                messages=[
+                    {"role": "system",
+                     "content": "You are a health analytics assistant. Provide health predictions based on statistical averages while clearly stating limitations."},
+                    {"role": "user", "content": prompt}
+                ],
+                model=DEFAULT_MODEL
+            )
 
-        # Extract and parse the JSON response
-        health_predictions = json.loads(response.choices[0].message.content)
+        health_predictions, cached = await health_prediction_cache.get_or_compute(
+            profile_key(profile, DEFAULT_MODEL), predict, db=db
+        )
 
-        # Save the health predictions to conversation history
-        if user_id:
+        # Save the health predictions to this user's conversation history, cached or not:
+        # the cache is shared by every user with the same profile
+        if user_id and db is not None:
             try:
                 conversation_data = {
                     "timestamp": datetime.datetime.utcnow(),
@@ -178,16 +225,18 @@ async def predict_health_metrics(user_data):
                     "response": health_predictions,
                     "metadata": {
                         "health_issues": user_data.get('health_issues', []),
-                        "family_history": user_data.get('family_history', {})
+                        "family_history": user_data.get('family_history', {}),
+                        "cached": cached
                     }
                 }
-                await save_conversation("diet_conversations", user_id, conversation_data)
+                await save_conversation(db, "diet_conversations", user_id, conversation_data)
             except Exception as e:
                 print(f"Error saving health metrics conversation: {e}")
 
         return {
             "status": "success",
-            "data": health_predictions
+            "data": health_predictions,
+            "cached": cached
         }
     except Exception as e:
         return {
@@ -196,11 +245,12 @@ async def predict_health_metrics(user_data):
         }
 
 
-async def save_diet_plan(user_id, diet_plan):
+async def save_diet_plan(db, user_id, diet_plan):
     """
     Save the generated diet plan to the database.
 
     Args:
+        db: The database
         user_id: The ID of the user
         diet_plan: The generated diet plan
 
@@ -209,14 +259,14 @@ async def save_diet_plan(user_id, diet_plan):
     """
     # This function is now being used primarily in the router file
     # The conversation saving is handled in the generate_diet_plan function
-    from database.mongodb import db
     try:
-        result = await db.diet_plans.insert_one({
+        record_id = await insert_document(db, "diet_plans", {
             "user_id": user_id,
             "timestamp": datetime.datetime.utcnow(),
             "diet_plan": diet_plan
         })
-        return str(result.inserted_id)
+        history_cache.invalidate("diet_plans", user_id)
+        return str(record_id)
     except Exception as e:
         print(f"Error saving diet plan: {e}")
         return "diet_plan_id_error"
\ No newline at end of file
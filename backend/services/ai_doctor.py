@@ -1,19 +1,120 @@
-import os
-import json
 import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
-from database.mongodb import save_conversation, get_user_conversations
+from services.llm_gateway import chat_completion_json, chat_completion_stream
+from services.streaming import JSONFieldParser
+from services.doctor_directory import doctor_repository
+from services.context_builder import (
+    CONTEXT_TOKEN_BUDGETS, build_context, context_messages, summarize_turn, trim_messages
+)
+from database.mongodb import save_conversation
 
 # Load environment variables
 load_dotenv()
 
-# OpenAI API configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=OPENAI_API_KEY)
 
+async def _build_medical_messages(user_id, query, conversation_history=None, db=None):
+    """Chat messages for a medical query: instructions, history within the token budget, then the query."""
+    # If no conversation history was provided, rebuild it from the database within the token budget
+    if not conversation_history and db is not None:
+        try:
+            turns = await build_context(db, "medical_conversations", user_id, max_turns=5)
+            conversation_history = context_messages(turns)
+        except Exception as e:
+            print(f"Error retrieving conversation history: {e}")
+            conversation_history = []
+    elif conversation_history:
+        conversation_history = trim_messages(conversation_history, CONTEXT_TOKEN_BUDGETS["medical_conversations"])
+
+    # Prepare messages for the API
+    messages = [
+        {"role": "system", "content": """
+        You are an AI medical assistant. Provide helpful information about medical conditions and symptoms.
+        Always include appropriate disclaimers that you are not a replacement for professional medical advice.
+        Format your response as a structured JSON with the following fields:
+        - answer: Your informative response to the query
+        - possible_conditions: An array of potential conditions related to the described symptoms
+        - recommendations: General advice and suggestion to consult with a healthcare provider
+        - doctor_referrals: An array of specialist types that would be appropriate to consult
+        - precautions: Immediate steps or precautions the person should take
+        - disclaimer: A clear medical disclaimer
+        """}
+    ]
+
+    # Add conversation history if available
+    if conversation_history:
+        for message in conversation_history:
+            messages.append({
+                "role": message.get("role", "user"),
+                "content": message.get("content", "")
+            })
+
+    # Add the current query
+    messages.append({"role": "user", "content": query})
+    return messages
+
+
+async def _complete_medical_response(user_id, query, medical_response, db=None):
+    """Attach the matching doctors to a model answer, save the conversation and build the response."""
+    # Format doctor referrals if not in expected format
+    if "doctor_referrals" in medical_response and not isinstance(medical_response["doctor_referrals"], list):
+        medical_response["doctor_referrals"] = [
+            {
+                "name": "Healthcare Provider",
+                "specialty": medical_response["doctor_referrals"],
+                "contact": "Consult local directory"
+            }
+        ]
 
-async def process_medical_query(user_id, query, conversation_history=None):
+    # Filter doctors based on recommended specialties if possible
+    recommended_specialties = []
+    if "doctor_referrals" in medical_response and isinstance(medical_response["doctor_referrals"], list):
+        for referral in medical_response["doctor_referrals"]:
+            if isinstance(referral, str):
+                recommended_specialties.append(referral.lower())
+            elif isinstance(referral, dict) and "specialty" in referral:
+                recommended_specialties.append(referral["specialty"].lower())
+
+    # Get the list of doctors, marking those matching a recommended specialty as relevant
+    doctors = await get_doctor_list()
+    relevant_doctors = []
+    if recommended_specialties:
+        try:
+            relevant_names = {
+                doctor["name"] for doctor in doctor_repository.find_by_specialties(recommended_specialties)
+            }
+        except Exception as e:
+            print(f"Error matching doctors to specialties: {e}")
+            relevant_names = set()
+
+        doctors = [dict(doctor, relevant=doctor.get("name") in relevant_names) for doctor in doctors]
+        relevant_doctors = [doctor for doctor in doctors if doctor["relevant"]]
+
+    # Save the conversation to the database
+    if db is not None:
+        try:
+            conversation_data = {
+                "timestamp": datetime.datetime.utcnow(),
+                "query": query,
+                "response": medical_response,
+                "context_summary": summarize_turn("medical_conversations", medical_response),
+                "metadata": {
+                    "recommended_specialties": recommended_specialties
+                }
+            }
+            await save_conversation(db, "medical_conversations", user_id, conversation_data)
+        except Exception as e:
+            print(f"Error saving conversation: {e}")
+
+    # Include both the medical response and the doctor list in the return value
+    return {
+        "status": "success",
+        "data": medical_response,
+        "doctors": doctors,
+        "relevant_doctors": relevant_doctors if recommended_specialties and relevant_doctors else None
+    }
+
+
+async def process_medical_query(user_id, query, conversation_history=None, db=None):
     """
     Process a medical query using OpenAI's GPT-4o and provide personalized answers.
     Also includes a list of available doctors in the response.
@@ -22,118 +123,18 @@ async def process_medical_query(user_id, query, conversation_history=None):
         user_id: The ID of the user
         query: The medical query text
         conversation_history: Previous conversation for context
+        db: Database holding the conversation history (optional)
 
     Returns:
         dict: Medical advice, potential diagnoses, doctor recommendations, and a list of available doctors
     """
     try:
-        # If no conversation history was provided, fetch from database
-        if not conversation_history:
-            try:
-                stored_conversations = await get_user_conversations("medical_conversations", user_id, limit=5)
-                conversation_history = []
-                for conv in stored_conversations:
-                    conversation_history.append({"role": "user", "content": conv["query"]})
-                    conversation_history.append({"role": "assistant", "content": json.dumps(conv["response"])})
-            except Exception as e:
-                print(f"Error retrieving conversation history: {e}")
-                conversation_history = []
-
-        # Prepare messages for the API
-        messages = [
-            {"role": "system", "content": """
-            You are an AI medical assistant. Provide helpful information about medical conditions and symptoms.
-            Always include appropriate disclaimers that you are not a replacement for professional medical advice.
-            Format your response as a structured JSON with the following fields:
-            - answer: Your informative response to the query
-            - possible_conditions: An array of potential conditions related to the described symptoms
-            - recommendations: General advice and suggestion to consult with a healthcare provider
-            - doctor_referrals: An array of specialist types that would be appropriate to consult
-            - precautions: Immediate steps or precautions the person should take
-            - disclaimer: A clear medical disclaimer
-            """}
-        ]
+        messages = await _build_medical_messages(user_id, query, conversation_history, db)
 
-        # Add conversation history if available
-        if conversation_history:
-            for message in conversation_history:
-                messages.append({
-                    "role": message.get("role", "user"),
-                    "content": message.get("content", "")
-                })
-
-        # Add the current query
-        messages.append({"role": "user", "content": query})
-
-        # Call the OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            response_format={"type": "json_object"}
-        )
-
-        # Extract and parse the JSON response
-        medical_response = json.loads(response.choices[0].message.content)
-
-        # Format doctor referrals if not in expected format
-        if "doctor_referrals" in medical_response and not isinstance(medical_response["doctor_referrals"], list):
-            medical_response["doctor_referrals"] = [
-                {
-                    "name": "Healthcare Provider",
-                    "specialty": medical_response["doctor_referrals"],
-                    "contact": "Consult local directory"
-                }
-            ]
-
-        # Get the list of doctors
-        doctors = await get_doctor_list()
-
-        # Filter doctors based on recommended specialties if possible
-        recommended_specialties = []
-        if "doctor_referrals" in medical_response and isinstance(medical_response["doctor_referrals"], list):
-            for referral in medical_response["doctor_referrals"]:
-                if isinstance(referral, str):
-                    recommended_specialties.append(referral.lower())
-                elif isinstance(referral, dict) and "specialty" in referral:
-                    recommended_specialties.append(referral["specialty"].lower())
-
-        # If we have specialties to filter by, create a relevant_doctors list
-        relevant_doctors = []
-        if recommended_specialties:
-            for doctor in doctors:
-                if "specialty" in doctor and any(
-                        specialty in doctor["specialty"].lower() for specialty in recommended_specialties):
-                    # Mark this doctor as particularly relevant
-                    doctor_copy = doctor.copy()
-                    doctor_copy["relevant"] = True
-                    relevant_doctors.append(doctor_copy)
-
-            # Add the relevant flag to all other doctors (setting to False)
-            for doctor in doctors:
-                if not any(d["name"] == doctor["name"] for d in relevant_doctors):
-                    doctor["relevant"] = False
-
-        # Save the conversation to the database
-        try:
-            conversation_data = {
-                "timestamp": datetime.datetime.utcnow(),
-                "query": query,
-                "response": medical_response,
-                "metadata": {
-                    "recommended_specialties": recommended_specialties
-                }
-            }
-            await save_conversation("medical_conversations", user_id, conversation_data)
-        except Exception as e:
-            print(f"Error saving conversation: {e}")
+        # Call the OpenAI API through the shared gateway
+        medical_response = await chat_completion_json(messages)
 
-        # Include both the medical response and the doctor list in the return value
-        return {
-            "status": "success",
-            "data": medical_response,
-            "doctors": doctors,
-            "relevant_doctors": relevant_doctors if recommended_specialties and relevant_doctors else None
-        }
+        return await _complete_medical_response(user_id, query, medical_response, db)
     except Exception as e:
         # Try to still provide a doctor list even if the medical query processing fails
         try:
@@ -149,6 +150,32 @@ async def process_medical_query(user_id, query, conversation_history=None):
                 "message": f"Failed to process medical query: {str(e)}. Also failed to retrieve doctor list: {str(doc_error)}"
             }
 
+
+async def stream_medical_query(user_id, query, conversation_history=None, db=None):
+    """
+    Streaming variant of process_medical_query().
+
+    Yields a ("field", {"name", "value"}) event for each field of the answer as
+    soon as the model has written it, then ("done", response) with the same
+    response process_medical_query() returns. The conversation is saved once
+    the answer is complete.
+
+    Args:
+        user_id: The ID of the user
+        query: The medical query text
+        conversation_history: Previous conversation for context
+        db: Database holding the conversation history (optional)
+    """
+    messages = await _build_medical_messages(user_id, query, conversation_history, db)
+
+    parser = JSONFieldParser()
+    async for delta in chat_completion_stream(messages, response_format={"type": "json_object"}):
+        for name, value in parser.feed(delta):
+            yield "field", {"name": name, "value": value}
+
+    yield "done", await _complete_medical_response(user_id, query, parser.result(), db)
+
+
 # Leave the other functions as they are
 async def save_medical_query(user_id, query, response):
     """
@@ -175,33 +202,11 @@ async def get_doctor_list():
         list: List of doctors with their details
     """
     try:
-        # Call the OpenAI API to generate a list of doctors
-        # This would typically come from a database in a real application
-        prompt = """
-        Generate a list of 5 example doctors with different specialties.
-        Include their name, specialty, contact information, and location.
-        Format the response as a JSON array of doctor objects.
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an assistant helping to generate sample doctor data."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-
-        # Extract and parse the JSON response
-        result = json.loads(response.choices[0].message.content)
-
-        # Ensure we have a list of doctors
-        if "doctors" in result:
-            return result["doctors"]
-        else:
-            return result
+        # Served from the in-memory directory loaded from data/doc_csv.csv
+        return doctor_repository.get_doctors()
     except Exception as e:
-        # Fallback to sample data if API call fails
+        print(f"Error loading doctor directory: {e}")
+        # Fallback to sample data if the directory cannot be loaded
         return [
             {
                 "name": "Dr. Jane Smith",
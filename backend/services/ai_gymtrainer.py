@@ -1,5 +1,4 @@
 import mediapipe as mp
-import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 import time
@@ -8,237 +7,44 @@ from datetime import datetime
 import json
 from typing import Dict, List, Any, Optional
 
+from services.pose_pool import pose_pool
+from services.gym_sessions import session_manager, export_history, DEFAULT_SESSION_ID
+from services.pose_angles import NUM_LANDMARKS, compute_features
+from services.rep_counter import exercise_registry, RepCounterBatcher
+
 mp_drawing = mp.solutions.drawing_utils
 mp_pose = mp.solutions.pose
 
-
-def calc_angle(x, y, z):
-    """Calculate angle between three points."""
-    x = np.array(x)
-    y = np.array(y)
-    z = np.array(z)
-    radians = np.arctan2(z[1] - y[1], z[0] - y[0]) - np.arctan2(x[1] - y[1], x[0] - y[0])
-    angle = np.abs(radians * 180.0 / np.pi)
-    if angle > 180.0:
-        angle = 360 - angle
-    return angle
+# Sessions hold on to a pose estimator until they end
+session_manager.end_listeners.append(pose_pool.release)
 
 
 class GymTrainerService:
     def __init__(self):
         self.mp_drawing = mp.solutions.drawing_utils
         self.mp_pose = mp.solutions.pose
-        self.reset_variables()
-
-    def reset_variables(self):
-        """Reset all tracking variables."""
-        self.exercise_counters = [0, 0, 0, 0, 0, 0]
-        self.state = "Up"
-        self.feedback = ""
-        self.range_flag = True
-        self.halfway = False
-        self.left_angle = []
-        self.right_angle = []
-        self.body_angles = []
-        self.frames = []
-        self.frame_count = 0
-
-    def recognise_squat(self, detection):
-        """Recognize squat exercise."""
-        try:
-            landmarks = detection.pose_landmarks.landmark
-            left_hip = [landmarks[self.mp_pose.PoseLandmark.LEFT_HIP.value].x,
-                        landmarks[self.mp_pose.PoseLandmark.LEFT_HIP.value].y]
-            left_knee = [landmarks[self.mp_pose.PoseLandmark.LEFT_KNEE.value].x,
-                         landmarks[self.mp_pose.PoseLandmark.LEFT_KNEE.value].y]
-            left_heel = [landmarks[self.mp_pose.PoseLandmark.LEFT_HEEL.value].x,
-                         landmarks[self.mp_pose.PoseLandmark.LEFT_HEEL.value].y]
-            right_hip = [landmarks[self.mp_pose.PoseLandmark.RIGHT_HIP.value].x,
-                         landmarks[self.mp_pose.PoseLandmark.RIGHT_HIP.value].y]
-            right_knee = [landmarks[self.mp_pose.PoseLandmark.RIGHT_KNEE.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.RIGHT_KNEE.value].y]
-            right_heel = [landmarks[self.mp_pose.PoseLandmark.RIGHT_HEEL.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.RIGHT_HEEL.value].y]
-            left_shoulder = [landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,
-                             landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            right_shoulder = [landmarks[self.mp_pose.PoseLandmark.RIGHT_SHOULDER.value].x,
-                              landmarks[self.mp_pose.PoseLandmark.RIGHT_SHOULDER.value].y]
-            left = calc_angle(left_hip, left_knee, left_heel)
-            right = calc_angle(right_hip, right_knee, right_heel)
-            self.left_angle.append(int(left))
-            self.right_angle.append(int(right))
-            shoulder_dist = left_shoulder[0] - right_shoulder[0]
-            knee_dist = left_knee[0] - right_knee[0]
-            if shoulder_dist - knee_dist > 0.04:
-                self.feedback = 'Open up your knees further apart to shoulder width!'
-            else:
-                self.feedback = ''
-            if left > 170 and right > 170:
-                self.state = "Up"
-            if left < 165 and right < 165:
-                self.feedback = 'Almost there... lower until height of hips!'
-            if left < 140 and right < 140 and self.state == "Up":
-                self.state = "Down"
-                self.exercise_counters[1] += 1
-            if self.state == "Down":
-                self.feedback = 'Good rep!'
-        except:
-            self.left_angle.append(180)
-            self.right_angle.append(180)
-
-    def recognise_curl(self, detection):
-        """Recognize arm curl exercise."""
-        try:
-            landmarks = detection.pose_landmarks.landmark
-            left_wrist = [landmarks[self.mp_pose.PoseLandmark.LEFT_WRIST.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.LEFT_WRIST.value].y]
-            left_shoulder = [landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,
-                             landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            left_elbow = [landmarks[self.mp_pose.PoseLandmark.LEFT_ELBOW.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.LEFT_ELBOW.value].y]
-            right_wrist = [landmarks[self.mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                           landmarks[self.mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-            right_shoulder = [landmarks[self.mp_pose.PoseLandmark.RIGHT_SHOULDER.value].x,
-                              landmarks[self.mp_pose.PoseLandmark.RIGHT_SHOULDER.value].y]
-            right_elbow = [landmarks[self.mp_pose.PoseLandmark.RIGHT_ELBOW.value].x,
-                           landmarks[self.mp_pose.PoseLandmark.RIGHT_ELBOW.value].y]
-            left_elbow_angle = calc_angle(left_shoulder, left_elbow, left_wrist)
-            right_elbow_angle = calc_angle(right_shoulder, right_elbow, right_wrist)
-            self.left_angle.append(int(left_elbow_angle))
-            self.right_angle.append(int(right_elbow_angle))
-            if left_elbow_angle > 160 and right_elbow_angle > 160:
-                if not self.range_flag:
-                    self.feedback = 'Did not curl completely.'
-                else:
-                    self.feedback = 'Good rep!'
-                self.state = 'Down'
-            elif (left_elbow_angle > 50 and right_elbow_angle > 50) and self.state == 'Down':
-                self.range_flag = False
-                self.feedback = ''
-            elif (left_elbow_angle < 30 and right_elbow_angle < 30) and self.state == 'Down':
-                self.state = 'Up'
-                self.feedback = ''
-                self.range_flag = True
-                self.exercise_counters[2] += 1
-        except:
-            self.left_angle.append(180)
-            self.right_angle.append(180)
-
-    def recognise_situp(self, detection):
-        """Recognize sit-up exercise."""
-        try:
-            landmarks = detection.pose_landmarks.landmark
-            left_hip = [landmarks[self.mp_pose.PoseLandmark.LEFT_HIP.value].x,
-                        landmarks[self.mp_pose.PoseLandmark.LEFT_HIP.value].y]
-            left_knee = [landmarks[self.mp_pose.PoseLandmark.LEFT_KNEE.value].x,
-                         landmarks[self.mp_pose.PoseLandmark.LEFT_KNEE.value].y]
-            left_heel = [landmarks[self.mp_pose.PoseLandmark.LEFT_HEEL.value].x,
-                         landmarks[self.mp_pose.PoseLandmark.LEFT_HEEL.value].y]
-            left_shoulder = [landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,
-                             landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            angle_knee = calc_angle(left_hip, left_knee, left_heel)
-            angle_body = calc_angle(left_shoulder, left_hip, left_knee)
-            self.body_angles.append(int(angle_body))
-            if (angle_body < 80 and angle_body > 50) and self.state == "Down":
-                self.halfway = True
-            if angle_body < 40 and self.state == "Down":
-                self.state = "Up"
-                self.range_flag = True
-            if angle_body > 90 and angle_knee < 60:
-                self.state = "Down"
-                if self.halfway:
-                    if self.range_flag:
-                        self.exercise_counters[3] += 1
-                        self.feedback = "Good repetition!"
-                    else:
-                        self.feedback = "Did not perform sit up completely."
-                    self.range_flag = False
-                    self.halfway = False
-            if angle_knee > 70:
-                self.feedback = "Keep legs tucked in closer"
-        except:
-            self.body_angles.append(180)
-
-    def recognise_lunge(self, detection):
-        """Recognize lunge exercise."""
-        try:
-            landmarks = detection.pose_landmarks.landmark
-            left_hip = [landmarks[self.mp_pose.PoseLandmark.LEFT_HIP.value].x,
-                        landmarks[self.mp_pose.PoseLandmark.LEFT_HIP.value].y]
-            left_knee = [landmarks[self.mp_pose.PoseLandmark.LEFT_KNEE.value].x,
-                         landmarks[self.mp_pose.PoseLandmark.LEFT_KNEE.value].y]
-            left_ankle = [landmarks[self.mp_pose.PoseLandmark.LEFT_ANKLE.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.LEFT_ANKLE.value].y]
-            right_hip = [landmarks[self.mp_pose.PoseLandmark.RIGHT_HIP.value].x,
-                         landmarks[self.mp_pose.PoseLandmark.RIGHT_HIP.value].y]
-            right_knee = [landmarks[self.mp_pose.PoseLandmark.RIGHT_KNEE.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.RIGHT_KNEE.value].y]
-            right_ankle = [landmarks[self.mp_pose.PoseLandmark.RIGHT_ANKLE.value].x,
-                           landmarks[self.mp_pose.PoseLandmark.RIGHT_ANKLE.value].y]
-
-            left_lunge_angle = calc_angle(left_hip, left_knee, left_ankle)
-            right_lunge_angle = calc_angle(right_hip, right_knee, right_ankle)
-
-            self.left_angle.append(int(left_lunge_angle))
-            self.right_angle.append(int(right_lunge_angle))
-
-            if left_lunge_angle > 160 and right_lunge_angle > 160:
-                self.state = "Up"
-                self.feedback = ''
-
-            if (left_lunge_angle < 100 and right_lunge_angle < 100) and self.state == "Up":
-                self.state = "Down"
-                self.exercise_counters[4] += 1
-                self.feedback = "Good lunge!"
-        except:
-            self.left_angle.append(180)
-            self.right_angle.append(180)
-
-    def recognise_pushup(self, detection):
-        """Recognize push-up exercise."""
-        try:
-            landmarks = detection.pose_landmarks.landmark
-            left_shoulder = [landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].x,
-                             landmarks[self.mp_pose.PoseLandmark.LEFT_SHOULDER.value].y]
-            left_elbow = [landmarks[self.mp_pose.PoseLandmark.LEFT_ELBOW.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.LEFT_ELBOW.value].y]
-            left_wrist = [landmarks[self.mp_pose.PoseLandmark.LEFT_WRIST.value].x,
-                          landmarks[self.mp_pose.PoseLandmark.LEFT_WRIST.value].y]
-            right_shoulder = [landmarks[self.mp_pose.PoseLandmark.RIGHT_SHOULDER.value].x,
-                              landmarks[self.mp_pose.PoseLandmark.RIGHT_SHOULDER.value].y]
-            right_elbow = [landmarks[self.mp_pose.PoseLandmark.RIGHT_ELBOW.value].x,
-                           landmarks[self.mp_pose.PoseLandmark.RIGHT_ELBOW.value].y]
-            right_wrist = [landmarks[self.mp_pose.PoseLandmark.RIGHT_WRIST.value].x,
-                           landmarks[self.mp_pose.PoseLandmark.RIGHT_WRIST.value].y]
-
-            left_elbow_angle = calc_angle(left_shoulder, left_elbow, left_wrist)
-            right_elbow_angle = calc_angle(right_shoulder, right_elbow, right_wrist)
-
-            self.left_angle.append(int(left_elbow_angle))
-            self.right_angle.append(int(right_elbow_angle))
-
-            if left_elbow_angle > 160 and right_elbow_angle > 160:
-                self.state = "Up"
-                self.feedback = ''
-
-            if (left_elbow_angle < 90 and right_elbow_angle < 90) and self.state == "Up":
-                self.state = "Down"
-                self.exercise_counters[5] += 1
-                self.feedback = "Good pushup!"
-        except:
-            self.left_angle.append(180)
-            self.right_angle.append(180)
-
-    def get_performance_summary(self, exercise_choice=None):
-        """Generate a performance summary."""
-        exercise_labels = ['', 'Squats', 'Arm Curls', 'Sit-ups', 'Lunges', 'Pushups']
-        total_reps = sum(self.exercise_counters[1:])
+        self.batcher = RepCounterBatcher()
+
+    def get_performance_summary(self, session, exercise_choice=None, history_points=None, history_mode="downsample"):
+        """
+        Generate a performance summary.
+
+        Args:
+            session: The session state to summarize
+            exercise_choice: Exercise whose angle history to include (None for no history)
+            history_points: Upper bound on exported history points (None for the whole buffer)
+            history_mode: "downsample" or "minmax" decimation of the history
+
+        Returns:
+            dict: Summary of the session
+        """
+        total_reps = sum(session.exercise_counters.values())
 
         # Build summary data
         summary = {
             "total_reps": total_reps,
             "exercise_counts": {
-                exercise_labels[i]: self.exercise_counters[i] for i in range(1, 6)
+                exercise.label: session.exercise_counters.get(exercise.id, 0) for exercise in exercise_registry
             },
             "timestamp": datetime.now().isoformat()
         }
@@ -256,97 +62,171 @@ class GymTrainerService:
             summary["overall_feedback"] = "Excellent performance! You're a fitness champion!"
 
         # Add muscle groups worked
-        muscle_groups = {
-            1: ["Quadriceps", "Glutes", "Hamstrings"],
-            2: ["Biceps", "Forearms"],
-            3: ["Core", "Abdominal Muscles"],
-            4: ["Quadriceps", "Glutes", "Calves"],
-            5: ["Chest", "Triceps", "Core"]
-        }
-
         worked_muscles = set()
-        for i in range(1, 6):
-            if self.exercise_counters[i] > 0:
-                worked_muscles.update(muscle_groups[i])
+        for exercise in exercise_registry:
+            if session.exercise_counters.get(exercise.id, 0) > 0:
+                worked_muscles.update(exercise.target_muscles)
 
         summary["muscles_worked"] = list(worked_muscles)
 
         # Add exercise-specific data if requested
-        if exercise_choice and 1 <= exercise_choice <= 5:
-            if exercise_choice in [1, 2, 4, 5]:
-                summary["angle_data"] = {
-                    "left": self.left_angle,
-                    "right": self.right_angle,
-                    "frames": self.frames
-                }
-            elif exercise_choice == 3:  # Sit-up
-                summary["angle_data"] = {
-                    "body": self.body_angles,
-                    "frames": self.frames
-                }
+        exercise = exercise_registry.get(exercise_choice)
+        if exercise:
+            summary["angle_data"] = export_history(
+                session.frames,
+                {key: getattr(session, attribute) for key, attribute in exercise.history_keys},
+                max_points=history_points,
+                mode=history_mode
+            )
+            summary["frames_recorded"] = session.frame_count
 
         return summary
 
-    async def process_frame(self, frame_bytes, user_id, exercise_choice):
+    def _exercise(self, exercise_choice):
+        exercise = exercise_registry.get(exercise_choice)
+        if exercise is None:
+            raise ValueError(f"Unknown exercise: {exercise_choice}")
+        return exercise
+
+    def _respond(self, session, exercise):
+        """Build the per-frame response for a session."""
+        return {
+            "exercise_type": exercise.name,
+            "reps": session.exercise_counters.get(exercise.id, 0),
+            "feedback": session.feedback,
+            "state": session.state
+        }
+
+    def _recognise(self, session, points, exercise, features=None):
+        """
+        Run the exercise state machine on one frame and build the frame response.
+
+        Args:
+            session: The session state to update
+            points: (33, 3) landmark array, or None if no pose was detected
+            exercise: Compiled exercise definition
+            features: Frame features if already computed as part of a batch
+        """
+        # Process landmarks if detected
+        if points is not None:
+            if features is None:
+                features = compute_features(points)
+            exercise.step(session, features)
+            session.frames.append(session.frame_count)
+            session.frame_count += 1
+
+        return self._respond(session, exercise)
+
+    async def process_frame(self, frame_bytes, user_id, exercise_choice, session_id=DEFAULT_SESSION_ID):
         """Process a single frame and return exercise recognition results."""
-        # Convert bytes to numpy array
-        nparr = np.frombuffer(frame_bytes, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        # Perform pose detection
-        with mp_pose.Pose(min_detection_confidence=0.5, min_tracking_confidence=0.5) as pose:
-            # Convert frame to RGB for MediaPipe
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image.flags.writeable = False
-
-            # Pose detection
-            results = pose.process(image)
-
-            # Process landmarks if detected
-            if results.pose_landmarks:
-                # Call the appropriate exercise recognition function
-                if exercise_choice == 1:
-                    self.recognise_squat(results)
-                elif exercise_choice == 2:
-                    self.recognise_curl(results)
-                elif exercise_choice == 3:
-                    self.recognise_situp(results)
-                elif exercise_choice == 4:
-                    self.recognise_lunge(results)
-                elif exercise_choice == 5:
-                    self.recognise_pushup(results)
-
-                self.frames.append(self.frame_count)
-                self.frame_count += 1
-
-            # Prepare response
-            response = {
-                "exercise_type": ['', 'Squat', 'Curl', 'Sit-up', 'Lunge', 'Pushup'][exercise_choice],
-                "reps": self.exercise_counters[exercise_choice],
-                "feedback": self.feedback,
-                "state": self.state
-            }
-
-            return response
-
-    async def save_exercise_data(self, user_id, db):
-        """Save the current exercise session data to the database."""
+        exercise = self._exercise(exercise_choice)
+        async with session_manager.lock(user_id, session_id):
+            session = await session_manager.get_or_create(user_id, session_id, exercise_choice)
+
+            # Decode and run pose detection on the session's pooled estimator, off the event loop
+            points = await pose_pool.process(session.key, frame_bytes)
+
+            response = self._recognise(session, points, exercise)
+            await session_manager.save(session)
+
+        return response
+
+    async def process_landmarks(self, landmarks, user_id, exercise_choice, session_id=DEFAULT_SESSION_ID):
+        """
+        Process one frame of landmarks computed by the client.
+
+        Frames submitted by different sessions in the same event loop iteration
+        are evaluated together in one batched state machine step.
+
+        Args:
+            landmarks: Array of 33 (x, y, z) pose landmarks in MediaPipe order
+            user_id: The ID of the user
+            exercise_choice: 1=Squat, 2=Curl, 3=Sit-up, 4=Lunge, 5=Pushup
+            session_id: The exercise session
+
+        Returns:
+            dict: Exercise recognition results for the frame
+        """
+        exercise = self._exercise(exercise_choice)
+        points = np.asarray(landmarks, dtype=np.float32)
+        if points.size != NUM_LANDMARKS * 3:
+            raise ValueError(f"Expected {NUM_LANDMARKS}x3 landmarks, got {points.size} values")
+        points = points.reshape(NUM_LANDMARKS, 3)
+
+        async with session_manager.lock(user_id, session_id):
+            session = await session_manager.get_or_create(user_id, session_id, exercise_choice)
+            await self.batcher.submit(session, exercise, points)
+            session.frames.append(session.frame_count)
+            session.frame_count += 1
+            response = self._respond(session, exercise)
+            await session_manager.save(session)
+
+        return response
+
+    async def process_landmark_batch(self, batch, user_id, exercise_choice, session_id=DEFAULT_SESSION_ID):
+        """
+        Feed a batch of client-computed landmark frames through the rep counter.
+
+        Args:
+            batch: Array of shape (frames, 33, 3), or a flat float32 buffer of that size
+            user_id: The ID of the user
+            exercise_choice: 1=Squat, 2=Curl, 3=Sit-up, 4=Lunge, 5=Pushup
+            session_id: The exercise session
+
+        Returns:
+            dict: Exercise recognition results after the last frame, plus the batch
+                  positions of frames that completed a rep
+        """
+        exercise = self._exercise(exercise_choice)
+        batch = np.asarray(batch, dtype=np.float32)
+        if batch.size % (NUM_LANDMARKS * 3):
+            raise ValueError(f"Landmark batch must hold a multiple of {NUM_LANDMARKS}x3 values, got {batch.size}")
+        batch = batch.reshape(-1, NUM_LANDMARKS, 3)
+
+        # Every feature of every frame in one vectorized pass
+        batch_features = compute_features(batch)
+
+        async with session_manager.lock(user_id, session_id):
+            session = await session_manager.get_or_create(user_id, session_id, exercise_choice)
+            rep_frames = []
+            for position in range(len(batch)):
+                reps = session.exercise_counters.get(exercise.id, 0)
+                self._recognise(session, batch[position], exercise, batch_features[position])
+                if session.exercise_counters.get(exercise.id, 0) > reps:
+                    rep_frames.append(position)
+            response = self._respond(session, exercise)
+            await session_manager.save(session)
+
+        response["frames_processed"] = len(batch)
+        response["rep_frames"] = rep_frames
+        return response
+
+    async def save_exercise_data(self, session, db=None, **summary_options):
+        """
+        Save the exercise session data to the database.
+
+        Args:
+            session: The finished session
+            db: The database (None to only build the summary)
+            **summary_options: Passed on to get_performance_summary()
+        """
         from database.mongodb import save_exercise_data
 
-        for i in range(1, 6):
-            if self.exercise_counters[i] > 0:
+        for exercise in exercise_registry:
+            reps = session.exercise_counters.get(exercise.id, 0)
+            if reps > 0 and db is not None:
                 exercise_data = {
                     "timestamp": datetime.now().isoformat(),
-                    "exercise_type": ['', 'Squat', 'Curl', 'Sit-up', 'Lunge', 'Pushup'][i],
-                    "reps": self.exercise_counters[i],
+                    "exercise_type": exercise.name,
+                    "reps": reps,
                     "accuracy": 95,  # Placeholder for actual accuracy calculation
                     "feedback": "Session completed successfully"
                 }
-                await save_exercise_data(user_id, exercise_data)
+                await save_exercise_data(db, session.user_id, exercise_data)
 
         # Return summary
-        return self.get_performance_summary()
+        return self.get_performance_summary(session, **summary_options)
 
 
 # Create a singleton instance
-gym_trainer_service = GymTrainerService()
\ No newline at end of file
+gym_trainer_service = GymTrainerService()
@@ -1,133 +1,122 @@
-import os
 import json
 import datetime
 from dotenv import load_dotenv
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 from database.mongodb import save_conversation
+from database.write_behind import insert_document
+from services.google_fit import google_fit, day_range_millis, FitnessAPIError
+from services.steps_store import sync_steps, steps_totals, from_millis
+from services.steps_rollups import STEP_GOALS
 
 # Load environment variables
 load_dotenv()
 
-# Google API configuration
-GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
-GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 
+def steps_aggregate_body(start_millis, end_millis):
+    """Google Fit aggregate request for daily step buckets between two epoch millisecond times."""
+    return {
+        "aggregateBy": [{
+            "dataTypeName": "com.google.step_count.delta",
+            "dataSourceId": "derived:com.google.step_count.delta:com.google.android.gms:estimated_steps"
+        }],
+        "bucketByTime": {"durationMillis": 86400000},  # 1 day in milliseconds
+        "startTimeMillis": start_millis,
+        "endTimeMillis": end_millis
+    }
+
+
+def daily_steps(response):
+    """(UTC day start, steps) for every bucket of an aggregate response."""
+    days = []
+    for bucket in response.get("bucket", []):
+        # Extract steps count
+        steps = 0
+        for data_set in bucket.get("dataset", []):
+            for point in data_set.get("point", []):
+                value = point.get("value", [])
+                if value:
+                    steps += value[0].get("intVal", 0)
+        days.append((from_millis(bucket.get("startTimeMillis")), steps))
+    return days
 
-async def get_steps_count(user_id, token_info, time_range="today"):
+
+async def get_steps_count(user_id, token_info, time_range="today", db=None):
     """
     Fetch steps count from Google Fit API for a given user and time range.
 
+    With a database, days already synced are read from the steps_daily store
+    and only the rest (at least today) are fetched from Google Fit.
+
     Args:
         user_id: The ID of the user
         token_info: OAuth token information for Google Fit API
         time_range: Time range for steps data (today, week, month)
+        db: Database to keep the daily steps and conversation history in (optional)
 
     Returns:
         dict: Steps count data and summary
     """
-    try:
-        # Create credentials from token info
-        credentials = Credentials(
-            token=token_info.get("access_token"),
-            refresh_token=token_info.get("refresh_token"),
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=GOOGLE_CLIENT_ID,
-            client_secret=GOOGLE_CLIENT_SECRET
-        )
-
-        # Build the Fitness API client
-        fitness_service = build('fitness', 'v1', credentials=credentials)
-
-        # Calculate time range
-        now = datetime.datetime.utcnow()
-        end_time = int(now.timestamp() * 1000000000)  # End time in nanoseconds
-
-        if time_range == "today":
-            start_time = int(datetime.datetime(now.year, now.month, now.day, 0, 0, 0).timestamp() * 1000000000)
-        elif time_range == "week":
-            start_of_week = now - datetime.timedelta(days=now.weekday())
-            start_time = int(datetime.datetime(start_of_week.year, start_of_week.month, start_of_week.day, 0, 0,
-                                               0).timestamp() * 1000000000)
-        elif time_range == "month":
-            start_of_month = datetime.datetime(now.year, now.month, 1)
-            start_time = int(start_of_month.timestamp() * 1000000000)
-        else:
-            # Default to today if invalid range specified
-            start_time = int(datetime.datetime(now.year, now.month, now.day, 0, 0, 0).timestamp() * 1000000000)
-
-        # Request steps data from Google Fit API
-        body = {
-            "aggregateBy": [{
-                "dataTypeName": "com.google.step_count.delta",
-                "dataSourceId": "derived:com.google.step_count.delta:com.google.android.gms:estimated_steps"
-            }],
-            "bucketByTime": {"durationMillis": 86400000},  # 1 day in milliseconds
-            "startTimeMillis": start_time // 1000000,  # Convert to milliseconds
-            "endTimeMillis": end_time // 1000000  # Convert to milliseconds
-        }
+    async def fetch(start_millis, end_millis):
+        # Cached per-credential client over a pooled async connection, so the event loop is not blocked
+        return daily_steps(await google_fit.aggregate(token, steps_aggregate_body(start_millis, end_millis), db=db))
 
-        response = fitness_service.users().dataset().aggregate(userId="me", body=body).execute()
-
-        # Process the response
-        steps_data = []
-        total_steps = 0
-
-        for bucket in response.get("bucket", []):
-            start_time_millis = bucket.get("startTimeMillis")
-            end_time_millis = bucket.get("endTimeMillis")
-
-            # Convert milliseconds to datetime
-            date = datetime.datetime.fromtimestamp(int(start_time_millis) / 1000).strftime('%Y-%m-%d')
-
-            # Extract steps count
-            dataset = bucket.get("dataset", [])
-            daily_steps = 0
-
-            for data_set in dataset:
-                points = data_set.get("point", [])
-                for point in points:
-                    value = point.get("value", [])
-                    if value:
-                        daily_steps += value[0].get("intVal", 0)
-
-            steps_data.append({
-                "date": date,
-                "steps": daily_steps
-            })
-
-            total_steps += daily_steps
+    try:
+        # The client's token, or a newer one refreshed from the same credentials, refreshed if about to expire
+        token = await google_fit.tokens.get_token(token_info, db)
+
+        # Calculate time range, defaulting to today if an invalid range is specified
+        start_millis, end_millis = day_range_millis(time_range if time_range in ("week", "month") else "today")
+        start, end = from_millis(start_millis), from_millis(end_millis)
+
+        sync = None
+        if db is not None:
+            try:
+                sync = await sync_steps(db, user_id, start, end, fetch)
+                totals = await steps_totals(db, user_id, start, end)
+                steps_data = [{"date": period["period"], "steps": period["steps"]} for period in totals["periods"]]
+            except FitnessAPIError:
+                raise
+            except Exception as e:
+                print(f"Error syncing steps store, fetching the whole range: {e}")
+                sync = None
+
+        if sync is None:
+            steps_data = [
+                {"date": date.strftime('%Y-%m-%d'), "steps": steps}
+                for date, steps in await fetch(start_millis, end_millis)
+            ]
+        total_steps = sum(day["steps"] for day in steps_data)
 
         # Create response with steps data and summary
         result = {
             "time_range": time_range,
             "total_steps": total_steps,
             "daily_data": steps_data,
-            "goal_progress": calculate_goal_progress(total_steps, time_range)
+            "goal_progress": calculate_goal_progress(total_steps, time_range),
+            "sync": sync
         }
 
         # Save the data to conversation history
-        try:
-            conversation_data = {
-                "timestamp": datetime.datetime.utcnow(),
-                "query": f"Steps count for {time_range}",
-                "response": result,
-                "metadata": {
-                    "time_range": time_range,
-                    "total_steps": total_steps
+        if db is not None:
+            try:
+                conversation_data = {
+                    "timestamp": datetime.datetime.utcnow(),
+                    "query": f"Steps count for {time_range}",
+                    "response": result,
+                    "metadata": {
+                        "time_range": time_range,
+                        "total_steps": total_steps
+                    }
                 }
-            }
-            await save_conversation("steps_conversations", user_id, conversation_data)
-        except Exception as e:
-            print(f"Error saving steps conversation: {e}")
+                await save_conversation(db, "steps_conversations", user_id, conversation_data)
+            except Exception as e:
+                print(f"Error saving steps conversation: {e}")
 
         return {
             "status": "success",
             "data": result
         }
 
-    except HttpError as error:
+    except FitnessAPIError as error:
         return {
             "status": "error",
             "message": f"Google Fit API error: {str(error)}",
@@ -151,14 +140,14 @@ def calculate_goal_progress(steps, time_range):
     Returns:
         dict: Goal progress information
     """
-    # Define default goals for different time ranges
+    # Define default goals for different time ranges, shared with the rollup goal queries
     default_goals = {
-        "today": 10000,  # 10k steps per day
-        "week": 70000,  # 70k steps per week
-        "month": 300000  # 300k steps per month
+        "today": STEP_GOALS["day"],  # 10k steps per day
+        "week": STEP_GOALS["week"],  # 70k steps per week
+        "month": STEP_GOALS["month"]  # 300k steps per month
     }
 
-    goal = default_goals.get(time_range, 10000)
+    goal = default_goals.get(time_range, STEP_GOALS["day"])
     progress_percent = min(round((steps / goal) * 100, 1), 100)
 
     status = "On Track"
@@ -175,25 +164,25 @@ def calculate_goal_progress(steps, time_range):
     }
 
 
-async def save_steps_data(user_id, steps_data):
+async def save_steps_data(db, user_id, steps_data):
     """
     Save steps data to the database.
 
     Args:
+        db: The database
         user_id: The ID of the user
         steps_data: Steps count data
 
     Returns:
         str: The ID of the saved record
     """
-    from database.mongodb import db
     try:
-        result = await db.steps_data.insert_one({
+        record_id = await insert_document(db, "steps_data", {
             "user_id": user_id,
             "timestamp": datetime.datetime.utcnow(),
             "steps_data": steps_data
         })
-        return str(result.inserted_id)
+        return str(record_id)
     except Exception as e:
         print(f"Error saving steps data to db: {e}")
         return "steps_data_id_error"
\ No newline at end of file
@@ -0,0 +1,229 @@
+import os
+import json
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+from database.pagination import HISTORY_SORT, json_default
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to an estimate of ~4 characters per token
+    tiktoken = None
+
+# Load environment variables
+load_dotenv()
+
+# Context budget configuration: tokens of past conversation each service may put in a prompt
+CONTEXT_TOKEN_BUDGETS = {
+    "medical_conversations": int(os.getenv("DOCTOR_CONTEXT_TOKEN_BUDGET", "1500")),
+    "diet_conversations": int(os.getenv("DIETICIAN_CONTEXT_TOKEN_BUDGET", "600")),
+}
+# Most recent turns sent verbatim; older ones are replaced by their stored summary
+CONTEXT_FULL_TURNS = int(os.getenv("CONTEXT_FULL_TURNS", "1"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "120"))
+CONTEXT_TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "o200k_base")
+
+SUMMARY_FIELD = "context_summary"
+
+# Per-message framing the chat format adds on top of the content
+MESSAGE_OVERHEAD_TOKENS = 4
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None and tiktoken is not None:
+        try:
+            _encoding = tiktoken.get_encoding(CONTEXT_TOKEN_ENCODING)
+        except Exception as e:
+            print(f"Error loading token encoding {CONTEXT_TOKEN_ENCODING}, estimating token counts: {e}")
+            _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text):
+    """Count the tokens of `text` locally, with tiktoken when it is installed."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` down to at most `max_tokens` tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN - 3].rstrip() + "..."
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max(max_tokens - 1, 0)]).rstrip() + "..."
+
+
+def compact_json(value):
+    return json.dumps(value, default=json_default, separators=(",", ":"))
+
+
+def _first_sentences(text, count=2):
+    sentences = [sentence.strip() for sentence in str(text).replace("\n", " ").split(". ") if sentence.strip()]
+    summary = ". ".join(sentences[:count])
+    return summary if summary.endswith(".") else summary + "."
+
+
+def _names(items):
+    names = []
+    for item in items if isinstance(items, list) else [items]:
+        if isinstance(item, dict):
+            item = item.get("specialty") or item.get("name") or item.get("condition")
+        if item:
+            names.append(str(item))
+    return ", ".join(names)
+
+
+def _summarize_medical(response):
+    parts = []
+    if response.get("answer"):
+        parts.append(_first_sentences(response["answer"]))
+    if response.get("possible_conditions"):
+        parts.append(f"Possible conditions: {_names(response['possible_conditions'])}.")
+    if response.get("doctor_referrals"):
+        parts.append(f"Suggested specialists: {_names(response['doctor_referrals'])}.")
+    return " ".join(parts)
+
+
+def _summarize_diet(response):
+    if "daily_calories" not in response:
+        return ""
+    parts = [f"{response['daily_calories']} kcal/day"]
+    ratio = response.get("macronutrient_ratio")
+    if isinstance(ratio, dict):
+        parts.append("macros " + ", ".join(f"{name} {value}" for name, value in ratio.items()))
+    meal_plan = response.get("meal_plan")
+    if isinstance(meal_plan, dict):
+        for meal, foods in meal_plan.items():
+            if foods:
+                parts.append(f"{meal}: {_names(foods if isinstance(foods, list) else [foods])}")
+    return "; ".join(parts) + "."
+
+
+SUMMARIZERS = {
+    "medical_conversations": _summarize_medical,
+    "diet_conversations": _summarize_diet,
+}
+
+
+def summarize_turn(collection_name, response):
+    """
+    Extractive summary of an assistant response, stored on the conversation
+    document so it is only computed once.
+
+    Args:
+        collection_name: Conversation collection the response belongs to
+        response: The structured response the model returned
+
+    Returns:
+        str: Summary of at most CONTEXT_SUMMARY_MAX_TOKENS tokens
+    """
+    if not isinstance(response, dict):
+        return truncate_to_tokens(str(response), CONTEXT_SUMMARY_MAX_TOKENS)
+    summarizer = SUMMARIZERS.get(collection_name)
+    summary = summarizer(response) if summarizer else ""
+    return truncate_to_tokens(summary or compact_json(response), CONTEXT_SUMMARY_MAX_TOKENS)
+
+
+async def build_context(db, collection_name, user_id, query=None, max_turns=5, budget=None,
+                        full_turns=CONTEXT_FULL_TURNS):
+    """
+    Select a user's past turns for a prompt, newest first, until the token
+    budget is spent.
+
+    The newest `full_turns` turns are sent verbatim when they fit; older ones
+    (and recent ones that do not fit) are sent as their stored summary.
+    Documents saved before summaries existed are summarized here and the
+    summary is written back, so each turn is summarized at most once.
+
+    Args:
+        db: The database
+        collection_name: Conversation collection to read
+        user_id: The ID of the user
+        query: Extra filter on the conversations, e.g. only diet plans
+        max_turns: Most turns to consider
+        budget: Token budget; defaults to the collection's CONTEXT_TOKEN_BUDGETS entry
+        full_turns: Number of newest turns to send verbatim
+
+    Returns:
+        list: Turns in chronological order, each {"query", "content", "summarized"}
+    """
+    budget = CONTEXT_TOKEN_BUDGETS.get(collection_name, 1000) if budget is None else budget
+    collection = db[collection_name]
+    conversations = await collection.find(
+        {"user_id": user_id, **(query or {})},
+        {"query": 1, "response": 1, SUMMARY_FIELD: 1, "timestamp": 1}
+    ).sort(HISTORY_SORT).limit(max_turns).to_list(length=max_turns)
+
+    turns = []
+    backfill = []
+    used = 0
+    for position, conversation in enumerate(conversations):
+        summary = conversation.get(SUMMARY_FIELD)
+        if summary is None:
+            summary = summarize_turn(collection_name, conversation.get("response"))
+            backfill.append(UpdateOne({"_id": conversation["_id"]}, {"$set": {SUMMARY_FIELD: summary}}))
+
+        user_tokens = count_tokens(conversation.get("query")) + MESSAGE_OVERHEAD_TOKENS
+        content, summarized = summary, True
+        if position < full_turns:
+            content, summarized = compact_json(conversation.get("response")), False
+            if used + user_tokens + count_tokens(content) + MESSAGE_OVERHEAD_TOKENS > budget:
+                content, summarized = summary, True
+
+        cost = user_tokens + count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        used += cost
+        turns.append({"query": conversation.get("query"), "content": content, "summarized": summarized})
+
+    if backfill:
+        try:
+            await collection.bulk_write(backfill, ordered=False)
+        except Exception as e:
+            print(f"Error storing conversation summaries in {collection_name}: {e}")
+
+    turns.reverse()
+    return turns
+
+
+def _content_text(content):
+    """Text of a message's content: a string, or the text parts of a multi-part message."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(part.get("text") or "" for part in content
+                         if isinstance(part, dict) and part.get("type") == "text")
+    return str(content) if content is not None else ""
+
+
+def trim_messages(messages, budget):
+    """Keep the newest messages that fit in `budget` tokens, e.g. for client-supplied history."""
+    kept = []
+    used = 0
+    for message in reversed(messages):
+        cost = count_tokens(_content_text(message.get("content"))) + MESSAGE_OVERHEAD_TOKENS
+        if used + cost > budget:
+            break
+        used += cost
+        kept.append(message)
+    kept.reverse()
+    return kept
+
+
+def context_messages(turns):
+    """Chat messages replaying the turns selected by build_context()."""
+    messages = []
+    for turn in turns:
+        messages.append({"role": "user", "content": turn["query"] or ""})
+        messages.append({"role": "assistant", "content": turn["content"]})
+    return messages
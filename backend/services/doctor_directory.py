@@ -0,0 +1,137 @@
+import os
+import re
+import csv
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Doctor directory configuration
+DOCTOR_CSV_PATH = os.getenv(
+    "DOCTOR_CSV_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "doc_csv.csv")
+)
+
+# Words that say nothing about the specialty itself
+STOP_WORDS = {"dr", "doctor", "doctors", "specialist", "specialists", "physician", "physicians", "a", "an", "the",
+              "of", "and", "or", "in", "for", "md"}
+
+# Suffixes folded so that e.g. "cardiology", "cardiologist" and "cardiological" share one token
+OLOGY_SUFFIXES = ("ological", "ologist", "ologic", "ology")
+SUFFIXES = ("icians", "ician", "ists", "ist", "ians", "ian", "ics", "ic", "al", "y")
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+
+
+def normalize_token(word):
+    """Fold a lowercase word to the stem used as an index key."""
+    for suffix in OLOGY_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + "olog"
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    return word
+
+
+def specialty_tokens(specialty):
+    """
+    Split a specialty name into normalized index tokens.
+
+    Args:
+        specialty: Free-text specialty, e.g. "Cardiologist" or "general practitioner"
+
+    Returns:
+        frozenset: Normalized tokens
+    """
+    words = TOKEN_PATTERN.findall(specialty.lower())
+    return frozenset(normalize_token(word) for word in words if word not in STOP_WORDS)
+
+
+class DoctorRepository:
+    """
+    In-memory doctor directory loaded from a CSV file.
+
+    The file is parsed once and reloaded only when its mtime changes. An inverted
+    index maps normalized specialty tokens to the positions of matching doctors,
+    so looking up doctors for a set of specialties is a handful of dict lookups.
+    """
+
+    def __init__(self, path=DOCTOR_CSV_PATH):
+        self.path = path
+        # (doctors, specialty_index) replaced as one tuple so readers never see a partial reload
+        self._directory = ([], {})
+        self.mtime = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Parse the CSV file and rebuild the specialty index."""
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, newline="", encoding="utf-8") as f:
+            doctors = [
+                {key: (value or "").strip() for key, value in row.items()}
+                for row in csv.DictReader(f)
+            ]
+
+        specialty_index = {}
+        for position, doctor in enumerate(doctors):
+            for token in specialty_tokens(doctor.get("specialty", "")):
+                specialty_index.setdefault(token, []).append(position)
+
+        self._directory = (doctors, specialty_index)
+        self.mtime = mtime
+        print(f"Loaded {len(doctors)} doctors from {self.path}")
+
+    def refresh(self):
+        """Reload the directory if the CSV file changed since it was last loaded."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            if self.mtime is None:
+                raise
+            print(f"Doctor directory unavailable, keeping loaded copy: {e}")
+            return
+
+        if mtime != self.mtime:
+            with self._lock:
+                if mtime != self.mtime:
+                    self.load()
+
+    def get_doctors(self):
+        """Return the current doctor list."""
+        self.refresh()
+        return self._directory[0]
+
+    def find_by_specialties(self, specialties):
+        """
+        Find doctors matching any of the given specialties.
+
+        A doctor matches a specialty when their specialty contains all of its
+        normalized tokens.
+
+        Args:
+            specialties: Iterable of free-text specialty names
+
+        Returns:
+            list: Matching doctors in directory order
+        """
+        self.refresh()
+        doctors, specialty_index = self._directory
+        matches = set()
+        for specialty in specialties:
+            tokens = specialty_tokens(specialty)
+            if not tokens:
+                continue
+            postings = [specialty_index.get(token) for token in tokens]
+            if not all(postings):
+                continue
+            positions = set(min(postings, key=len))
+            for posting in postings:
+                positions.intersection_update(posting)
+            matches.update(positions)
+        return [doctors[position] for position in sorted(matches)]
+
+
+# Create a singleton instance
+doctor_repository = DoctorRepository()
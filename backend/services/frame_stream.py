@@ -0,0 +1,48 @@
+import time
+import asyncio
+
+
+class LatestFrameBuffer:
+    """
+    Single-slot buffer between a frame receiver and a frame processor.
+
+    Putting a frame while another one is still waiting replaces it, so when
+    inference falls behind the processor always picks up the newest frame and
+    stale frames are dropped instead of queueing up latency.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._received_at = None
+        self._event = asyncio.Event()
+        self.closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._received_at = time.perf_counter()
+        self.received += 1
+        self._event.set()
+
+    def close(self):
+        self.closed = True
+        self._event.set()
+
+    async def get(self):
+        """
+        Wait for the next frame.
+
+        Returns:
+            tuple: (frame, received_at) or (None, None) once the buffer is closed and empty
+        """
+        while self._frame is None:
+            if self.closed:
+                return None, None
+            self._event.clear()
+            await self._event.wait()
+        frame, received_at = self._frame, self._received_at
+        self._frame = None
+        return frame, received_at
@@ -0,0 +1,536 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import tempfile
+import datetime
+from urllib.parse import parse_qs
+
+import httpx
+from dotenv import load_dotenv
+
+from database.cache import TTLCache
+
+# Load environment variables
+load_dotenv()
+
+# Google API configuration
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+
+# Google Fit client configuration
+GOOGLE_FIT_BACKEND = os.getenv("GOOGLE_FIT_BACKEND", "google")  # google, recorded
+GOOGLE_FIT_DISCOVERY_CACHE = os.getenv(
+    "GOOGLE_FIT_DISCOVERY_CACHE", os.path.join(tempfile.gettempdir(), "google_fit_discovery_v1.json")
+)
+GOOGLE_FIT_DISCOVERY_TTL_SECONDS = float(os.getenv("GOOGLE_FIT_DISCOVERY_TTL_SECONDS", str(7 * 86400)))
+GOOGLE_FIT_CLIENT_CACHE_SIZE = int(os.getenv("GOOGLE_FIT_CLIENT_CACHE_SIZE", "1024"))
+GOOGLE_FIT_CLIENT_TTL_SECONDS = float(os.getenv("GOOGLE_FIT_CLIENT_TTL_SECONDS", "3600"))
+GOOGLE_FIT_MAX_CONNECTIONS = int(os.getenv("GOOGLE_FIT_MAX_CONNECTIONS", "20"))
+GOOGLE_FIT_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_FIT_TIMEOUT_SECONDS", "15"))
+GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+GOOGLE_FIT_RECORDED_LATENCY_SECONDS = float(os.getenv("GOOGLE_FIT_RECORDED_LATENCY_SECONDS", "0.05"))
+
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/fitness/v1/rest"
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+GOOGLE_TOKENS_COLLECTION = "google_tokens"
+
+# Used when the discovery document cannot be loaded at all
+DEFAULT_AGGREGATE_URL = "https://fitness.googleapis.com/fitness/v1/users/{userId}/dataset:aggregate"
+
+GOOGLE_FIT_RECORDINGS_PATH = os.getenv(
+    "GOOGLE_FIT_RECORDINGS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "google_fit_recordings.json")
+)
+
+
+class FitnessAPIError(Exception):
+    """An error response from the Fitness API or the token endpoint."""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+
+class DiscoveryDocument:
+    """
+    The Fitness API discovery document, fetched at most once per TTL.
+
+    It is kept in memory and in a local file (unless path is None), so a
+    restart reuses the copy on disk instead of fetching the document again.
+    """
+
+    def __init__(self, path=GOOGLE_FIT_DISCOVERY_CACHE, ttl=GOOGLE_FIT_DISCOVERY_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._document = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+        # Counters exposed through get_metrics()
+        self.fetches = 0
+        self.file_loads = 0
+
+    def _read_file(self):
+        if self.path is None:
+            return None
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.ttl:
+                return None
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_file(self, document):
+        if self.path is None:
+            return
+        try:
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(document, f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Error caching Google Fit discovery document: {e}")
+
+    async def get(self, http):
+        if self._document is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return self._document
+        async with self._lock:
+            if self._document is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._document
+            document = self._read_file()
+            if document is not None:
+                self.file_loads += 1
+            else:
+                response = await http.get(DISCOVERY_URL)
+                response.raise_for_status()
+                document = response.json()
+                self.fetches += 1
+                self._write_file(document)
+            self._document = document
+            self._loaded_at = time.monotonic()
+            return document
+
+    async def method_url(self, http, resource_path, method):
+        """
+        URL template and HTTP method of an API method, e.g. (["users", "dataset"], "aggregate").
+
+        Falls back to the documented aggregate endpoint if the document is unavailable.
+        """
+        try:
+            document = await self.get(http)
+            resource = document
+            for name in resource_path:
+                resource = resource["resources"][name]
+            spec = resource["methods"][method]
+            return document["rootUrl"] + document["servicePath"] + spec["path"], spec["httpMethod"]
+        except Exception as e:
+            print(f"Error reading Google Fit discovery document, using the default endpoint: {e}")
+            return DEFAULT_AGGREGATE_URL, "POST"
+
+
+def credential_key(token_info):
+    """Hash identifying a set of credentials: the refresh token when there is one, else the access token."""
+    credential = token_info.get("refresh_token") or token_info.get("access_token") or ""
+    return hashlib.sha256(credential.encode("utf-8")).hexdigest()
+
+
+class TokenManager:
+    """
+    Google OAuth tokens, refreshed before they expire.
+
+    Tokens are always looked up with the credentials the client sends: the
+    freshest token of each credential (a hash of its refresh token) is kept in
+    memory and in the google_tokens collection, so a caller only ever gets a
+    token refreshed from the refresh token it holds itself, and a refresh made
+    by one worker is reused by the others. A token within `margin` seconds of
+    its expiry is refreshed before it is used, and concurrent refreshes of the
+    same credential share one call to the token endpoint, so tokens expiring
+    together cause one refresh per user.
+    """
+
+    def __init__(self, api, margin=GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS,
+                 max_entries=GOOGLE_FIT_CLIENT_CACHE_SIZE, ttl=GOOGLE_FIT_CLIENT_TTL_SECONDS):
+        self.api = api
+        self.margin = margin
+        self._tokens = TTLCache(max_entries=max_entries, ttl=ttl)  # credential key -> token
+        self._inflight = {}  # credential key -> future of the refresh in progress
+
+        # Counters exposed through get_metrics()
+        self.refreshes = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.store_reads = 0
+        self.store_hits = 0
+
+    async def _post(self, data):
+        response = await self.api.http.post(TOKEN_URI, data=dict(
+            data, client_id=GOOGLE_CLIENT_ID or "", client_secret=GOOGLE_CLIENT_SECRET or ""
+        ))
+        if response.status_code != 200:
+            raise FitnessAPIError(response.status_code, response.text)
+        return response.json()
+
+    def expiring(self, token):
+        expires_at = token.get("expires_at")
+        return expires_at is not None and expires_at - self.margin <= time.time()
+
+    async def exchange_code(self, code, redirect_uri, db=None):
+        """
+        Exchange an authorization code for access and refresh tokens.
+
+        Args:
+            code: Authorization code from the OAuth callback
+            redirect_uri: Redirect URI the code was issued for
+            db: Database holding google_tokens (optional)
+
+        Returns:
+            dict: The token response with expires_at, or the error response of the endpoint
+        """
+        response = await self.api.http.post(TOKEN_URI, data={
+            "client_id": GOOGLE_CLIENT_ID or "",
+            "client_secret": GOOGLE_CLIENT_SECRET or "",
+            "code": code,
+            "redirect_uri": redirect_uri,
+            "grant_type": "authorization_code"
+        })
+        token_data = response.json()
+        if "error" in token_data:
+            return token_data
+
+        # Calculate expiration time
+        if "expires_in" in token_data:
+            token_data["expires_at"] = int(time.time()) + token_data["expires_in"]
+
+        key = credential_key(token_data)
+        self._tokens.set(key, token_data)
+        if db is not None:
+            await self._save(db, key, token_data)
+        return token_data
+
+    async def refresh(self, token_info, db=None):
+        """
+        Refresh an access token, sharing the call with concurrent refreshes of the same credential.
+
+        Args:
+            token_info: Token information holding the refresh token
+            db: Database to keep the refreshed token in (optional)
+
+        Raises:
+            FitnessAPIError: If the token endpoint rejects the refresh token
+        """
+        key = credential_key(token_info)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            data = await self._post({"grant_type": "refresh_token", "refresh_token": token_info["refresh_token"]})
+            token = {
+                "access_token": data["access_token"],
+                # Google only returns a refresh token when it rotates it
+                "refresh_token": data.get("refresh_token") or token_info["refresh_token"],
+                "expires_at": int(time.time()) + int(data.get("expires_in", 3600))
+            }
+            self.refreshes += 1
+            self._tokens.set(key, token)
+            if db is not None:
+                await self._save(db, key, token)
+            future.set_result(token)
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError("Token refresh was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            self.failures += 1
+            future.set_exception(e)
+            # Waiters see the error; nobody else needs to retrieve it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        return token
+
+    async def refresh_rejected(self, token_info, db=None):
+        """
+        A new token for one the API rejected: the token another request already
+        refreshed for the same credential, or else a single-flight refresh().
+        """
+        token = self._tokens.get(credential_key(token_info))
+        if token is not None and token["access_token"] != token_info["access_token"] and not self.expiring(token):
+            return token
+        return await self.refresh(token_info, db)
+
+    async def _load(self, db, key):
+        self.store_reads += 1
+        try:
+            return await db[GOOGLE_TOKENS_COLLECTION].find_one(
+                {"credential": key}, {"_id": 0, "access_token": 1, "refresh_token": 1, "expires_at": 1}
+            )
+        except Exception as e:
+            print(f"Error loading Google tokens: {e}")
+            return None
+
+    async def _save(self, db, key, token):
+        try:
+            await db[GOOGLE_TOKENS_COLLECTION].update_one({"credential": key}, {"$set": {
+                "access_token": token["access_token"],
+                "refresh_token": token.get("refresh_token"),
+                "expires_at": token.get("expires_at"),
+                "updated_at": datetime.datetime.utcnow()
+            }}, upsert=True)
+        except Exception as e:
+            print(f"Error saving Google tokens: {e}")
+
+    async def get_token(self, token_info, db=None):
+        """
+        A usable token for the client's credentials, refreshed first if it is about to expire.
+
+        Args:
+            token_info: Token information sent by the client
+            db: Database holding google_tokens, checked for a token another
+                worker refreshed before refreshing here (optional)
+
+        Returns:
+            dict: access_token, refresh_token and expires_at
+
+        Raises:
+            FitnessAPIError: If there is no access token or refreshing fails
+        """
+        if not token_info or not token_info.get("access_token"):
+            raise FitnessAPIError(401, "Google Fit is not connected for this user")
+
+        # A token refreshed earlier is newer than what the client still holds
+        key = credential_key(token_info)
+        token = self._tokens.get(key)
+        if token is None or (token.get("expires_at") or 0) < (token_info.get("expires_at") or 0):
+            token = dict(token_info)
+            self._tokens.set(key, token)
+
+        if self.expiring(token) and token.get("refresh_token"):
+            stored = await self._load(db, key) if db is not None and key not in self._inflight else None
+            if stored and stored.get("access_token") and not self.expiring(stored):
+                self.store_hits += 1
+                token = stored
+                self._tokens.set(key, token)
+            else:
+                token = await self.refresh(token, db)
+        return token
+
+    def get_metrics(self):
+        return dict(
+            self._tokens.get_metrics(),
+            refreshes=self.refreshes,
+            coalesced=self.coalesced,
+            failures=self.failures,
+            store_reads=self.store_reads,
+            store_hits=self.store_hits,
+            inflight=len(self._inflight)
+        )
+
+
+class FitnessClient:
+    """
+    Fitness API access for one set of OAuth credentials.
+
+    Holds the current access token; when the API rejects it and a refresh
+    token is available, the token is refreshed once through the token
+    manager and the call repeated.
+    """
+
+    def __init__(self, api, token_info):
+        self.api = api
+        self.access_token = token_info.get("access_token")
+        self.refresh_token = token_info.get("refresh_token")
+
+    async def aggregate(self, body, user_id="me", db=None):
+        """
+        Run users.dataset.aggregate.
+
+        Args:
+            body: Aggregate request (aggregateBy, bucketByTime, start/endTimeMillis)
+            user_id: Fitness API user, "me" for the token's owner
+            db: Database to keep a token refreshed after a 401 in (optional)
+
+        Returns:
+            dict: The aggregate response
+
+        Raises:
+            FitnessAPIError: If the API returns an error
+        """
+        url, method = await self.api.discovery.method_url(self.api.http, ["users", "dataset"], "aggregate")
+        url = url.replace("{userId}", user_id)
+        for attempt in range(2):
+            access_token = self.access_token
+            started = time.perf_counter()
+            response = await self.api.http.request(
+                method, url, json=body, headers={"Authorization": f"Bearer {access_token}"}
+            )
+            self.api.record(time.perf_counter() - started)
+            if response.status_code == 401 and attempt == 0 and self.refresh_token:
+                if self.access_token == access_token:
+                    token = await self.api.tokens.refresh_rejected(
+                        {"access_token": access_token, "refresh_token": self.refresh_token}, db
+                    )
+                    self.access_token = token["access_token"]
+                continue
+            if response.status_code != 200:
+                raise FitnessAPIError(response.status_code, response.text)
+            return response.json()
+
+
+class GoogleFitAPI:
+    """
+    Shared entry point to the Google Fit REST API.
+
+    All requests, token refreshes included, go through one pooled async HTTP
+    client, so connections are reused across users; per-credential clients
+    are cached by a hash of the credentials.
+    """
+
+    def __init__(self, transport=None, max_connections=GOOGLE_FIT_MAX_CONNECTIONS,
+                 timeout=GOOGLE_FIT_TIMEOUT_SECONDS, discovery=None):
+        self.transport = transport
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.discovery = discovery or DiscoveryDocument()
+        self.tokens = TokenManager(self)
+        self._http = None
+        self._clients = TTLCache(max_entries=GOOGLE_FIT_CLIENT_CACHE_SIZE, ttl=GOOGLE_FIT_CLIENT_TTL_SECONDS)
+
+        # Counters exposed through get_metrics()
+        self.requests = 0
+        self.total_latency = 0.0
+
+    @property
+    def http(self):
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+                transport=self.transport
+            )
+        return self._http
+
+    def record(self, latency):
+        self.requests += 1
+        self.total_latency += latency
+
+    def client_for(self, token_info):
+        """The cached client for these credentials, using the access token given."""
+        key = credential_key(token_info)
+        client = self._clients.get(key)
+        if client is None:
+            client = FitnessClient(self, token_info)
+            self._clients.set(key, client)
+        else:
+            client.access_token = token_info.get("access_token")
+        return client
+
+    async def aggregate(self, token_info, body, user_id="me", db=None):
+        """Run users.dataset.aggregate with the given OAuth token information (see TokenManager.get_token())."""
+        return await self.client_for(token_info).aggregate(body, user_id, db)
+
+    def get_metrics(self):
+        return {
+            "backend": type(self.transport).__name__ if self.transport else "google",
+            "requests": self.requests,
+            "avg_latency_ms": round(self.total_latency / self.requests * 1000, 2) if self.requests else 0.0,
+            "clients": self._clients.get_metrics(),
+            "tokens": self.tokens.get_metrics(),
+            "discovery_fetches": self.discovery.fetches,
+            "discovery_file_loads": self.discovery.file_loads
+        }
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+class RecordedFitnessTransport(httpx.AsyncBaseTransport):
+    """
+    Offline stand-in for the Google endpoints, replaying recorded responses.
+
+    Serves the discovery document, the token endpoint (code exchange and
+    refresh) and dataset:aggregate, whose buckets cover the requested time
+    range with the recorded daily step counts. The access token "expired" is
+    rejected with 401 to exercise refreshing. Each request takes `latency`
+    seconds.
+    """
+
+    def __init__(self, recordings_path=GOOGLE_FIT_RECORDINGS_PATH, latency=GOOGLE_FIT_RECORDED_LATENCY_SECONDS):
+        with open(recordings_path, "r", encoding="utf-8") as f:
+            self.recordings = json.load(f)
+        self.latency = latency
+        self.requests = 0
+
+    def _aggregate(self, body):
+        duration = int(body.get("bucketByTime", {}).get("durationMillis", 86400000))
+        start, end = int(body["startTimeMillis"]), int(body["endTimeMillis"])
+        daily_steps = self.recordings["aggregate"]["daily_steps"]
+        template = self.recordings["aggregate"]["bucket"]
+        buckets = []
+        for index, bucket_start in enumerate(range(start, end, duration)):
+            bucket_end = min(bucket_start + duration, end)
+            bucket = json.loads(json.dumps(template))
+            bucket["startTimeMillis"], bucket["endTimeMillis"] = str(bucket_start), str(bucket_end)
+            point = bucket["dataset"][0]["point"][0]
+            point["startTimeNanos"], point["endTimeNanos"] = str(bucket_start * 1000000), str(bucket_end * 1000000)
+            point["value"][0]["intVal"] = daily_steps[index % len(daily_steps)]
+            buckets.append(bucket)
+        return {"bucket": buckets}
+
+    async def handle_async_request(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        url = str(request.url)
+        if url.startswith(DISCOVERY_URL):
+            return httpx.Response(200, json=self.recordings["discovery"])
+        if url == TOKEN_URI:
+            form = parse_qs((await request.aread()).decode("utf-8"))
+            token = {"access_token": f"recorded-{random.getrandbits(32):08x}", "expires_in": 3599,
+                     "token_type": "Bearer"}
+            if form.get("grant_type") == ["authorization_code"] and form.get("code"):
+                return httpx.Response(200, json=dict(token, refresh_token=f"recorded-refresh-{form['code'][0]}"))
+            if form.get("grant_type") == ["refresh_token"] and form.get("refresh_token"):
+                return httpx.Response(200, json=token)
+            return httpx.Response(400, json={"error": "invalid_grant"})
+        if url.endswith("/dataset:aggregate"):
+            if request.headers.get("Authorization") == "Bearer expired":
+                return httpx.Response(401, json=self.recordings["unauthorized"])
+            return httpx.Response(200, json=self._aggregate(json.loads(await request.aread())))
+        return httpx.Response(404, json={"error": {"code": 404, "message": f"No recording for {url}"}})
+
+
+def day_range_millis(time_range, now=None):
+    """Start and end in epoch milliseconds of today, this week or this month (UTC)."""
+    now = now or datetime.datetime.utcnow()
+    start = datetime.datetime(now.year, now.month, now.day)
+    if time_range == "week":
+        start -= datetime.timedelta(days=now.weekday())
+    elif time_range == "month":
+        start = datetime.datetime(now.year, now.month, 1)
+    epoch = datetime.datetime(1970, 1, 1)
+    return int((start - epoch).total_seconds() * 1000), int((now - epoch).total_seconds() * 1000)
+
+
+def create_google_fit(name=GOOGLE_FIT_BACKEND):
+    """Create the API entry point by backend name (google or recorded)."""
+    if name == "recorded":
+        return GoogleFitAPI(transport=RecordedFitnessTransport(), discovery=DiscoveryDocument(path=None))
+    if name == "google":
+        return GoogleFitAPI()
+    raise ValueError(f"Unknown Google Fit backend: {name}")
+
+
+# Create a singleton instance
+google_fit = create_google_fit()
@@ -0,0 +1,290 @@
+import os
+import time
+import asyncio
+from array import array
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Session configuration
+GYM_SESSION_TTL_SECONDS = float(os.getenv("GYM_SESSION_TTL_SECONDS", "1800"))
+GYM_SESSION_EVICT_INTERVAL_SECONDS = float(os.getenv("GYM_SESSION_EVICT_INTERVAL_SECONDS", "60"))
+# Most recent frames of angle history kept per session (9000 = 10 minutes at 15 FPS)
+GYM_HISTORY_CAPACITY = int(os.getenv("GYM_HISTORY_CAPACITY", "9000"))
+
+DEFAULT_SESSION_ID = "default"
+
+HISTORY_EXPORT_MODES = ("downsample", "minmax")
+
+# SessionState attributes holding RingBuffer histories, with their array typecodes
+HISTORY_BUFFERS = {
+    "left_angle": "h",
+    "right_angle": "h",
+    "body_angles": "h",
+    "frames": "i",
+}
+
+
+def session_key(user_id, session_id):
+    """Key identifying one exercise session of one user; a tuple, so no two (user_id, session_id) pairs collide."""
+    return (user_id, session_id)
+
+
+class RingBuffer:
+    """
+    Fixed-capacity history of small integers backed by a typed array.
+
+    Grows like a list until it holds `capacity` values, then overwrites the
+    oldest one, so a session's memory stays bounded however long it runs.
+    """
+
+    __slots__ = ("capacity", "total", "_data", "_next")
+
+    def __init__(self, capacity=GYM_HISTORY_CAPACITY, typecode="h", values=()):
+        self.capacity = capacity
+        self.total = 0  # values ever appended, including overwritten ones
+        self._data = array(typecode)
+        self._next = 0  # position of the oldest value once the buffer is full
+        self.extend(values)
+
+    def append(self, value):
+        if len(self._data) < self.capacity:
+            self._data.append(value)
+        else:
+            self._data[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+        self.total += 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def to_array(self):
+        """Copy of the buffered values as a NumPy array, oldest first."""
+        view = np.frombuffer(self._data, dtype=self._data.typecode)
+        return np.concatenate((view[self._next:], view[:self._next]))
+
+    def tolist(self):
+        return self.to_array().tolist()
+
+
+def export_history(frames, series, max_points=None, mode="downsample"):
+    """
+    Export angle history, optionally reduced to a bounded number of points.
+
+    Args:
+        frames: RingBuffer of frame numbers
+        series: Dict of name -> RingBuffer of angles recorded on those frames
+        max_points: Upper bound on exported points per series (None for everything buffered)
+        mode: "downsample" keeps evenly spaced samples; "minmax" keeps the minimum and
+              maximum of each bucket so the extremes of every rep survive
+
+    Returns:
+        dict: Name -> list of angles (or {"min": [...], "max": [...]} in minmax mode),
+              plus "frames" with the frame number of each sample or bucket start
+    """
+    if mode not in HISTORY_EXPORT_MODES:
+        raise ValueError(f"Unknown history export mode: {mode}")
+
+    # Keep the most recent stretch all series share, in case the session switched exercises
+    arrays = {name: values.to_array() for name, values in series.items()}
+    length = min([len(frames)] + [len(values) for values in arrays.values()])
+    frame_numbers = frames.to_array()[len(frames) - length:]
+    arrays = {name: values[len(values) - length:] for name, values in arrays.items()}
+
+    if max_points is None or length <= max_points:
+        exported = {name: values.tolist() for name, values in arrays.items()}
+        exported["frames"] = frame_numbers.tolist()
+        return exported
+
+    if mode == "downsample":
+        picks = np.linspace(0, length - 1, max(max_points, 1)).round().astype(np.int64)
+        exported = {name: values[picks].tolist() for name, values in arrays.items()}
+        exported["frames"] = frame_numbers[picks].tolist()
+        return exported
+
+    starts = np.linspace(0, length, max(max_points // 2, 1) + 1).astype(np.int64)[:-1]
+    exported = {
+        name: {
+            "min": np.minimum.reduceat(values, starts).tolist(),
+            "max": np.maximum.reduceat(values, starts).tolist()
+        }
+        for name, values in arrays.items()
+    }
+    exported["frames"] = frame_numbers[starts].tolist()
+    return exported
+
+
+class SessionState:
+    """Tracking state of one exercise session."""
+
+    __slots__ = ("user_id", "session_id", "exercise_choice", "exercise_counters", "state", "feedback",
+                 "flags", "left_angle", "right_angle", "body_angles", "frames", "frame_count",
+                 "started_at", "last_seen")
+
+    def __init__(self, user_id, session_id=DEFAULT_SESSION_ID, exercise_choice=1):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.exercise_choice = exercise_choice
+        self.started_at = time.time()
+        self.last_seen = self.started_at
+        self.reset()
+
+    @property
+    def key(self):
+        return session_key(self.user_id, self.session_id)
+
+    def reset(self):
+        """Reset all tracking variables."""
+        self.exercise_counters = {}  # exercise id -> reps
+        self.state = "Up"
+        self.feedback = ""
+        self.flags = {}  # state machine flags, e.g. range_flag
+        for name, typecode in HISTORY_BUFFERS.items():
+            setattr(self, name, RingBuffer(typecode=typecode))
+        self.frame_count = 0
+
+
+class InMemorySessionStore:
+    """Session store backed by a dict kept in least-recently-seen order."""
+
+    def __init__(self):
+        self._sessions = OrderedDict()  # key -> (state, expires_at)
+
+    async def get(self, key):
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+        state, expires_at = entry
+        if expires_at <= time.time():
+            del self._sessions[key]
+            return None
+        return state
+
+    async def put(self, state, ttl):
+        key = state.key
+        self._sessions[key] = (state, state.last_seen + ttl)
+        self._sessions.move_to_end(key)
+
+    async def delete(self, key):
+        self._sessions.pop(key, None)
+
+    async def evict_expired(self, now):
+        # Entries are ordered by last put, so expired sessions are always at the front
+        evicted = 0
+        while self._sessions:
+            key, (state, expires_at) = next(iter(self._sessions.items()))
+            if expires_at > now:
+                break
+            del self._sessions[key]
+            evicted += 1
+        return evicted
+
+    async def count(self):
+        return len(self._sessions)
+
+
+class SessionManager:
+    """
+    Per-user exercise sessions keyed by (user_id, session_id).
+
+    Frames of the same session are serialized with a per-session lock so state
+    updates are applied in order; idle sessions expire after the TTL.
+    """
+
+    def __init__(self, store=None, ttl=GYM_SESSION_TTL_SECONDS):
+        self.store = store or InMemorySessionStore()
+        self.ttl = ttl
+        self._locks = {}
+        self._eviction_task = None
+        # Called with the key of every session that is restarted, ended or evicted
+        self.end_listeners = []
+
+    def _notify_end(self, key):
+        for listener in self.end_listeners:
+            try:
+                listener(key)
+            except Exception as e:
+                print(f"Error in session end listener: {e}")
+
+    def lock(self, user_id, session_id=DEFAULT_SESSION_ID):
+        """Lock serializing updates to one session within this worker."""
+        key = session_key(user_id, session_id)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def start(self, user_id, session_id=DEFAULT_SESSION_ID, exercise_choice=1):
+        """Start a fresh session, replacing any previous state under the same key."""
+        state = SessionState(user_id, session_id, exercise_choice)
+        await self.store.put(state, self.ttl)
+        self._notify_end(state.key)
+        return state
+
+    async def get(self, user_id, session_id=DEFAULT_SESSION_ID):
+        return await self.store.get(session_key(user_id, session_id))
+
+    async def get_or_create(self, user_id, session_id=DEFAULT_SESSION_ID, exercise_choice=1):
+        """Return the session, starting one if it does not exist or has expired."""
+        state = await self.get(user_id, session_id)
+        if state is None:
+            state = await self.start(user_id, session_id, exercise_choice)
+        return state
+
+    async def save(self, state):
+        """Store the updated state and extend its TTL."""
+        state.last_seen = time.time()
+        await self.store.put(state, self.ttl)
+
+    async def end(self, user_id, session_id=DEFAULT_SESSION_ID):
+        """Remove a session and return its final state (None if it did not exist)."""
+        key = session_key(user_id, session_id)
+        state = await self.store.get(key)
+        await self.store.delete(key)
+        self._locks.pop(key, None)
+        self._notify_end(key)
+        return state
+
+    async def evict_expired(self):
+        evicted = await self.store.evict_expired(time.time())
+        # Drop locks of sessions that no longer exist and are not in use
+        for key, lock in list(self._locks.items()):
+            if not lock.locked() and await self.store.get(key) is None:
+                del self._locks[key]
+                self._notify_end(key)
+        return evicted
+
+    async def _eviction_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                evicted = await self.evict_expired()
+                if evicted:
+                    print(f"Evicted {evicted} idle exercise sessions")
+            except Exception as e:
+                print(f"Error evicting exercise sessions: {e}")
+
+    def start_eviction(self, interval=GYM_SESSION_EVICT_INTERVAL_SECONDS):
+        """Start the background task that evicts idle sessions."""
+        if self._eviction_task is None:
+            self._eviction_task = asyncio.create_task(self._eviction_loop(interval))
+
+    async def stop_eviction(self):
+        if self._eviction_task:
+            self._eviction_task.cancel()
+            try:
+                await self._eviction_task
+            except asyncio.CancelledError:
+                pass
+            self._eviction_task = None
+
+
+# Create a singleton instance
+session_manager = SessionManager()
@@ -0,0 +1,174 @@
+import os
+import json
+import asyncio
+import hashlib
+import datetime
+from dotenv import load_dotenv
+
+from database.cache import TTLCache
+from database.indexes import (
+    HEALTH_PREDICTION_CACHE_COLLECTION, HEALTH_PREDICTION_CACHE_SHARED, HEALTH_PREDICTION_CACHE_TTL_SECONDS
+)
+
+# Load environment variables
+load_dotenv()
+
+# Health prediction cache configuration
+HEALTH_PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("HEALTH_PREDICTION_CACHE_MAX_ENTRIES", "1024"))
+
+# Bump when the prediction prompt changes so earlier answers are not reused
+PREDICTION_PROMPT_VERSION = 1
+
+LIST_FIELDS = ("health_issues", "current_medications")
+TEXT_FIELDS = ("sex", "activity_level", "daily_routine")
+
+
+def _text(value):
+    return " ".join(str(value).lower().split()) if value is not None else None
+
+
+def normalize_profile(user_data):
+    """
+    Reduce a health profile to the fields the prediction depends on, in a
+    canonical form: text lowercased with collapsed whitespace, lists
+    deduplicated and sorted, weight and height rounded to whole kg and cm,
+    sleep to half hours. Profiles that differ only in these ways get the same
+    prediction.
+
+    Args:
+        user_data: UserHealthData as a dict
+
+    Returns:
+        dict: The normalized profile
+    """
+    profile = {
+        "age": int(round(user_data["age"])) if user_data.get("age") is not None else None,
+        "weight": int(round(user_data["weight"])) if user_data.get("weight") is not None else None,
+        "height": int(round(user_data["height"])) if user_data.get("height") is not None else None,
+        "sleep_hours": round(user_data["sleep_hours"] * 2) / 2 if user_data.get("sleep_hours") is not None else None,
+        "family_history": {
+            _text(condition): bool(present) for condition, present in sorted((user_data.get("family_history") or {}).items())
+        },
+    }
+    for field in TEXT_FIELDS:
+        profile[field] = _text(user_data.get(field))
+    for field in LIST_FIELDS:
+        profile[field] = sorted({_text(item) for item in user_data.get(field) or [] if _text(item)})
+    return profile
+
+
+def profile_key(profile, model):
+    """Content address of a normalized profile: SHA-256 of its canonical JSON."""
+    canonical = json.dumps(
+        {"profile": profile, "model": model, "prompt_version": PREDICTION_PROMPT_VERSION},
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class HealthPredictionCache:
+    """
+    Two-tier cache of health predictions keyed by profile_key().
+
+    The in-process tier is an LRU with TTL expiry. The optional shared tier is
+    a MongoDB collection whose TTL index expires entries after the same time.
+    Concurrent misses for the same key share a single computation.
+    """
+
+    def __init__(self, ttl=HEALTH_PREDICTION_CACHE_TTL_SECONDS, max_entries=HEALTH_PREDICTION_CACHE_MAX_ENTRIES,
+                 shared=HEALTH_PREDICTION_CACHE_SHARED):
+        self.ttl = ttl
+        self.shared = shared
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self._inflight = {}  # key -> future of the computation in progress
+
+        # Counters exposed through get_metrics()
+        self.shared_hits = 0
+        self.computations = 0
+        self.coalesced = 0
+
+    async def _get_shared(self, db, key):
+        if not self.shared or db is None:
+            return None
+        try:
+            entry = await db[HEALTH_PREDICTION_CACHE_COLLECTION].find_one({
+                "_id": key,
+                "created_at": {"$gte": datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)}
+            })
+        except Exception as e:
+            print(f"Error reading shared health prediction cache: {e}")
+            return None
+        return entry["prediction"] if entry else None
+
+    async def _put_shared(self, db, key, prediction):
+        if not self.shared or db is None:
+            return
+        try:
+            await db[HEALTH_PREDICTION_CACHE_COLLECTION].replace_one(
+                {"_id": key},
+                {"prediction": prediction, "created_at": datetime.datetime.utcnow()},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Error writing shared health prediction cache: {e}")
+
+    async def get_or_compute(self, key, compute, db=None):
+        """
+        Return the cached prediction for `key`, or compute and cache it.
+
+        Args:
+            key: profile_key() of the normalized profile
+            compute: Coroutine function producing the prediction
+            db: Database for the shared tier (optional)
+
+        Returns:
+            tuple: (prediction, True if it came from the cache)
+        """
+        prediction = self.memory.get(key)
+        if prediction is not None:
+            return prediction, True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            prediction = await self._get_shared(db, key)
+            cached = prediction is not None
+            if cached:
+                self.shared_hits += 1
+            else:
+                self.computations += 1
+                prediction = await compute()
+                await self._put_shared(db, key, prediction)
+            self.memory.set(key, prediction)
+            future.set_result(prediction)
+            return prediction, cached
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError("Health prediction was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters see the error; nobody else needs to retrieve it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def get_metrics(self):
+        return dict(
+            self.memory.get_metrics(),
+            shared=self.shared,
+            shared_hits=self.shared_hits,
+            computations=self.computations,
+            coalesced=self.coalesced,
+            inflight=len(self._inflight)
+        )
+
+
+# Create a singleton instance
+health_prediction_cache = HealthPredictionCache()
@@ -0,0 +1,214 @@
+import io
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Without Pillow uploads are sent as they are
+    Image = None
+
+# Load environment variables
+load_dotenv()
+
+# Report image pre-processing configuration
+REPORT_IMAGE_MAX_DIMENSION = int(os.getenv("REPORT_IMAGE_MAX_DIMENSION", "2048"))
+REPORT_IMAGE_FORMAT = os.getenv("REPORT_IMAGE_FORMAT", "jpeg").lower()  # jpeg, webp
+REPORT_IMAGE_QUALITY = int(os.getenv("REPORT_IMAGE_QUALITY", "85"))
+# Documents read as well in grayscale with stretched contrast, at a fraction of the size
+REPORT_IMAGE_GRAYSCALE = os.getenv("REPORT_IMAGE_GRAYSCALE", "false").lower() == "true"
+REPORT_IMAGE_ENHANCE_CONTRAST = os.getenv("REPORT_IMAGE_ENHANCE_CONTRAST", "false").lower() == "true"
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", str(os.cpu_count() or 1)))
+
+EXIF_ORIENTATION = 0x0112
+
+# Side of the difference hash grid: DHASH_SIZE ** 2 bits
+DHASH_SIZE = 16
+
+OUTPUT_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+# Formats the vision model accepts as they are
+MODEL_IMAGE_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+# Leading bytes of the accepted formats, to label uploads when Pillow is not installed
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def sniff_mime_type(data):
+    """Guess the MIME type of encoded image bytes from their signature."""
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def difference_hash(image, size=DHASH_SIZE):
+    """
+    Perceptual hash of an image as hex: one bit per horizontally adjacent pair
+    of cells of a (size + 1) x size grayscale thumbnail, set where brightness
+    falls. Re-photos and re-encodings of the same page differ in few bits.
+    """
+    pixels = image.convert("L").resize((size + 1, size), Image.Resampling.BOX).tobytes()
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for column in range(size):
+            bits = bits << 1 | (pixels[offset + column] > pixels[offset + column + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def preprocess_image(data, max_dimension=REPORT_IMAGE_MAX_DIMENSION, output_format=REPORT_IMAGE_FORMAT,
+                     quality=REPORT_IMAGE_QUALITY, grayscale=REPORT_IMAGE_GRAYSCALE,
+                     enhance_contrast=REPORT_IMAGE_ENHANCE_CONTRAST):
+    """
+    Prepare an uploaded image for the vision model: decode, apply the EXIF
+    orientation, downscale to fit max_dimension, optionally convert to
+    grayscale and stretch the contrast, and re-encode.
+
+    The upload is kept as it is when it already is in a format the model
+    accepts, needs none of these changes and is smaller than the re-encoded
+    image.
+
+    Args:
+        data: Encoded image bytes
+        max_dimension: Longest side of the result in pixels
+        output_format: "jpeg" or "webp"
+        quality: Encoder quality (1-100)
+        grayscale: Convert to a single channel
+        enhance_contrast: Stretch the histogram, cutting 1% at each end
+
+    Returns:
+        dict: data, mime_type, width, height, original_size, original_format,
+              original_dimensions and dhash (see difference_hash()) of the prepared image
+
+    Raises:
+        ValueError: If the bytes are not an image Pillow can decode
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_format = image.format
+        original_dimensions = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        # Let the JPEG decoder scale down by a power of two while decoding, much cheaper than resizing after
+        image.draft("L" if grayscale else "RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+    except Exception as e:
+        raise ValueError(f"Could not decode image: {e}") from e
+
+    result = {
+        "original_size": len(data),
+        "dhash": None,
+        "original_format": original_format,
+        "original_dimensions": original_dimensions
+    }
+    unchanged = (
+        orientation == 1 and max(original_dimensions) <= max_dimension
+        and not grayscale and not enhance_contrast
+    )
+
+    if image.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white, as a scanned page would look
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image)
+    image = image.convert("L" if grayscale else "RGB")
+
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    if enhance_contrast:
+        image = ImageOps.autocontrast(image, cutoff=1)
+    result["dhash"] = difference_hash(image)
+
+    pil_format, mime_type = OUTPUT_FORMATS[output_format]
+    buffer = io.BytesIO()
+    if pil_format == "JPEG":
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buffer, "WEBP", quality=quality, method=4)
+    encoded = buffer.getvalue()
+
+    if unchanged and original_format in MODEL_IMAGE_TYPES and len(data) <= len(encoded):
+        return dict(result, data=data, mime_type=MODEL_IMAGE_TYPES[original_format],
+                    width=original_dimensions[0], height=original_dimensions[1])
+    return dict(result, data=encoded, mime_type=mime_type, width=image.width, height=image.height)
+
+
+class ImagePreprocessor:
+    """
+    Runs preprocess_image() on a thread pool, off the event loop.
+
+    Pillow releases the GIL while decoding, resizing and encoding, so threads
+    scale across cores without copying the images to other processes.
+    """
+
+    def __init__(self, workers=IMAGE_PREPROCESS_WORKERS, **options):
+        self.workers = max(1, workers)
+        self.options = options
+        self._executor = None
+
+        # Counters exposed through get_metrics()
+        self.images = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_latency = 0.0
+
+    async def process(self, data):
+        """
+        Prepare an image in the worker pool.
+
+        Returns:
+            dict: See preprocess_image(); without Pillow the original bytes
+                  with their sniffed MIME type
+
+        Raises:
+            ValueError: If the bytes are not a decodable image
+        """
+        if Image is None:
+            return {"data": data, "mime_type": sniff_mime_type(data), "original_size": len(data)}
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-preprocess")
+        started = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, lambda: preprocess_image(data, **self.options)
+            )
+        except Exception:
+            self.errors += 1
+            raise
+        latency = time.perf_counter() - started
+        self.images += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(result["data"])
+        self.total_latency += latency
+        return dict(result, preprocess_ms=round(latency * 1000, 2))
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_metrics(self):
+        return {
+            "workers": self.workers,
+            "images": self.images,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "size_ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0,
+            "avg_preprocess_ms": round(self.total_latency / self.images * 1000, 2) if self.images else 0.0
+        }
+
+
+# Create a singleton instance
+image_preprocessor = ImagePreprocessor()
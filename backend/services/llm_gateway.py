@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import random
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+
+# Load environment variables
+load_dotenv()
+
+# OpenAI API configuration
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# Gateway configuration
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")  # openai, stub
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+LLM_STUB_LATENCY_SECONDS = float(os.getenv("LLM_STUB_LATENCY_SECONDS", "0.05"))
+
+DEFAULT_MODEL = "gpt-4o"
+
+# Errors worth retrying: the request may succeed if sent again a little later
+RETRYABLE_ERRORS = (
+    APIConnectionError,
+    APITimeoutError,
+    RateLimitError,
+    InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class OpenAIBackend:
+    """Chat completion backend talking to the OpenAI API over a pooled HTTP connection."""
+
+    def __init__(self, api_key=None, max_connections=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT_SECONDS):
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            timeout=timeout
+        )
+        # Retries are handled by the gateway so they share the jittered backoff policy
+        self.client = AsyncOpenAI(
+            api_key=api_key or OPENAI_API_KEY,
+            http_client=self.http_client,
+            max_retries=0
+        )
+
+    async def complete(self, model, messages, response_format=None, timeout=None):
+        kwargs = {"model": model, "messages": messages}
+        if response_format:
+            kwargs["response_format"] = response_format
+        if timeout:
+            kwargs["timeout"] = timeout
+
+        response = await self.client.chat.completions.create(**kwargs)
+        return response.choices[0].message.content
+
+    async def stream(self, model, messages, response_format=None, timeout=None):
+        kwargs = {"model": model, "messages": messages, "stream": True}
+        if response_format:
+            kwargs["response_format"] = response_format
+        if timeout:
+            kwargs["timeout"] = timeout
+
+        response = await self.client.chat.completions.create(**kwargs)
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+
+class StubBackend:
+    """
+    Offline backend that answers after a fixed latency without any network access.
+
+    Used for benchmarking gateway throughput and for running the API without an
+    OpenAI key. A custom responder can be supplied to return canned content.
+    """
+
+    def __init__(self, latency=LLM_STUB_LATENCY_SECONDS, responder=None, chunk_size=16, chunk_delay=0.0):
+        self.latency = latency
+        self.responder = responder
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+
+    def _respond(self, model, messages, response_format):
+        if self.responder:
+            return self.responder(model, messages, response_format)
+        return json.dumps({
+            "stub": True,
+            "model": model,
+            "messages": len(messages)
+        })
+
+    async def complete(self, model, messages, response_format=None, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(model, messages, response_format)
+
+    async def stream(self, model, messages, response_format=None, timeout=None):
+        """Yield the canned content in chunk_size pieces: the first after `latency`, then every chunk_delay."""
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self._respond(model, messages, response_format)
+        for start in range(0, len(content), self.chunk_size):
+            if start and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield content[start:start + self.chunk_size]
+
+    async def aclose(self):
+        pass
+
+
+class LLMGateway:
+    """
+    Shared async entry point for every chat completion made by the ai_* services.
+
+    Limits the number of in-flight model calls, applies a per-call timeout and
+    retries transient failures with full-jitter exponential backoff.
+    """
+
+    def __init__(self, backend, max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT_SECONDS,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE_SECONDS,
+                 backoff_max=LLM_BACKOFF_MAX_SECONDS):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Counters exposed through get_metrics()
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.streams = 0
+        self.total_stream_ttfb = 0.0
+        self.max_stream_ttfb = 0.0
+        self.total_stream_latency = 0.0
+
+    def _backoff_delay(self, attempt):
+        """Full jitter: a random delay between 0 and the capped exponential step."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def chat_completion(self, messages, model=DEFAULT_MODEL, response_format=None, timeout=None):
+        """
+        Run a chat completion and return the raw message content.
+
+        Args:
+            messages: Chat messages in OpenAI format
+            model: Model name
+            response_format: Optional OpenAI response_format
+            timeout: Per-call timeout in seconds (defaults to the gateway timeout)
+
+        Returns:
+            str: The content of the first choice
+        """
+        timeout = timeout or self.timeout
+        attempt = 0
+
+        while True:
+            async with self._semaphore:
+                self.in_flight += 1
+                started = time.perf_counter()
+                try:
+                    content = await asyncio.wait_for(
+                        self.backend.complete(model, messages, response_format, timeout),
+                        timeout=timeout
+                    )
+                    self.calls += 1
+                    self.total_latency += time.perf_counter() - started
+                    return content
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        self.failures += 1
+                        raise
+                    error = e
+                except Exception:
+                    self.failures += 1
+                    raise
+                finally:
+                    self.in_flight -= 1
+
+            # Sleep outside the semaphore so waiting retries do not hold a slot
+            delay = self._backoff_delay(attempt)
+            attempt += 1
+            self.retries += 1
+            print(f"LLM call failed ({type(error).__name__}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def chat_completion_stream(self, messages, model=DEFAULT_MODEL, response_format=None, timeout=None):
+        """
+        Run a streaming chat completion and yield the content as it arrives.
+
+        The concurrency slot is held until the stream ends. Transient failures
+        are only retried before the first chunk, since after that the caller
+        already has part of the answer. The timeout applies to the wait for
+        each chunk rather than to the whole stream.
+
+        Args:
+            messages: Chat messages in OpenAI format
+            model: Model name
+            response_format: Optional OpenAI response_format
+            timeout: Longest wait for the next chunk in seconds (defaults to the gateway timeout)
+
+        Yields:
+            str: Content deltas of the first choice
+        """
+        timeout = timeout or self.timeout
+        attempt = 0
+
+        while True:
+            async with self._semaphore:
+                self.in_flight += 1
+                started = time.perf_counter()
+                first_chunk_at = None
+                chunks = self.backend.stream(model, messages, response_format, timeout)
+                try:
+                    while True:
+                        try:
+                            delta = await asyncio.wait_for(chunks.__anext__(), timeout=timeout)
+                        except StopAsyncIteration:
+                            break
+                        if first_chunk_at is None:
+                            first_chunk_at = time.perf_counter()
+                            ttfb = first_chunk_at - started
+                            self.total_stream_ttfb += ttfb
+                            self.max_stream_ttfb = max(self.max_stream_ttfb, ttfb)
+                        yield delta
+                    self.streams += 1
+                    self.total_stream_latency += time.perf_counter() - started
+                    return
+                except RETRYABLE_ERRORS as e:
+                    if first_chunk_at is not None or attempt >= self.max_retries:
+                        self.failures += 1
+                        raise
+                    error = e
+                except Exception:
+                    self.failures += 1
+                    raise
+                finally:
+                    self.in_flight -= 1
+                    await chunks.aclose()
+
+            # Sleep outside the semaphore so waiting retries do not hold a slot
+            delay = self._backoff_delay(attempt)
+            attempt += 1
+            self.retries += 1
+            print(f"LLM stream failed ({type(error).__name__}), retry {attempt} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def chat_completion_json(self, messages, model=DEFAULT_MODEL, timeout=None):
+        """Run a chat completion in JSON mode and return the parsed object."""
+        content = await self.chat_completion(
+            messages,
+            model=model,
+            response_format={"type": "json_object"},
+            timeout=timeout
+        )
+        return json.loads(content)
+
+    def get_metrics(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "avg_latency_ms": round(self.total_latency / self.calls * 1000, 2) if self.calls else 0.0,
+            "streams": self.streams,
+            "avg_stream_ttfb_ms": round(self.total_stream_ttfb / self.streams * 1000, 2) if self.streams else 0.0,
+            "max_stream_ttfb_ms": round(self.max_stream_ttfb * 1000, 2),
+            "avg_stream_latency_ms": round(self.total_stream_latency / self.streams * 1000, 2) if self.streams else 0.0
+        }
+
+    async def aclose(self):
+        await self.backend.aclose()
+
+
+# Global gateway instance, created on first use
+_gateway: Optional[LLMGateway] = None
+
+
+def create_backend(name=LLM_BACKEND):
+    """Create a backend by name (openai or stub)."""
+    if name == "stub":
+        return StubBackend()
+    if name == "openai":
+        return OpenAIBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+def get_llm_gateway():
+    """Return the shared gateway, creating it with the configured backend if needed."""
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway(create_backend())
+    return _gateway
+
+
+def set_llm_backend(backend, **gateway_options):
+    """Replace the shared gateway with one using the given backend (e.g. a StubBackend)."""
+    global _gateway
+    _gateway = LLMGateway(backend, **gateway_options)
+    return _gateway
+
+
+async def close_llm_gateway():
+    """Close the pooled HTTP connection of the shared gateway."""
+    global _gateway
+    if _gateway:
+        await _gateway.aclose()
+        _gateway = None
+
+
+async def chat_completion(messages: List[Dict[str, Any]], model=DEFAULT_MODEL, response_format=None, timeout=None):
+    """Run a chat completion through the shared gateway and return the message content."""
+    return await get_llm_gateway().chat_completion(messages, model, response_format, timeout)
+
+
+async def chat_completion_json(messages: List[Dict[str, Any]], model=DEFAULT_MODEL, timeout=None):
+    """Run a JSON-mode chat completion through the shared gateway and return the parsed object."""
+    return await get_llm_gateway().chat_completion_json(messages, model, timeout)
+
+
+async def chat_completion_stream(messages: List[Dict[str, Any]], model=DEFAULT_MODEL, response_format=None, timeout=None):
+    """Run a streaming chat completion through the shared gateway, yielding content deltas."""
+    async for delta in get_llm_gateway().chat_completion_stream(messages, model, response_format, timeout):
+        yield delta
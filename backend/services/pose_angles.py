@@ -0,0 +1,94 @@
+import numpy as np
+
+# MediaPipe PoseLandmark indices used by the exercise recognisers
+NUM_LANDMARKS = 33
+LEFT_SHOULDER, RIGHT_SHOULDER = 11, 12
+LEFT_ELBOW, RIGHT_ELBOW = 13, 14
+LEFT_WRIST, RIGHT_WRIST = 15, 16
+LEFT_HIP, RIGHT_HIP = 23, 24
+LEFT_KNEE, RIGHT_KNEE = 25, 26
+LEFT_ANKLE, RIGHT_ANKLE = 27, 28
+LEFT_HEEL, RIGHT_HEEL = 29, 30
+
+# Every joint angle any exercise needs, as (name, (first, vertex, last)) landmark triplets
+JOINT_ANGLES = [
+    ("left_knee_heel", (LEFT_HIP, LEFT_KNEE, LEFT_HEEL)),
+    ("right_knee_heel", (RIGHT_HIP, RIGHT_KNEE, RIGHT_HEEL)),
+    ("left_knee", (LEFT_HIP, LEFT_KNEE, LEFT_ANKLE)),
+    ("right_knee", (RIGHT_HIP, RIGHT_KNEE, RIGHT_ANKLE)),
+    ("left_elbow", (LEFT_SHOULDER, LEFT_ELBOW, LEFT_WRIST)),
+    ("right_elbow", (RIGHT_SHOULDER, RIGHT_ELBOW, RIGHT_WRIST)),
+    ("left_hip", (LEFT_SHOULDER, LEFT_HIP, LEFT_KNEE)),
+]
+JOINT_NAMES = [name for name, _ in JOINT_ANGLES]
+JOINT_INDEX = {name: position for position, name in enumerate(JOINT_NAMES)}
+
+# Horizontal distances between paired landmarks, as (name, (left, right)): x of left minus x of right
+SPANS = [
+    ("shoulder_width", (LEFT_SHOULDER, RIGHT_SHOULDER)),
+    ("knee_width", (LEFT_KNEE, RIGHT_KNEE)),
+]
+
+# Columns of compute_features(): every joint angle followed by every span
+FEATURE_NAMES = JOINT_NAMES + [name for name, _ in SPANS]
+FEATURE_INDEX = {name: position for position, name in enumerate(FEATURE_NAMES)}
+
+_FIRST = np.array([triplet[0] for _, triplet in JOINT_ANGLES])
+_VERTEX = np.array([triplet[1] for _, triplet in JOINT_ANGLES])
+_LAST = np.array([triplet[2] for _, triplet in JOINT_ANGLES])
+_SPAN_LEFT = np.array([pair[0] for _, pair in SPANS])
+_SPAN_RIGHT = np.array([pair[1] for _, pair in SPANS])
+
+
+def landmarks_to_array(pose_landmarks):
+    """
+    Convert MediaPipe pose landmarks to a (33, 3) float32 array in one pass.
+
+    Args:
+        pose_landmarks: results.pose_landmarks from MediaPipe Pose
+
+    Returns:
+        np.ndarray: x, y, z of every landmark
+    """
+    return np.array([(point.x, point.y, point.z) for point in pose_landmarks.landmark], dtype=np.float32)
+
+
+def compute_angles(points):
+    """
+    Compute every joint angle in JOINT_ANGLES, in degrees between 0 and 180.
+
+    Works on one frame or a batch: points may have shape (33, 2+) or
+    (..., 33, 2+), e.g. (frames, 33, 3) for a recorded session.
+
+    Args:
+        points: Landmark coordinates; only x and y are used
+
+    Returns:
+        np.ndarray: Angles of shape (..., len(JOINT_ANGLES))
+    """
+    points = np.asarray(points, dtype=np.float32)
+    first = points[..., _FIRST, :2]
+    vertex = points[..., _VERTEX, :2]
+    last = points[..., _LAST, :2]
+
+    to_last = last - vertex
+    to_first = first - vertex
+    radians = np.arctan2(to_last[..., 1], to_last[..., 0]) - np.arctan2(to_first[..., 1], to_first[..., 0])
+    angles = np.abs(np.degrees(radians))
+    return np.where(angles > 180.0, 360.0 - angles, angles)
+
+
+def compute_features(points):
+    """
+    Compute the feature vector used by the rep counters: every joint angle
+    followed by every span, in FEATURE_NAMES order.
+
+    Args:
+        points: Landmark coordinates of shape (33, 2+) or (..., 33, 2+)
+
+    Returns:
+        np.ndarray: Features of shape (..., len(FEATURE_NAMES))
+    """
+    points = np.asarray(points, dtype=np.float32)
+    spans = points[..., _SPAN_LEFT, 0] - points[..., _SPAN_RIGHT, 0]
+    return np.concatenate([compute_angles(points), spans], axis=-1)
@@ -0,0 +1,165 @@
+import os
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import mediapipe as mp
+from dotenv import load_dotenv
+
+from services.pose_angles import landmarks_to_array
+
+# Load environment variables
+load_dotenv()
+
+mp_pose = mp.solutions.pose
+
+# Pose pool configuration
+POSE_POOL_SIZE = int(os.getenv("POSE_POOL_SIZE", str(os.cpu_count() or 1)))
+# Estimators kept for concurrently active sessions (each holds its own MediaPipe graph)
+POSE_MAX_ESTIMATORS = int(os.getenv("POSE_MAX_ESTIMATORS", str(POSE_POOL_SIZE * 2)))
+POSE_MODEL_COMPLEXITY = int(os.getenv("POSE_MODEL_COMPLEXITY", "1"))
+POSE_MIN_DETECTION_CONFIDENCE = float(os.getenv("POSE_MIN_DETECTION_CONFIDENCE", "0.5"))
+POSE_MIN_TRACKING_CONFIDENCE = float(os.getenv("POSE_MIN_TRACKING_CONFIDENCE", "0.5"))
+
+
+def decode_frame(frame_bytes):
+    """Decode an encoded image (JPEG, PNG, ...) into an RGB array for MediaPipe."""
+    nparr = np.frombuffer(frame_bytes, np.uint8)
+    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError("Could not decode image")
+    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    image.flags.writeable = False
+    return image
+
+
+class PosePool:
+    """
+    Pool of long-lived MediaPipe Pose estimators, checked out one per active session.
+
+    MediaPipe keeps tracking state between frames, so an estimator only ever
+    serves one session at a time: a session checks one out on its first frame
+    and keeps it until the session ends (release()), which lets MediaPipe track
+    landmarks from that session's previous frame (min_tracking_confidence)
+    instead of running a cold detection on every frame. Released estimators are
+    reset before the next session uses them. When more than max_estimators
+    sessions are active, the least recently used session loses its estimator
+    to the new one and starts again from a cold detection on its next frame.
+
+    Each estimator is pinned to one of `size` single-thread executors, so its
+    graph is only ever used from one thread and decoding plus inference run off
+    the event loop.
+    """
+
+    def __init__(self, size=POSE_POOL_SIZE, max_estimators=POSE_MAX_ESTIMATORS,
+                 model_complexity=POSE_MODEL_COMPLEXITY,
+                 min_detection_confidence=POSE_MIN_DETECTION_CONFIDENCE,
+                 min_tracking_confidence=POSE_MIN_TRACKING_CONFIDENCE):
+        self.size = max(1, size)
+        self.max_estimators = max(self.size, max_estimators)
+        self.model_complexity = model_complexity
+        self.min_detection_confidence = min_detection_confidence
+        self.min_tracking_confidence = min_tracking_confidence
+        self._estimators = []  # index -> estimator, None until first used
+        self._executors = []
+        self._sessions = OrderedDict()  # session key -> estimator index, least recently used first
+        self._free = []  # indexes of estimators not checked out
+        self._needs_reset = set()  # indexes to reset before their next frame
+
+    @property
+    def started(self):
+        return bool(self._executors)
+
+    def _new_estimator(self):
+        return mp_pose.Pose(
+            static_image_mode=False,
+            model_complexity=self.model_complexity,
+            min_detection_confidence=self.min_detection_confidence,
+            min_tracking_confidence=self.min_tracking_confidence
+        )
+
+    def start(self):
+        """Create the worker threads and one estimator per thread; more are created as sessions need them."""
+        if self.started:
+            return
+        for slot in range(self.size):
+            self._estimators.append(self._new_estimator())
+            self._executors.append(ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"pose-{slot}"))
+        self._free = list(reversed(range(self.size)))
+        print(f"Started pose pool with {self.size} workers and up to {self.max_estimators} estimators")
+
+    def close(self):
+        """Shut down the worker threads and release the estimators."""
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+        for estimator in self._estimators:
+            if estimator is not None:
+                estimator.close()
+        self._estimators = []
+        self._executors = []
+        self._sessions.clear()
+        self._free = []
+        self._needs_reset.clear()
+
+    def checkout(self, session_key):
+        """Index of the session's estimator, checking one out on the session's first frame."""
+        index = self._sessions.get(session_key)
+        if index is not None:
+            self._sessions.move_to_end(session_key)
+            return index
+        if self._free:
+            index = self._free.pop()
+        elif len(self._estimators) < self.max_estimators:
+            index = len(self._estimators)
+            self._estimators.append(None)
+        else:
+            # Take over the estimator of the least recently used session
+            _, index = self._sessions.popitem(last=False)
+            self._needs_reset.add(index)
+        self._sessions[session_key] = index
+        return index
+
+    def release(self, session_key):
+        """Return a session's estimator to the pool when the session ends."""
+        index = self._sessions.pop(session_key, None)
+        if index is not None:
+            self._needs_reset.add(index)
+            self._free.append(index)
+
+    def _detect(self, index, reset, frame_bytes):
+        estimator = self._estimators[index]
+        if estimator is None:
+            estimator = self._estimators[index] = self._new_estimator()
+        elif reset:
+            estimator.reset()
+        results = estimator.process(decode_frame(frame_bytes))
+        if not results.pose_landmarks:
+            return None
+        return landmarks_to_array(results.pose_landmarks)
+
+    async def process(self, session_key, frame_bytes):
+        """
+        Decode a frame and run pose estimation on the session's estimator.
+
+        Args:
+            session_key: Identifier of the session the frame belongs to
+            frame_bytes: Encoded image bytes
+
+        Returns:
+            np.ndarray: (33, 3) landmark array, or None if no pose was detected
+        """
+        if not self.started:
+            self.start()
+        index = self.checkout(session_key)
+        reset = index in self._needs_reset
+        self._needs_reset.discard(index)
+        # An estimator always runs on the same thread, so a reset is queued
+        # behind any frame the previous session still has in flight
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executors[index % self.size], self._detect, index, reset, frame_bytes)
+
+
+# Create a singleton instance
+pose_pool = PosePool()
@@ -0,0 +1,353 @@
+import os
+import json
+import math
+import asyncio
+import operator
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.pose_angles import FEATURE_INDEX, compute_features
+
+# Load environment variables
+load_dotenv()
+
+# Exercise definitions configuration
+EXERCISE_DEFINITIONS_PATH = os.getenv(
+    "EXERCISE_DEFINITIONS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "exercises.json")
+)
+
+# Sessions stepped together below this size use the scalar path, which is faster for tiny batches
+MIN_VECTOR_BATCH = 8
+
+# Angle recorded into the session history when it cannot be computed
+MISSING_ANGLE = 180
+
+COMPARISONS = {
+    ">": (operator.gt, np.greater),
+    ">=": (operator.ge, np.greater_equal),
+    "<": (operator.lt, np.less),
+    "<=": (operator.le, np.less_equal),
+}
+ARITHMETIC = {
+    "+": operator.add,
+    "-": operator.sub,
+}
+
+# Session history lists fed by each history key of a definition
+HISTORY_ATTRIBUTES = {
+    "left": "left_angle",
+    "right": "right_angle",
+    "body": "body_angles",
+}
+
+
+class Rule:
+    """One compiled rule of an exercise state machine."""
+
+    __slots__ = ("conditions", "in_state", "if_flags", "chained", "set_state", "set_flags", "count", "feedback")
+
+    def __init__(self, conditions, in_state, if_flags, chained, set_state, set_flags, count, feedback):
+        self.conditions = conditions  # [(feature column, scalar op, vector op, threshold)]
+        self.in_state = in_state  # state index or None
+        self.if_flags = if_flags  # [(flag index, required value)]
+        self.chained = chained  # only evaluated if no earlier rule of the chain fired
+        self.set_state = set_state  # state index or None
+        self.set_flags = set_flags  # [(flag index, value)]
+        self.count = count
+        self.feedback = feedback  # feedback index or None
+
+
+class ExerciseDefinition:
+    """
+    An exercise compiled from its declarative definition.
+
+    Rules are evaluated in order on every frame, each one seeing the state left
+    by the rules before it, like a chain of if statements. A rule marked "elif"
+    is skipped when an earlier rule of the same chain fired. Conditions compare
+    features (joint angles, spans and derived values) with thresholds; gating
+    transitions on the current state with separate enter and exit thresholds
+    (e.g. Up above 170 degrees, Down below 140) gives each machine its hysteresis.
+    """
+
+    def __init__(self, data, states):
+        self.id = data["id"]
+        self.name = data["name"]
+        self.label = data.get("label", self.name)
+        self.display_name = data.get("display_name", self.name)
+        self.target_muscles = data.get("target_muscles", [])
+        self.initial_state = data.get("initial_state", "Up")
+        self.initial_flags = dict(data.get("flags", {}))
+        self.states = states
+        self.state_index = {name: position for position, name in enumerate(states)}
+
+        # Flags this exercise reads or writes; sessions share flag values across exercises by name
+        self.flags = list(self.initial_flags)
+        for rule in data["rules"]:
+            for flag in list(rule.get("if_flags", {})) + list(rule.get("then", {}).get("flags", {})):
+                if flag not in self.flags:
+                    self.flags.append(flag)
+
+        # Derived features are appended after the shared feature columns
+        self.feature_index = dict(FEATURE_INDEX)
+        self.derived = []
+        for name, (left, op, right) in data.get("derived", {}).items():
+            self.derived.append((self.feature_index[left], ARITHMETIC[op], self.feature_index[right]))
+            self.feature_index[name] = len(self.feature_index)
+
+        self.history_keys = [(key, HISTORY_ATTRIBUTES[key]) for key in data.get("history", {})]
+        self.history = [
+            (HISTORY_ATTRIBUTES[key], self.feature_index[feature]) for key, feature in data.get("history", {}).items()
+        ]
+
+        self.feedbacks = []
+        self.rules = [self._compile_rule(rule) for rule in data["rules"]]
+
+    def _feedback_index(self, text):
+        if text not in self.feedbacks:
+            self.feedbacks.append(text)
+        return self.feedbacks.index(text)
+
+    def _compile_rule(self, rule):
+        then = rule.get("then", {})
+        conditions = []
+        for feature, op, threshold in rule.get("when", []):
+            scalar_op, vector_op = COMPARISONS[op]
+            conditions.append((self.feature_index[feature], scalar_op, vector_op, float(threshold)))
+        return Rule(
+            conditions=conditions,
+            in_state=self.states.index(rule["in_state"]) if "in_state" in rule else None,
+            if_flags=[(self.flags.index(flag), bool(value)) for flag, value in rule.get("if_flags", {}).items()],
+            chained=bool(rule.get("elif")),
+            set_state=self.states.index(then["state"]) if "state" in then else None,
+            set_flags=[(self.flags.index(flag), bool(value)) for flag, value in then.get("flags", {}).items()],
+            count=bool(then.get("count")),
+            feedback=self._feedback_index(then["feedback"]) if "feedback" in then else None
+        )
+
+    def extend_features(self, features):
+        """Append derived feature columns to shared features of shape (..., F)."""
+        if not self.derived:
+            return features
+        extra = [op(features[..., left], features[..., right]) for left, op, right in self.derived]
+        return np.concatenate([features, np.stack(extra, axis=-1)], axis=-1)
+
+    def _load_machine(self, session):
+        state = self.state_index.get(session.state)
+        flags = [session.flags.get(flag, self.initial_flags.get(flag, False)) for flag in self.flags]
+        return state, flags
+
+    def _record_history(self, session, values, valid=True):
+        for attribute, column in self.history:
+            getattr(session, attribute).append(int(values[column]) if valid else MISSING_ANGLE)
+
+    def _record(self, session, state, flags, count, feedback):
+        if state is not None:
+            session.state = self.states[state]
+        for flag, value in zip(self.flags, flags):
+            session.flags[flag] = bool(value)
+        if count:
+            session.exercise_counters[self.id] = session.exercise_counters.get(self.id, 0) + count
+        if feedback is not None:
+            session.feedback = self.feedbacks[feedback]
+
+    def step(self, session, features):
+        """
+        Advance one session by one frame.
+
+        Args:
+            session: The session state to update
+            features: Feature vector of the frame (shared columns, without derived ones)
+        """
+        values = features.tolist()
+        for left, op, right in self.derived:
+            values.append(op(values[left], values[right]))
+
+        # A frame with unusable landmarks only records placeholder angles
+        if not all(map(math.isfinite, values)):
+            self._record_history(session, values, valid=False)
+            return
+        self._record_history(session, values)
+
+        state, flags = self._load_machine(session)
+        count = 0
+        feedback = None
+        chain_fired = False
+        for rule in self.rules:
+            if not rule.chained:
+                chain_fired = False
+            elif chain_fired:
+                continue
+            if rule.in_state is not None and rule.in_state != state:
+                continue
+            if any(flags[flag] != value for flag, value in rule.if_flags):
+                continue
+            if not all(op(values[column], threshold) for column, op, _, threshold in rule.conditions):
+                continue
+
+            chain_fired = True
+            if rule.set_state is not None:
+                state = rule.set_state
+            for flag, value in rule.set_flags:
+                flags[flag] = value
+            if rule.count:
+                count += 1
+            if rule.feedback is not None:
+                feedback = rule.feedback
+
+        self._record(session, state, flags, count, feedback)
+
+    def step_many(self, sessions, features):
+        """
+        Advance many sessions by one frame each in a single vectorized pass.
+
+        Args:
+            sessions: Session states, all doing this exercise
+            features: Array of shape (len(sessions), F) with each session's frame features
+        """
+        if len(sessions) < MIN_VECTOR_BATCH:
+            for session, row in zip(sessions, features):
+                self.step(session, row)
+            return
+
+        values = self.extend_features(np.asarray(features, dtype=np.float32))
+        machines = [self._load_machine(session) for session in sessions]
+        state = np.array([-1 if s is None else s for s, _ in machines], dtype=np.int16)
+        flags = np.array([f for _, f in machines], dtype=bool).reshape(len(sessions), len(self.flags))
+        count = np.zeros(len(sessions), dtype=np.int32)
+        feedback = np.full(len(sessions), -1, dtype=np.int16)
+        chain_fired = np.zeros(len(sessions), dtype=bool)
+
+        # Frames with unusable landmarks only record placeholder angles
+        valid = np.isfinite(values).all(axis=1)
+
+        for rule in self.rules:
+            if rule.chained:
+                mask = valid & ~chain_fired
+            else:
+                chain_fired[:] = False
+                mask = valid.copy()
+            if rule.in_state is not None:
+                mask &= state == rule.in_state
+            for flag, value in rule.if_flags:
+                mask &= flags[:, flag] == value
+            for column, _, op, threshold in rule.conditions:
+                mask &= op(values[:, column], threshold)
+
+            chain_fired |= mask
+            if rule.set_state is not None:
+                state[mask] = rule.set_state
+            for flag, value in rule.set_flags:
+                flags[mask, flag] = value
+            if rule.count:
+                count += mask
+            if rule.feedback is not None:
+                feedback[mask] = rule.feedback
+
+        # Convert results to Python values column by column, then write them back to the sessions
+        history = [
+            (attribute, np.where(valid, values[:, column], MISSING_ANGLE).astype(np.int64).tolist())
+            for attribute, column in self.history
+        ]
+        state, flags, count, feedback = state.tolist(), flags.tolist(), count.tolist(), feedback.tolist()
+        for i, session in enumerate(sessions):
+            for attribute, column in history:
+                getattr(session, attribute).append(column[i])
+            self._record(
+                session,
+                None if state[i] < 0 else state[i],
+                flags[i],
+                count[i],
+                None if feedback[i] < 0 else feedback[i]
+            )
+
+
+class ExerciseRegistry:
+    """All exercises known to the gym trainer, compiled from the definitions file."""
+
+    def __init__(self, path=EXERCISE_DEFINITIONS_PATH):
+        self.path = path
+        with open(path, encoding="utf-8") as f:
+            definitions = json.load(f)["exercises"]
+
+        # States share one vocabulary so sessions can switch exercises
+        states = []
+        for data in definitions:
+            for name in [data.get("initial_state", "Up")] + [
+                    value for rule in data["rules"]
+                    for value in (rule.get("in_state"), rule.get("then", {}).get("state")) if value]:
+                if name not in states:
+                    states.append(name)
+
+        self.exercises = {data["id"]: ExerciseDefinition(data, states) for data in definitions}
+
+    def get(self, exercise_id):
+        return self.exercises.get(exercise_id)
+
+    def __contains__(self, exercise_id):
+        return exercise_id in self.exercises
+
+    def __iter__(self):
+        return iter(sorted(self.exercises.values(), key=lambda exercise: exercise.id))
+
+
+class RepCounterBatcher:
+    """
+    Coalesces single frames from many sessions into batched state machine steps.
+
+    Frames submitted during one event loop iteration are flushed together on the
+    next one: their landmarks are turned into features in a single kernel call
+    and each exercise advances all of its sessions with one step_many().
+    """
+
+    def __init__(self):
+        self._pending = []
+        self.steps = 0
+        self.frames = 0
+
+    def submit(self, session, exercise, points):
+        """
+        Queue one frame of a session for the next batched step.
+
+        Args:
+            session: The session state to update
+            exercise: Compiled exercise definition
+            points: (33, 3) landmark array
+
+        Returns:
+            asyncio.Future: Resolved once the session has been stepped
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._pending:
+            loop.call_soon(self._flush)
+        self._pending.append((session, exercise, points, future))
+        return future
+
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        try:
+            features = compute_features(np.stack([points for _, _, points, _ in pending]))
+            by_exercise = {}
+            for position, (session, exercise, _, _) in enumerate(pending):
+                by_exercise.setdefault(exercise, []).append(position)
+            for exercise, positions in by_exercise.items():
+                exercise.step_many([pending[position][0] for position in positions], features[positions])
+            error = None
+        except Exception as e:
+            error = e
+
+        self.steps += 1
+        self.frames += len(pending)
+        for _, _, _, future in pending:
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(None)
+
+
+# Create a singleton instance
+exercise_registry = ExerciseRegistry()
@@ -0,0 +1,226 @@
+import os
+import asyncio
+import hashlib
+from dotenv import load_dotenv
+
+from database.cache import TTLCache
+from services.image_preprocessing import image_preprocessor
+
+# Load environment variables
+load_dotenv()
+
+# Report deduplication configuration
+REPORT_DEDUP_ENABLED = os.getenv("REPORT_DEDUP_ENABLED", "true").lower() == "true"
+# Largest difference hash distance (out of 256 bits) at which two uploads count as the same page
+REPORT_DEDUP_MAX_DISTANCE = int(os.getenv("REPORT_DEDUP_MAX_DISTANCE", "12"))
+REPORT_DEDUP_CACHE_TTL_SECONDS = float(os.getenv("REPORT_DEDUP_CACHE_TTL_SECONDS", "3600"))
+REPORT_DEDUP_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_DEDUP_CACHE_MAX_ENTRIES", "512"))
+
+# Bump when the analysis prompt changes so earlier analyses are not reused
+REPORT_ANALYSIS_VERSION = 1
+
+# A difference hash is split into this many bands for lookup. Two hashes within
+# PHASH_BANDS - 1 bits of each other share at least one band exactly, so
+# candidates come from an index match on any band and only they are compared.
+PHASH_BANDS = 16
+
+CANDIDATE_LIMIT = 50
+
+
+def content_hash(data):
+    """SHA-256 of the uploaded bytes as hex."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_bands(dhash):
+    """Index keys of a difference hash: each band prefixed by its position."""
+    width = len(dhash) // PHASH_BANDS
+    return [f"{band:x}:{dhash[band * width:(band + 1) * width]}" for band in range(PHASH_BANDS)]
+
+
+def hamming_distance(first, second):
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
+
+
+def report_fingerprint(sha256, dhash):
+    """Fields stored on a medical_reports document so later uploads can find it."""
+    fingerprint = {"content_sha256": sha256, "analysis_version": REPORT_ANALYSIS_VERSION}
+    if dhash:
+        fingerprint.update(dhash=dhash, phash_bands=hash_bands(dhash))
+    return fingerprint
+
+
+class ReportAnalysisCache:
+    """
+    Reuses analyses of report images uploaded before.
+
+    Only the user's own reports are reused: an upload with the same bytes
+    (SHA-256) as one of their earlier ones gets that analysis without being
+    decoded at all. Otherwise the upload is prepared for the model and its
+    difference hash compared with the user's earlier reports, so a re-photo
+    of the same page is matched too. Entries live in an in-process LRU keyed
+    by (user_id, content_sha256) in front of the medical_reports collection,
+    whose unique (content_sha256, user_id) index keeps one report per user and
+    image. Concurrent uploads of the same bytes by a user share a single model
+    call.
+    """
+
+    def __init__(self, enabled=REPORT_DEDUP_ENABLED, max_distance=REPORT_DEDUP_MAX_DISTANCE,
+                 ttl=REPORT_DEDUP_CACHE_TTL_SECONDS, max_entries=REPORT_DEDUP_CACHE_MAX_ENTRIES,
+                 preprocessor=image_preprocessor):
+        self.enabled = enabled
+        self.preprocessor = preprocessor
+        self.max_distance = min(max_distance, PHASH_BANDS - 1)
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)  # (user_id, sha256) -> entry
+        self._inflight = {}  # (user_id, sha256) -> future of the analysis in progress
+
+        # Counters exposed through get_metrics()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.computations = 0
+        self.coalesced = 0
+
+    async def _find_exact(self, db, user_id, sha256):
+        if db is None:
+            return None
+        try:
+            report = await db.medical_reports.find_one(
+                {"content_sha256": sha256, "user_id": user_id, "analysis_version": REPORT_ANALYSIS_VERSION},
+                {"analysis_result": 1, "dhash": 1}
+            )
+        except Exception as e:
+            print(f"Error looking up report by content hash: {e}")
+            return None
+        if report is None:
+            return None
+        return {
+            "analysis_result": report["analysis_result"],
+            "dhash": report.get("dhash"),
+            "report_id": str(report["_id"])
+        }
+
+    async def _find_similar(self, db, user_id, dhash):
+        if db is None or not user_id or not dhash:
+            return None, None
+        try:
+            candidates = await db.medical_reports.find(
+                {"user_id": user_id, "phash_bands": {"$in": hash_bands(dhash)},
+                 "analysis_version": REPORT_ANALYSIS_VERSION},
+                {"analysis_result": 1, "dhash": 1}
+            ).limit(CANDIDATE_LIMIT).to_list(length=CANDIDATE_LIMIT)
+        except Exception as e:
+            print(f"Error looking up similar reports: {e}")
+            return None, None
+        best, best_distance = None, None
+        for candidate in candidates:
+            distance = hamming_distance(dhash, candidate["dhash"])
+            if distance <= self.max_distance and (best is None or distance < best_distance):
+                best, best_distance = candidate, distance
+        if best is None:
+            return None, None
+        return {
+            "analysis_result": best["analysis_result"],
+            "dhash": best["dhash"],
+            "report_id": str(best["_id"])
+        }, best_distance
+
+    async def get_or_analyze(self, data, analyze, user_id=None, db=None, sha256=None):
+        """
+        Return the analysis of an earlier upload of the same report, or prepare
+        the image and analyze it.
+
+        Args:
+            data: Uploaded image bytes
+            analyze: Coroutine function taking the prepared image (see
+                     ImagePreprocessor.process()) and returning the analysis
+            user_id: The ID of the user whose earlier reports may be reused
+            db: Database holding medical_reports (optional)
+            sha256: content_hash() of data if already computed
+
+        Returns:
+            tuple: (analysis, details) where details has the content_sha256 and
+                   dhash of the upload, the prepared image if one was made, and
+                   for a reused analysis the match ("exact" or "similar"), the
+                   hash distance and the report_id if the user already has this report
+        """
+        sha256 = sha256 or content_hash(data)
+        key = (user_id, sha256)
+        if not self.enabled:
+            image = await self.preprocessor.process(data)
+            return await analyze(image), {"content_sha256": sha256, "dhash": image.get("dhash"), "image": image}
+
+        entry = self.memory.get(key)
+        if entry is None and key not in self._inflight:
+            entry = await self._find_exact(db, user_id, sha256)
+            if entry is not None:
+                self.memory.set(key, entry)
+        if entry is not None:
+            self.exact_hits += 1
+            return entry["analysis_result"], self._details(entry, sha256, "exact", 0)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            entry = await asyncio.shield(inflight)
+            return entry["analysis_result"], self._details(entry, sha256, "exact", 0)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            image = await self.preprocessor.process(data)
+            entry, distance = await self._find_similar(db, user_id, image.get("dhash"))
+            if entry is not None:
+                self.similar_hits += 1
+                match = "similar"
+            else:
+                self.computations += 1
+                entry = {"analysis_result": await analyze(image), "dhash": image.get("dhash"), "report_id": None}
+                match = None
+            self.memory.set(key, entry)
+            future.set_result(entry)
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError("Report analysis was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters see the error; nobody else needs to retrieve it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        details = self._details(entry, sha256, match, distance) if match else \
+            {"content_sha256": sha256, "dhash": image.get("dhash")}
+        return entry["analysis_result"], dict(details, image=image)
+
+    @staticmethod
+    def _details(entry, sha256, match, distance):
+        return {
+            "content_sha256": sha256,
+            "dhash": entry.get("dhash"),
+            "match": match,
+            "distance": distance,
+            "report_id": entry["report_id"]
+        }
+
+    def remember_report(self, sha256, user_id, report_id):
+        """Record the report a user's upload was saved as, so their repeat uploads point to it."""
+        entry = self.memory.get((user_id, sha256))
+        if entry is not None:
+            entry["report_id"] = report_id
+
+    def get_metrics(self):
+        return dict(
+            self.memory.get_metrics(),
+            enabled=self.enabled,
+            exact_hits=self.exact_hits,
+            similar_hits=self.similar_hits,
+            computations=self.computations,
+            coalesced=self.coalesced,
+            inflight=len(self._inflight)
+        )
+
+
+# Create a singleton instance
+report_analysis_cache = ReportAnalysisCache()
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import base64
+import binascii
+import datetime
+import numpy as np
+from dotenv import load_dotenv
+
+from services.steps_store import write_buckets
+
+# Load environment variables
+load_dotenv()
+
+# Steps ingestion configuration
+STEPS_INGEST_MAX_BYTES = int(os.getenv("STEPS_INGEST_MAX_BYTES", str(32 * 1024 * 1024)))
+STEPS_INGEST_BATCH_SIZE = int(os.getenv("STEPS_INGEST_BATCH_SIZE", "1000"))
+STEPS_INGEST_MAX_DAILY_STEPS = int(os.getenv("STEPS_INGEST_MAX_DAILY_STEPS", "200000"))
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+EARLIEST_DATE = np.datetime64("2000-01-01", "D")
+ERROR_LIMIT = 20
+
+
+class StepsColumns:
+    """Rows of (user_id, date, steps) as parallel arrays, plus the rows rejected while parsing."""
+
+    def __init__(self, user_ids, dates, steps, errors=None, received=None, rows=None):
+        self.user_ids = np.asarray(user_ids, dtype=str)
+        self.dates = dates
+        self.steps = steps
+        self.errors = errors or []  # (row, reason)
+        self.rows = np.arange(len(self.user_ids)) if rows is None else np.asarray(rows)  # row number in the payload
+        self.received = len(self.user_ids) + len(self.errors) if received is None else received
+
+
+def _parse_dates(values):
+    """ISO dates as datetime64[D]; unparseable entries become NaT."""
+    try:
+        return np.asarray(values, dtype="datetime64[D]")
+    except (ValueError, TypeError):
+        dates = np.empty(len(values), dtype="datetime64[D]")
+        for index, value in enumerate(values):
+            try:
+                dates[index] = np.datetime64(value, "D")
+            except (ValueError, TypeError):
+                dates[index] = np.datetime64("NaT")
+        return dates
+
+
+def parse_ndjson(body):
+    """
+    Parse one {"user_id", "date", "steps"} object per line.
+
+    Returns:
+        StepsColumns: The well-formed rows; malformed lines are listed in errors
+    """
+    user_ids, dates, steps, errors, row_numbers = [], [], [], [], []
+    rows = 0
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        rows += 1
+        try:
+            row = json.loads(line)
+            user_id, date, count = row["user_id"], row["date"], row["steps"]
+        except (ValueError, TypeError, KeyError):
+            errors.append((rows - 1, "expected a JSON object with user_id, date and steps"))
+            continue
+        if not isinstance(user_id, str) or not user_id or not isinstance(date, str) or \
+                not isinstance(count, int) or isinstance(count, bool):
+            errors.append((rows - 1, "user_id and date must be strings and steps an integer"))
+            continue
+        if not 0 <= count <= STEPS_INGEST_MAX_DAILY_STEPS:
+            # Checked here as well as in validate(): counts past int64 cannot be stored in the array
+            errors.append((rows - 1, f"steps must be between 0 and {STEPS_INGEST_MAX_DAILY_STEPS}"))
+            continue
+        user_ids.append(user_id)
+        dates.append(date)
+        steps.append(count)
+        row_numbers.append(rows - 1)
+    return StepsColumns(user_ids, _parse_dates(dates), np.fromiter(steps, dtype=np.int64, count=len(steps)),
+                        errors, rows, row_numbers)
+
+
+def _series_steps(series):
+    if "steps_int32" in series:
+        raw = base64.b64decode(series["steps_int32"], validate=True)
+        if len(raw) % 4:
+            raise ValueError("steps_int32 must hold whole little-endian int32 values")
+        return np.frombuffer(raw, dtype="<i4").astype(np.int64)
+    steps = np.asarray(series["steps"])
+    if steps.ndim != 1 or (steps.size and steps.dtype.kind not in "iu"):
+        raise ValueError("steps must be a list of integers")
+    return steps.astype(np.int64)
+
+
+def parse_columnar(payload):
+    """
+    Parse series of daily steps, one per user:
+
+        {"series": [
+            {"user_id": "u1", "start_date": "2025-01-01", "steps": [8123, 10412, ...]},
+            {"user_id": "u2", "dates": ["2025-01-01", ...], "steps_int32": "<base64 little-endian int32>"}
+        ]}
+
+    start_date gives consecutive days; dates gives one date per count.
+
+    Returns:
+        StepsColumns: The rows of the well-formed series; malformed series are listed in errors
+
+    Raises:
+        ValueError: If the payload has no series list
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get("series"), list):
+        raise ValueError('Expected {"series": [...]}')
+
+    user_ids, dates, steps, errors = [], [], [], []
+    received = 0
+    for index, series in enumerate(payload["series"]):
+        try:
+            user_id = series["user_id"]
+            if not isinstance(user_id, str) or not user_id:
+                raise ValueError("user_id must be a non-empty string")
+            counts = _series_steps(series)
+            if "dates" in series:
+                days = _parse_dates(series["dates"])
+                if len(days) != len(counts):
+                    raise ValueError("dates and steps must have the same length")
+            else:
+                days = np.datetime64(series["start_date"], "D") + np.arange(len(counts))
+        except (ValueError, TypeError, KeyError, binascii.Error) as e:
+            received += 1
+            errors.append((f"series {index}", str(e) if not isinstance(e, KeyError) else f"missing {e}"))
+            continue
+        received += len(counts)
+        user_ids.append(np.full(len(counts), user_id, dtype=object))
+        dates.append(days)
+        steps.append(counts)
+
+    if not steps:
+        return StepsColumns([], np.empty(0, dtype="datetime64[D]"), np.empty(0, dtype=np.int64), errors, received)
+    return StepsColumns(np.concatenate(user_ids), np.concatenate(dates), np.concatenate(steps), errors, received)
+
+
+def validate(columns, today=None):
+    """
+    Drop rows with an invalid date or step count and keep only the last row of each (user_id, date).
+
+    All checks run on whole arrays; only the reported errors are looked at row by row.
+
+    Returns:
+        tuple: ((user_ids, dates, steps) of the accepted rows, the first rejected
+               rows as (row, reason), number of rows rejected)
+    """
+    today = np.datetime64(today or datetime.datetime.utcnow().date(), "D")
+    dates, steps = columns.dates, columns.steps
+    known = ~np.isnat(dates)
+    valid = known & (dates >= EARLIEST_DATE) & (dates <= today) & \
+        (steps >= 0) & (steps <= STEPS_INGEST_MAX_DAILY_STEPS)
+
+    errors = list(columns.errors)
+    for row in np.flatnonzero(~valid)[:ERROR_LIMIT]:
+        if not known[row]:
+            reason = "date must be YYYY-MM-DD"
+        elif not EARLIEST_DATE <= dates[row] <= today:
+            reason = f"date must be between {EARLIEST_DATE} and {today}"
+        else:
+            reason = f"steps must be between 0 and {STEPS_INGEST_MAX_DAILY_STEPS}"
+        errors.append((int(columns.rows[row]), reason))
+    rejected = len(columns.errors) + int((~valid).sum())
+
+    user_ids, dates, steps = columns.user_ids[valid], dates[valid], steps[valid]
+
+    # Later rows for the same user and day win: find each key's last occurrence
+    _, users = np.unique(user_ids, return_inverse=True)
+    keys = (users.astype(np.int64) << 32) | (dates - EARLIEST_DATE).astype(np.int64)
+    _, last_in_reversed = np.unique(keys[::-1], return_index=True)
+    keep = np.sort(len(keys) - 1 - last_in_reversed)
+
+    return (user_ids[keep], dates[keep], steps[keep]), errors[:ERROR_LIMIT], rejected
+
+
+async def ingest_steps(db, columns, batch_size=STEPS_INGEST_BATCH_SIZE, now=None):
+    """
+    Validate parsed rows and upsert them into the daily steps store.
+
+    Writes go out as unordered bulk_write batches of batch_size upserts (see
+    write_buckets()), so one bad document does not stop the rest and the
+    server may apply each batch in parallel.
+
+    Args:
+        db: The database
+        columns: StepsColumns from parse_ndjson() or parse_columnar()
+        batch_size: Upserts per bulk_write
+        now: Current time (defaults to utcnow)
+
+    Returns:
+        dict: Rows received, accepted, rejected (with the first errors),
+              duplicates collapsed, buckets upserted, modified and failed,
+              and rollups updated
+    """
+    started = time.perf_counter()
+    now = now or datetime.datetime.utcnow()
+    (user_ids, dates, steps), errors, rejected = validate(columns, now.date())
+    accepted = len(steps)
+
+    totals = {"upserted": 0, "modified": 0, "failed": 0, "rollups": 0}
+    rows = list(zip(user_ids.tolist(), dates.astype("datetime64[us]").tolist(), steps.tolist()))
+    for start in range(0, accepted, batch_size):
+        written = await write_buckets(db, rows[start:start + batch_size], now, source="ingest")
+        for name in totals:
+            totals[name] += written[name]
+
+    return {
+        "received": columns.received,
+        "accepted": accepted,
+        "rejected": rejected,
+        "duplicates": columns.received - rejected - accepted,
+        "upserted": totals["upserted"],
+        "modified": totals["modified"],
+        "failed": totals["failed"],
+        "rollups": totals["rollups"],
+        "errors": [{"row": row, "error": reason} for row, reason in errors],
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
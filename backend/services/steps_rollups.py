@@ -0,0 +1,160 @@
+import os
+import datetime
+from collections import defaultdict
+from pymongo import UpdateOne, DESCENDING
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Steps rollup configuration
+STEPS_ROLLUPS_COLLECTION = "steps_rollups"
+STEP_GOALS = {
+    "day": int(os.getenv("STEP_GOAL_DAY", "10000")),
+    "week": int(os.getenv("STEP_GOAL_WEEK", "70000")),
+    "month": int(os.getenv("STEP_GOAL_MONTH", "300000")),
+}
+LEADERBOARD_MAX_SIZE = 100
+GOAL_QUERY_MAX_SIZE = 5000
+
+
+def period_keys(date):
+    """(period, key) of the day, ISO week and month a UTC day belongs to."""
+    year, week, _ = date.isocalendar()
+    return [
+        ("day", date.strftime("%Y-%m-%d")),
+        ("week", f"{year}-W{week:02d}"),
+        ("month", date.strftime("%Y-%m")),
+    ]
+
+
+def current_key(period, now=None):
+    """Key of the period containing `now` (defaults to utcnow)."""
+    return dict(period_keys(now or datetime.datetime.utcnow()))[period]
+
+
+async def apply_bucket_changes(db, changes, now=None):
+    """
+    Add the step changes of daily buckets to their day, week and month rollups.
+
+    Every changed bucket costs one $inc upsert per period, each an index
+    update on the rollup collection, whatever the number of buckets stored.
+
+    Args:
+        db: The database
+        changes: (user_id, date, old steps or None, new steps) of buckets written
+        now: Current time (defaults to utcnow)
+
+    Returns:
+        int: Rollup documents updated
+    """
+    now = now or datetime.datetime.utcnow()
+    deltas = defaultdict(int)
+    for user_id, date, old_steps, new_steps in changes:
+        delta = new_steps - (old_steps or 0)
+        if delta or old_steps is None:
+            for period, key in period_keys(date):
+                deltas[(user_id, period, key)] += delta
+    if not deltas:
+        return 0
+
+    await db[STEPS_ROLLUPS_COLLECTION].bulk_write([
+        UpdateOne(
+            {"user_id": user_id, "period": period, "key": key},
+            {"$inc": {"steps": delta}, "$set": {"updated_at": now}},
+            upsert=True
+        )
+        for (user_id, period, key), delta in deltas.items()
+    ], ordered=False)
+    return len(deltas)
+
+
+async def leaderboard(db, period, key=None, limit=10):
+    """
+    Users with the most steps in a period.
+
+    Args:
+        db: The database
+        period: day, week or month
+        key: Period key such as 2026-10-18, 2026-W42 or 2026-10 (defaults to the current one)
+        limit: Number of users
+
+    Returns:
+        list: {"rank", "user_id", "steps"} from the top down
+    """
+    key = key or current_key(period)
+    cursor = db[STEPS_ROLLUPS_COLLECTION].find(
+        {"period": period, "key": key}, {"_id": 0, "user_id": 1, "steps": 1}
+    ).sort([("steps", DESCENDING)]).limit(min(limit, LEADERBOARD_MAX_SIZE))
+    return [
+        {"rank": rank, "user_id": entry["user_id"], "steps": entry["steps"]}
+        for rank, entry in enumerate(await cursor.to_list(length=LEADERBOARD_MAX_SIZE), start=1)
+    ]
+
+
+async def goal_reached(db, period, key=None, goal=None, unrewarded_only=True, limit=GOAL_QUERY_MAX_SIZE):
+    """
+    Users at or over the step goal of a period, e.g. to find who is due a reward.
+
+    Args:
+        db: The database
+        period: day, week or month
+        key: Period key (defaults to the current one)
+        goal: Step goal (defaults to STEP_GOALS[period])
+        unrewarded_only: Leave out users already passed to mark_rewarded()
+        limit: Most users returned
+
+    Returns:
+        list: {"user_id", "steps"} from the most steps down
+    """
+    key = key or current_key(period)
+    query = {"period": period, "key": key, "steps": {"$gte": goal or STEP_GOALS[period]}}
+    if unrewarded_only:
+        query["rewarded_at"] = None
+    cursor = db[STEPS_ROLLUPS_COLLECTION].find(
+        query, {"_id": 0, "user_id": 1, "steps": 1}
+    ).sort([("steps", DESCENDING)]).limit(min(limit, GOAL_QUERY_MAX_SIZE))
+    return await cursor.to_list(length=GOAL_QUERY_MAX_SIZE)
+
+
+async def mark_rewarded(db, period, key, user_ids, now=None):
+    """
+    Record that users were rewarded for a period, so goal_reached() leaves them out.
+
+    Returns:
+        int: Rollups marked
+    """
+    result = await db[STEPS_ROLLUPS_COLLECTION].update_many(
+        {"period": period, "key": key, "user_id": {"$in": list(user_ids)}, "rewarded_at": None},
+        {"$set": {"rewarded_at": now or datetime.datetime.utcnow()}}
+    )
+    return result.modified_count
+
+
+async def rebuild_rollups(db, user_id=None):
+    """
+    Recompute the rollups from the daily buckets, e.g. for buckets stored before rollups existed.
+
+    The steps of each rollup are replaced with the total of its buckets; reward marks are kept.
+
+    Args:
+        db: The database
+        user_id: Only rebuild this user's rollups (optional)
+    """
+    # steps_store writes rollups through this module, so it is imported here
+    from services.steps_store import STEPS_DAILY_COLLECTION, PERIOD_FORMATS
+
+    match = {"user_id": user_id} if user_id else {}
+    for period, period_format in PERIOD_FORMATS.items():
+        await db[STEPS_DAILY_COLLECTION].aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {"user_id": "$user_id",
+                        "key": {"$dateToString": {"format": period_format, "date": "$date"}}},
+                "steps": {"$sum": "$steps"}
+            }},
+            {"$project": {"_id": 0, "user_id": "$_id.user_id", "period": {"$literal": period},
+                          "key": "$_id.key", "steps": 1, "updated_at": "$$NOW"}},
+            {"$merge": {"into": STEPS_ROLLUPS_COLLECTION, "on": ["user_id", "period", "key"],
+                        "whenMatched": "merge", "whenNotMatched": "insert"}},
+        ]).to_list(length=None)
@@ -0,0 +1,213 @@
+import os
+import asyncio
+import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+from services.steps_rollups import apply_bucket_changes
+
+# Load environment variables
+load_dotenv()
+
+# Steps store configuration
+STEPS_DAILY_COLLECTION = "steps_daily"
+# A day stops being re-fetched once it was synced this long after it ended, leaving
+# time for phones that upload their step counts late
+STEPS_FINAL_AFTER_HOURS = float(os.getenv("STEPS_FINAL_AFTER_HOURS", "3"))
+# Rounds of compare-and-set writes for buckets that another writer changed in between
+BUCKET_WRITE_ATTEMPTS = 3
+
+DAY = datetime.timedelta(days=1)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# $dateToString formats of the periods totals can be grouped by
+PERIOD_FORMATS = {
+    "day": "%Y-%m-%d",
+    "week": "%G-W%V",
+    "month": "%Y-%m",
+}
+
+
+def day_start(value):
+    """UTC midnight of a datetime or date."""
+    return datetime.datetime(value.year, value.month, value.day)
+
+
+def to_millis(value):
+    return int((value - EPOCH).total_seconds() * 1000)
+
+
+def from_millis(millis):
+    return EPOCH + datetime.timedelta(milliseconds=int(millis))
+
+
+def _runs(days):
+    """Group sorted days into runs of consecutive days, as (first day, last day)."""
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == DAY:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def bucket_update(user_id, date, steps, now, expected=None, source="google_fit"):
+    """
+    Upsert of one daily bucket, applied only while the bucket still holds
+    `expected` steps (None: does not exist yet). Otherwise the upsert collides
+    with the existing bucket on the unique (user_id, date) index and fails.
+    The day is final once `now` is STEPS_FINAL_AFTER_HOURS past its end.
+    """
+    final = date + DAY <= now - datetime.timedelta(hours=STEPS_FINAL_AFTER_HOURS)
+    return UpdateOne(
+        {"user_id": user_id, "date": date, "steps": expected},
+        {"$set": {"steps": steps, "synced_at": now, "final": final, "source": source}},
+        upsert=True
+    )
+
+
+async def _stored_steps(collection, rows):
+    dates = {}
+    for user_id, date, _ in rows:
+        dates.setdefault(user_id, set()).add(date)
+    stored = {}
+    async for bucket in collection.find(
+            {"$or": [{"user_id": user_id, "date": {"$in": list(days)}} for user_id, days in dates.items()]},
+            {"_id": 0, "user_id": 1, "date": 1, "steps": 1}
+    ):
+        stored[(bucket["user_id"], bucket["date"])] = bucket["steps"]
+    return stored
+
+
+async def write_buckets(db, rows, now=None, source="google_fit"):
+    """
+    Upsert daily buckets and add their changes to the steps rollups.
+
+    Each bucket is written only if it still holds the steps read just before
+    (compare-and-set), so when two writers update the same day only one
+    change lands and is added to the rollups; the other is read and written
+    again.
+
+    Args:
+        db: The database
+        rows: (user_id, UTC day start, steps) with at most one row per user and day
+        now: Current time (defaults to utcnow)
+        source: Where the counts came from (google_fit or ingest)
+
+    Returns:
+        dict: Buckets upserted, modified and failed, and rollups updated
+    """
+    now = now or datetime.datetime.utcnow()
+    collection = db[STEPS_DAILY_COLLECTION]
+    upserted = modified = rollups = 0
+    pending = list(rows)
+    for _ in range(BUCKET_WRITE_ATTEMPTS):
+        if not pending:
+            break
+        stored = await _stored_steps(collection, pending)
+        failed = set()
+        try:
+            result = await collection.bulk_write([
+                bucket_update(user_id, date, steps, now, stored.get((user_id, date)), source)
+                for user_id, date, steps in pending
+            ], ordered=False)
+            upserted += result.upserted_count
+            modified += result.modified_count
+        except BulkWriteError as e:
+            upserted += e.details.get("nUpserted", 0)
+            modified += e.details.get("nModified", 0)
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+
+        rollups += await apply_bucket_changes(db, [
+            (user_id, date, stored.get((user_id, date)), steps)
+            for index, (user_id, date, steps) in enumerate(pending) if index not in failed
+        ], now)
+        pending = [row for index, row in enumerate(pending) if index in failed]
+
+    return {"upserted": upserted, "modified": modified, "failed": len(pending), "rollups": rollups}
+
+
+async def sync_steps(db, user_id, start, end, fetch, now=None):
+    """
+    Bring the user's daily step buckets for a date range up to date.
+
+    Days already stored as final are not fetched again; the rest (days never
+    synced, days synced too soon after they ended, and today) are fetched with
+    one remote call per run of consecutive days and written with write_buckets().
+
+    Args:
+        db: The database
+        user_id: The ID of the user
+        start: First day of the range (datetime)
+        end: End of the range, usually now (datetime)
+        fetch: Coroutine function taking (start millis, end millis) and returning
+               a list of (UTC day start, steps) for the daily buckets in it
+        now: Current time (defaults to utcnow)
+
+    Returns:
+        dict: Days read from the store, days fetched and remote calls made
+    """
+    now = now or datetime.datetime.utcnow()
+    days = []
+    day = day_start(start)
+    while day < end:
+        days.append(day)
+        day += DAY
+    if not days:
+        return {"stored_days": 0, "fetched_days": 0, "remote_calls": 0}
+
+    final = set()
+    async for bucket in db[STEPS_DAILY_COLLECTION].find(
+            {"user_id": user_id, "date": {"$gte": days[0], "$lte": days[-1]}, "final": True},
+            {"date": 1, "_id": 0}
+    ):
+        final.add(bucket["date"])
+
+    runs = _runs([day for day in days if day not in final])
+    results = await asyncio.gather(*(
+        fetch(to_millis(first), to_millis(min(last + DAY, end))) for first, last in runs
+    ))
+
+    fetched = [(user_id, date, steps) for buckets in results for date, steps in buckets]
+    if fetched:
+        await write_buckets(db, fetched, now)
+
+    return {"stored_days": len(final), "fetched_days": len(fetched), "remote_calls": len(runs)}
+
+
+async def steps_totals(db, user_id, start, end, group_by="day"):
+    """
+    Total the stored daily steps of a user over a date range.
+
+    Args:
+        db: The database
+        user_id: The ID of the user
+        start: First day of the range (datetime)
+        end: Last day of the range, inclusive (datetime)
+        group_by: Period of the returned buckets (day, week or month)
+
+    Returns:
+        dict: total_steps, days with data, and per-period steps in date order
+    """
+    period_format = PERIOD_FORMATS[group_by]
+    pipeline = [
+        {"$match": {"user_id": user_id, "date": {"$gte": day_start(start), "$lte": day_start(end)}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": period_format, "date": "$date"}},
+            "steps": {"$sum": "$steps"},
+            "days": {"$sum": 1},
+            "first_day": {"$min": "$date"}
+        }},
+        {"$sort": {"first_day": 1}},
+    ]
+    periods = []
+    async for period in db[STEPS_DAILY_COLLECTION].aggregate(pipeline):
+        periods.append({"period": period["_id"], "steps": period["steps"], "days": period["days"]})
+
+    return {
+        "total_steps": sum(period["steps"] for period in periods),
+        "days": sum(period["days"] for period in periods),
+        "periods": periods
+    }
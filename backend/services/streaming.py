@@ -0,0 +1,147 @@
+import json
+import time
+from fastapi.responses import StreamingResponse
+
+from database.pagination import json_default
+
+
+class JSONFieldParser:
+    """
+    Incremental parser for a JSON object streamed in arbitrary pieces.
+
+    feed() returns the top-level fields whose values became complete, so a
+    client can show each part of a structured answer as soon as the model has
+    written it. Each character is scanned once.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._field_start = None
+
+    def feed(self, delta):
+        """
+        Add the next piece of the document.
+
+        Returns:
+            list: (name, value) pairs of the fields completed by this piece
+        """
+        self.text += delta
+        text = self.text
+        fields = []
+        for index in range(self._position, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._field_start = index + 1
+            elif char in "}]":
+                if self._depth == 1:
+                    self._complete_field(text[self._field_start:index], fields)
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                self._complete_field(text[self._field_start:index], fields)
+                self._field_start = index + 1
+        self._position = len(text)
+        return fields
+
+    @staticmethod
+    def _complete_field(segment, fields):
+        if segment.strip():
+            try:
+                fields.extend(json.loads("{" + segment + "}").items())
+            except ValueError:
+                pass
+
+    def result(self):
+        """Parse the whole document once the stream has ended."""
+        return json.loads(self.text)
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default, separators=(',', ':'))}\n\n"
+
+
+class StreamMetrics:
+    """Time to first event and total duration of the SSE endpoints, per endpoint."""
+
+    def __init__(self):
+        self._endpoints = {}
+
+    def record(self, endpoint, ttfb, total, failed=False):
+        stats = self._endpoints.setdefault(endpoint, {
+            "streams": 0, "errors": 0, "total_ttfb": 0.0, "max_ttfb": 0.0, "total_latency": 0.0
+        })
+        stats["streams"] += 1
+        stats["errors"] += int(failed)
+        stats["total_ttfb"] += ttfb
+        stats["max_ttfb"] = max(stats["max_ttfb"], ttfb)
+        stats["total_latency"] += total
+
+    def get_metrics(self):
+        return {
+            endpoint: {
+                "streams": stats["streams"],
+                "errors": stats["errors"],
+                "avg_ttfb_ms": round(stats["total_ttfb"] / stats["streams"] * 1000, 2),
+                "max_ttfb_ms": round(stats["max_ttfb"] * 1000, 2),
+                "avg_total_ms": round(stats["total_latency"] / stats["streams"] * 1000, 2)
+            }
+            for endpoint, stats in self._endpoints.items()
+        }
+
+
+async def _sse_body(events, endpoint, started):
+    first_event_at = None
+    failed = False
+    try:
+        async for event, data in events:
+            now = time.perf_counter()
+            if first_event_at is None:
+                first_event_at = now
+            if event == "done":
+                data = dict(data, timing={
+                    "ttfb_ms": round((first_event_at - started) * 1000, 2),
+                    "total_ms": round((now - started) * 1000, 2)
+                })
+            yield sse_event(event, data)
+    except Exception as e:
+        failed = True
+        print(f"Error streaming {endpoint}: {e}")
+        yield sse_event("error", {"status": "error", "message": str(e)})
+    finally:
+        finished = time.perf_counter()
+        stream_metrics.record(endpoint, (first_event_at or finished) - started, finished - started, failed)
+
+
+def sse_response(events, endpoint):
+    """
+    Stream (event, data) pairs to the client as server-sent events.
+
+    The "done" event gets a timing field with the time to the first event and
+    the total time, and both are recorded under `endpoint` in stream_metrics.
+    An exception ends the stream with an "error" event.
+    """
+    return StreamingResponse(
+        _sse_body(events, endpoint, time.perf_counter()),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Create a singleton instance
+stream_metrics = StreamMetrics()
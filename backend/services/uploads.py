@@ -0,0 +1,116 @@
+import io
+import os
+import hashlib
+from fastapi import HTTPException, Request
+from fastapi.routing import APIRoute
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Upload size configuration
+MAX_REPORT_UPLOAD_BYTES = int(os.getenv("MAX_REPORT_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_FRAME_UPLOAD_BYTES = int(os.getenv("MAX_FRAME_UPLOAD_BYTES", str(2 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Room for the multipart boundaries, headers and form fields around an uploaded file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+def _too_large(max_bytes):
+    return HTTPException(
+        status_code=413,
+        detail=f"Upload too large; the limit is {max_bytes} bytes"
+    )
+
+
+def max_body_size(max_bytes):
+    """
+    Limit the request body of an endpoint on a router using LimitedBodyRoute.
+
+    Place it below the route decorator:
+
+        @router.post("/upload")
+        @max_body_size(MAX_REPORT_UPLOAD_BYTES)
+        async def upload(...):
+    """
+    def decorator(endpoint):
+        endpoint.max_body_bytes = max_bytes
+        return endpoint
+    return decorator
+
+
+class LimitedBodyRoute(APIRoute):
+    """
+    Route that enforces the max_body_size() of its endpoint before the body is parsed.
+
+    A request whose Content-Length is over the limit is rejected with 413
+    before any of the body is read; one without a Content-Length (chunked) is
+    counted as it arrives and cut off as soon as it passes the limit.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        max_bytes = getattr(self.endpoint, "max_body_bytes", None)
+        if max_bytes is None:
+            return handler
+
+        async def limited_handler(request):
+            content_length = request.headers.get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                raise _too_large(max_bytes)
+
+            received = 0
+
+            async def receive():
+                nonlocal received
+                message = await request.receive()
+                if message["type"] == "http.request":
+                    received += len(message.get("body", b""))
+                    if received > max_bytes:
+                        raise _too_large(max_bytes)
+                return message
+
+            return await handler(Request(request.scope, receive))
+
+        return limited_handler
+
+
+async def read_upload(file, max_bytes, hash_content=True, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Read an uploaded file chunk by chunk, hashing it on the way.
+
+    The chunks are written to one buffer whose final value is returned without
+    another copy, so a request holds a single copy of the upload at most
+    max_bytes large.
+
+    Args:
+        file: FastAPI UploadFile
+        max_bytes: Largest accepted upload
+        hash_content: Compute the SHA-256 of the content
+        chunk_size: Bytes read at a time
+
+    Returns:
+        tuple: (content bytes, SHA-256 hex digest or None)
+
+    Raises:
+        HTTPException: 413 if the file is larger than max_bytes
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    buffer = io.BytesIO()
+    digest = hashlib.sha256() if hash_content else None
+    size = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large(max_bytes)
+        if digest:
+            digest.update(chunk)
+        buffer.write(chunk)
+    return buffer.getvalue(), digest.hexdigest() if digest else None
+